@@ -2,11 +2,19 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 import os
+import importlib
+import sqlite3
 from dotenv import load_dotenv
+from app.uploads import UploadRequest
+from app.json_provider import ORJSONProvider
 import logging
 
-# Disable ChromaDB telemetry to avoid errors
+# Disable ChromaDB telemetry to avoid errors. Set here, before anything in the app imports
+# chromadb; the service also passes Settings(anonymized_telemetry=False) to its client
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
 os.environ["CHROMA_TELEMETRY_DISABLED"] = "True"
 os.environ["POSTHOG_DISABLED"] = "True"
@@ -22,14 +30,84 @@ db = SQLAlchemy()
 login_manager = LoginManager()
 csrf = CSRFProtect()
 
+# SQLite settings applied to every new connection: WAL lets readers run alongside the
+# writer and synchronous=NORMAL drops the per-commit fsync (still durable with WAL)
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+    "cache_size=-64000",
+)
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+# Blueprints as (module, attribute) pairs so route modules are only imported inside create_app
+BLUEPRINTS = [
+    ('app.routes.auth', 'auth_bp'),
+    ('app.routes.main', 'main_bp'),
+    ('app.routes.notes', 'notes_bp'),
+    ('app.routes.subjects', 'subjects_bp'),
+    ('app.routes.chatbot', 'chatbot_bp'),
+    ('app.routes.profile', 'profile'),
+]
+
+def _engine_options(database_uri):
+    """Connection pool settings so connections are reused across requests"""
+    if database_uri.startswith('sqlite'):
+        if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+            return {}  # Flask-SQLAlchemy pins in-memory databases to a StaticPool
+        return {
+            'poolclass': QueuePool,
+            'connect_args': {'check_same_thread': False}
+        }
+    # Sized for request threads (or greenlets) plus the background job workers
+    return {
+        'pool_size': 6,
+        'max_overflow': 20,
+        'pool_pre_ping': True
+    }
+
+def _patch_psycopg_for_gevent():
+    """
+    When the app is served by gevent workers (e.g. gunicorn -k gevent), make psycopg2
+    yield to other greenlets while it waits on Postgres. A no-op without gevent or psycogreen.
+    """
+    try:
+        from gevent import monkey
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        return
+    if monkey.is_module_patched('socket'):
+        patch_psycopg()
+
 def create_app():
     app = Flask(__name__)
+    # Spool uploaded files into the upload folder so saving them is a rename
+    app.request_class = UploadRequest
+    # Serialize JSON responses with orjson when it is installed
+    app.json = ORJSONProvider(app)
     
     # Configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///notes_app.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres'):
+        _patch_psycopg_for_gevent()
     app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['UPLOAD_FOLDER_ABS'] = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    # Let the front-end server send upload bodies: Apache mod_xsendfile (X-Sendfile)
+    # or an nginx internal location mapped to the upload folder (X-Accel-Redirect)
+    app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'False').lower() == 'true'
+    app.config['X_ACCEL_REDIRECT_PREFIX'] = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
     # Disable CSRF for development - enable in production
     app.config['WTF_CSRF_ENABLED'] = False
@@ -42,22 +120,21 @@ def create_app():
     csrf.init_app(app)
     
     # Register blueprints
-    from app.routes.auth import auth_bp
-    from app.routes.main import main_bp
-    from app.routes.notes import notes_bp
-    from app.routes.subjects import subjects_bp
-    from app.routes.chatbot import chatbot_bp
-    from app.routes.profile import profile
-    
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(main_bp)
-    app.register_blueprint(notes_bp)
-    app.register_blueprint(subjects_bp)
-    app.register_blueprint(chatbot_bp)
-    app.register_blueprint(profile)
+    for module_name, blueprint_name in BLUEPRINTS:
+        module = importlib.import_module(module_name)
+        app.register_blueprint(getattr(module, blueprint_name))
     
     # Create database tables
     with app.app_context():
         db.create_all()
+        
+        from app.models import ensure_note_search_index
+        with db.engine.begin() as connection:
+            ensure_note_search_index(connection)
+    
+    # Load llama3 in the background so the first upload does not wait for it
+    if os.environ.get('INKLING_OLLAMA_WARM_UP', 'True').lower() == 'true':
+        from app.services.ai_classification import classification_service
+        classification_service.warm_up()
     
     return app
@@ -2,6 +2,11 @@ from app import db
 from flask_login import UserMixin
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import insert, select, func, text, false, literal_column
+import hashlib
+
+# scrypt is memory-hard and about twice as fast per check as Werkzeug 2.3's 600k-round PBKDF2 default
+PASSWORD_HASH_METHOD = 'scrypt'
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -9,23 +14,40 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     profile_image = db.Column(db.String(255), nullable=True)  # File path
-    profile_image_data = db.Column(db.LargeBinary, nullable=True)  # Binary data
-    profile_image_mimetype = db.Column(db.String(100), nullable=True)  # MIME type
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     subjects = db.relationship('Subject', backref='user', lazy=True, cascade='all, delete-orphan')
     notes = db.relationship('Note', backref='user', lazy=True, cascade='all, delete-orphan')
+    # Image bytes live in their own table so loading a user never pulls the BLOB
+    image = db.relationship('UserProfileImage', uselist=False, lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD, salt_length=16)
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    def password_needs_rehash(self):
+        return not self.password_hash.startswith(f'{PASSWORD_HASH_METHOD}:')
+    
     def __repr__(self):
         return f'<User {self.username}>'
 
+class UserProfileImage(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # The bytes and their MIME type load together, and only when accessed
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False), group='content')  # Binary data
+    mimetype = db.deferred(db.Column(db.String(100), nullable=True), group='content')  # MIME type
+    etag = db.Column(db.String(32), nullable=True)  # Content hash for conditional requests
+    
+    @staticmethod
+    def compute_etag(data):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+    
+    def __repr__(self):
+        return f'<UserProfileImage {self.user_id}>'
+
 class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -38,6 +60,13 @@ class Subject(db.Model):
     # Relationships
     notes = db.relationship('Note', backref='subject', lazy=True, cascade='all, delete-orphan')
     
+    # Subject names are unique per user; the routes rely on this instead of checking first.
+    # The unique index also serves (user_id, name) lookups; the listing is per user by creation date.
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'name', name='uq_subject_user_name'),
+        db.Index('ix_subject_user_created_at', 'user_id', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<Subject {self.name}>'
 
@@ -46,6 +75,7 @@ class Note(db.Model):
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     original_image_path = db.Column(db.String(255))
+    image_sha256 = db.Column(db.String(64))  # Digest of the source image, for skipping re-uploads
     extracted_text = db.Column(db.Text)
     confidence_score = db.Column(db.Float)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -57,6 +87,13 @@ class Note(db.Model):
     embedding_id = db.Column(db.String(100))  # ChromaDB document ID
     is_embedded = db.Column(db.Boolean, default=False)
     
+    # Both listing orders (all notes / one subject) read rows in updated_at order straight from an index
+    __table_args__ = (
+        db.Index('ix_note_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_note_user_subject_updated', 'user_id', 'subject_id', 'updated_at'),
+        db.Index('ix_note_user_image_sha256', 'user_id', 'image_sha256'),
+    )
+    
     def __repr__(self):
         return f'<Note {self.title}>'
 
@@ -68,18 +105,144 @@ class Chat(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    messages = db.relationship('ChatMessage', backref='chat', lazy=True, cascade='all, delete-orphan')
+    # Dynamic so callers get an ordered query; messages are removed with one bulk DELETE
+    # (delete_chat / ON DELETE CASCADE) instead of being loaded and deleted row by row
+    messages = db.relationship('ChatMessage', backref='chat', lazy='dynamic',
+                               order_by='(ChatMessage.created_at, ChatMessage.id)', passive_deletes=True)
+    
+    __table_args__ = (
+        db.Index('ix_chat_user_updated', 'user_id', 'updated_at'),
+    )
     
     def __repr__(self):
         return f'<Chat {self.title}>'
 
 class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), nullable=False)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id', ondelete='CASCADE'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     is_user = db.Column(db.Boolean, nullable=False)  # True for user messages, False for AI responses
-    sources = db.Column(db.Text)  # JSON string of source note IDs
+    sources = db.Column(db.JSON(none_as_null=True))  # List of source note IDs
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_msg_chat_created', 'chat_id', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<ChatMessage {self.id}>'
+
+class BackgroundJob(db.Model):
+    # Kept in the database rather than in the process that runs the job, so any app
+    # worker can answer a status poll
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(16), nullable=False)  # queued, running, finished or failed
+    result = db.Column(db.JSON(none_as_null=True))  # JSON body the job returned
+    status_code = db.Column(db.Integer)
+    worker = db.Column(db.String(255))  # Process running the job
+    heartbeat_at = db.Column(db.DateTime)  # Last time that process reported it was alive
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<BackgroundJob {self.id}>'
+
+def bulk_insert(model, rows, return_objects=False):
+    """
+    Insert many rows with a single executemany INSERT instead of per-object flushes
+    
+    Args:
+        model: Model class to insert into
+        rows (List[Dict]): Column values, one dict per row (all with the same keys)
+        return_objects (bool): Return the inserted rows as ORM objects (IDs populated)
+        
+    Returns:
+        List: Inserted objects when return_objects is set, otherwise an empty list
+    """
+    if not rows:
+        return []
+    
+    if not return_objects:
+        db.session.execute(insert(model), rows)
+        return []
+    
+    if db.session.get_bind().dialect.insert_executemany_returning:
+        return db.session.scalars(insert(model).returning(model), rows).all()
+    
+    # Older SQLite without multi-row RETURNING: fall back to the unit of work
+    objects = [model(**row) for row in rows]
+    db.session.add_all(objects)
+    db.session.flush()
+    return objects
+
+# Full-text index over note titles and content: an external-content FTS5 table kept in sync by
+# triggers on SQLite, an expression GIN index on PostgreSQL. Other backends fall back to LIKE.
+SQLITE_NOTE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE note_fts USING fts5(title, content, content='note', content_rowid='id')",
+    """CREATE TRIGGER note_fts_ai AFTER INSERT ON note BEGIN
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER note_fts_ad AFTER DELETE ON note BEGIN
+        INSERT INTO note_fts(note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER note_fts_au AFTER UPDATE OF title, content ON note BEGIN
+        INSERT INTO note_fts(note_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO note_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    # Index the notes that existed before the table was created
+    "INSERT INTO note_fts(note_fts) VALUES ('rebuild')",
+)
+
+POSTGRES_NOTE_TSV_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_note_tsv ON note "
+    "USING gin (to_tsvector('english', title || ' ' || content))"
+)
+
+def ensure_note_search_index(connection):
+    """
+    Create the full-text index for notes if the database does not have it yet
+    
+    Args:
+        connection: SQLAlchemy connection inside a transaction
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'note_fts'")
+        ).first()
+        if not exists:
+            for statement in SQLITE_NOTE_FTS_DDL:
+                connection.execute(text(statement))
+    elif dialect == 'postgresql':
+        connection.execute(text(POSTGRES_NOTE_TSV_DDL))
+
+def _fts5_query(query_text):
+    """Quote every word so user input is never parsed as FTS5 syntax; each word also matches as a prefix"""
+    terms = [term.replace('"', '""') for term in query_text.split()]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def note_search_filter(query_text):
+    """
+    Filter expression matching notes whose title or content contain the query words
+    
+    Args:
+        query_text (str): Search text typed by the user
+        
+    Returns:
+        SQL expression usable in Note.query.filter()
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        match_query = _fts5_query(query_text)
+        if not match_query:
+            return false()
+        return Note.id.in_(
+            select(literal_column('rowid'))
+            .select_from(text('note_fts'))
+            .where(text('note_fts MATCH :fts_query').bindparams(fts_query=match_query))
+        )
+    if dialect == 'postgresql':
+        document = func.to_tsvector('english', Note.title + ' ' + Note.content)
+        return document.op('@@')(func.plainto_tsquery('english', query_text))
+    return Note.title.contains(query_text) | Note.content.contains(query_text)
@@ -1,19 +1,78 @@
-from flask import Blueprint, request, jsonify, render_template, current_app
+from flask import Blueprint, request, jsonify, render_template, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
-from app.services.rag_chatbot import RAGChatbotService
-from app.models import Chat, ChatMessage, Note
+from app.models import Chat, ChatMessage, Note, Subject
 from app import db
-import json
+from app.services.chat_history_writer import ChatHistoryWriter, ChatHistoryWriteError
+from sqlalchemy import select, func
+from sqlalchemy.orm import load_only, joinedload
+from concurrent.futures import ThreadPoolExecutor
+import functools
 
 chatbot_bp = Blueprint('chatbot', __name__)
 
-# Initialize chatbot service
-chatbot_service = RAGChatbotService()
+# Writes chat messages off the request thread
+chat_history_writer = ChatHistoryWriter()
+
+# Worker pool for page-load work that can overlap with the request's own queries
+_executor = ThreadPoolExecutor(max_workers=4)
+
+@functools.lru_cache(maxsize=1)
+def get_chatbot_service():
+    """Create the chatbot service on first use so importing this module stays cheap"""
+    from app.services.rag_chatbot import RAGChatbotService
+    return RAGChatbotService()
+
+def get_suggestions_for(user_id):
+    """Suggested questions for a user, cached with their subjects until the subjects change"""
+    return get_chatbot_service().get_suggested_questions(user_id)
+
+def _note_detail_query():
+    """Note query limited to the columns the detail views render, with the subject joined in"""
+    return Note.query.options(
+        load_only(Note.id, Note.title, Note.content, Note.original_image_path, Note.confidence_score,
+                  Note.subject_id, Note.created_at, Note.updated_at),
+        joinedload(Note.subject).load_only(Subject.name)
+    )
+
+def _run_in_app_context(app, func, *args):
+    """Run func in a worker thread with its own app context (and database session)"""
+    with app.app_context():
+        return func(*args)
+
+def _sse(event, payload):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {current_app.json.dumps(payload)}\n\n"
+
+def _record_exchange(chat, question, result):
+    """Save a question and its answer to chat and add the chat's ID and title to result"""
+    # A new chat is committed right away because the client needs its ID
+    if chat.id is None:
+        db.session.add(chat)
+        db.session.commit()
+    
+    # Persist the exchange in the background so the answer does not wait on the write
+    chat_history_writer.enqueue(current_app._get_current_object(), chat.id, [
+        {'content': question, 'is_user': True, 'sources': None},
+        {'content': result['answer'], 'is_user': False,
+         'sources': [src['note_id'] for src in result.get('sources', [])]}
+    ])
+    
+    # Add chat info to result
+    result['chat_id'] = chat.id
+    result['chat_title'] = chat.title
 
 @chatbot_bp.route('/chatbot')
 @login_required
 def chatbot_interface():
     """Render the chatbot interface with three-panel layout"""
+    # Build suggestions in the background while the panel queries run
+    suggestions_future = _executor.submit(
+        _run_in_app_context,
+        current_app._get_current_object(),
+        get_suggestions_for,
+        current_user.id
+    )
+    
     # Get user's chats
     chats = Chat.query.filter_by(user_id=current_user.id).order_by(Chat.updated_at.desc()).all()
     
@@ -21,12 +80,12 @@ def chatbot_interface():
     current_chat_id = request.args.get('chat_id', type=int)
     current_chat = None
     if current_chat_id:
-        current_chat = Chat.query.filter_by(id=current_chat_id, user_id=current_user.id).first()
+        current_chat = next((chat for chat in chats if chat.id == current_chat_id), None)
     
     # Get recent notes for image viewer
     recent_notes = Note.query.filter_by(user_id=current_user.id).order_by(Note.updated_at.desc()).limit(10).all()
     
-    suggestions = chatbot_service.get_suggested_questions(current_user.id)
+    suggestions = suggestions_future.result()
     return render_template('chatbot/interface.html', 
                          suggestions=suggestions,
                          chats=chats, 
@@ -41,15 +100,18 @@ def new_chat():
         data = request.get_json()
         title = data.get('title', 'New Chat Session')
         
-        # Create new chat
+        # Create new chat; the ID is known after the flush, so the response
+        # does not need to reload the expired row after commit
         chat = Chat(user_id=current_user.id, title=title)
         db.session.add(chat)
+        db.session.flush()
+        chat_id = chat.id
         db.session.commit()
         
         return jsonify({
             'success': True,
-            'chat_id': chat.id,
-            'title': chat.title
+            'chat_id': chat_id,
+            'title': title
         })
         
     except Exception as e:
@@ -61,15 +123,22 @@ def new_chat():
 def delete_chat(chat_id):
     """Delete a specific chat"""
     try:
+        # Write the chat's queued messages first so they are deleted along with it
+        chat_history_writer.flush(chat_id)
+        
         chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
+        ChatMessage.query.filter_by(chat_id=chat.id).delete(synchronize_session=False)
         db.session.delete(chat)
         db.session.commit()
         
         return jsonify({'success': True})
         
+    except ChatHistoryWriteError as e:
+        current_app.logger.error(f"Delete chat error: {str(e)}")
+        return jsonify({'success': False, 'error': 'Messages of this chat are still being saved, please try again'}), 503
     except Exception as e:
         current_app.logger.error(f"Delete chat error: {str(e)}")
         return jsonify({'success': False, 'error': 'Failed to delete chat'}), 500
@@ -97,44 +166,16 @@ def ask_question():
         
         if not chat:
             # Create new chat with AI-generated title
-            title = chatbot_service.generate_chat_title(question)
+            title = get_chatbot_service().generate_chat_title(question, current_user.id)
             chat = Chat(user_id=current_user.id, title=title)
-            db.session.add(chat)
-            db.session.flush()  # Get the ID
-        
-        # Save user message
-        user_message = ChatMessage(
-            chat_id=chat.id,
-            content=question,
-            is_user=True
-        )
-        db.session.add(user_message)
         
-        # Get answer from RAG service
-        result = chatbot_service.search_and_answer(
+        # Get answer from RAG service before touching the session
+        result = get_chatbot_service().search_and_answer(
             question=question,
             user_id=current_user.id
         )
         
-        # Save AI response
-        ai_message = ChatMessage(
-            chat_id=chat.id,
-            content=result['answer'],
-            is_user=False,
-            sources=json.dumps([src['note_id'] for src in result.get('sources', [])])
-        )
-        db.session.add(ai_message)
-        
-        # Update chat timestamp
-        chat.updated_at = db.func.now()
-        
-        db.session.commit()
-        
-        # Add chat info to result
-        result['chat_id'] = chat.id
-        result['chat_title'] = chat.title
-        result['message_id'] = ai_message.id
-        
+        _record_exchange(chat, question, result)
         return jsonify(result)
         
     except Exception as e:
@@ -142,42 +183,121 @@ def ask_question():
         db.session.rollback()
         return jsonify({'error': 'Failed to process question'}), 500
 
+@chatbot_bp.route('/chatbot/ask/stream', methods=['POST'])
+@login_required
+def ask_question_stream():
+    """
+    Handle chatbot questions, streaming the answer as server-sent events: a
+    "token" event per generated piece, then one "done" event with the same
+    JSON /chatbot/ask returns (or an "error" event)
+    """
+    data = request.get_json()
+    
+    if not data or 'question' not in data:
+        return jsonify({'error': 'Question is required'}), 400
+    
+    question = data['question'].strip()
+    chat_id = data.get('chat_id')
+    
+    if not question:
+        return jsonify({'error': 'Question cannot be empty'}), 400
+    
+    user_id = current_user.id
+    
+    def generate():
+        try:
+            result = None
+            for kind, value in get_chatbot_service().search_and_answer_stream(question=question, user_id=user_id):
+                if kind == 'token':
+                    yield _sse('token', {'text': value})
+                else:
+                    result = value
+            
+            # The chat (and a new chat's title) is only needed once the answer is out
+            chat = None
+            if chat_id:
+                chat = Chat.query.filter_by(id=chat_id, user_id=user_id).first()
+            if not chat:
+                chat = Chat(user_id=user_id, title=get_chatbot_service().generate_chat_title(question, user_id))
+            
+            _record_exchange(chat, question, result)
+            yield _sse('done', result)
+            
+        except Exception as e:
+            current_app.logger.error(f"Chatbot stream error: {str(e)}")
+            db.session.rollback()
+            yield _sse('error', {'error': 'Failed to process question'})
+    
+    # X-Accel-Buffering stops nginx from holding the events back until the answer is complete
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @chatbot_bp.route('/chatbot/chat/<int:chat_id>/messages')
 @login_required
 def get_chat_messages(chat_id):
     """Get messages for a specific chat"""
     try:
-        chat = Chat.query.filter_by(id=chat_id, user_id=current_user.id).first()
-        if not chat:
+        # Include this chat's exchanges that are still queued for writing
+        chat_history_writer.flush(chat_id)
+        
+        # The chat's title and its messages in one statement; the outer join still returns
+        # a row (with no message) for a chat that has no messages yet
+        rows = db.session.execute(
+            select(Chat.title, ChatMessage)
+            .outerjoin(ChatMessage, ChatMessage.chat_id == Chat.id)
+            .where(Chat.id == chat_id, Chat.user_id == current_user.id)
+            .order_by(ChatMessage.created_at, ChatMessage.id)
+        ).all()
+        if not rows:
             return jsonify({'error': 'Chat not found'}), 404
         
+        chat_title = rows[0].title
+        chat_messages = [row.ChatMessage for row in rows if row.ChatMessage is not None]
+        
+        # Resolve the sources of every AI message with a single query
+        source_ids_by_message = {
+            message.id: message.sources
+            for message in chat_messages
+            if message.sources and not message.is_user
+        }
+        all_source_ids = {note_id for ids in source_ids_by_message.values() for note_id in ids}
+        notes_by_id = {}
+        if all_source_ids:
+            # Only pull the first 151 characters of each note: enough to build and flag the excerpt
+            rows = db.session.execute(
+                select(Note.id, Note.title, func.substr(Note.content, 1, 151).label('excerpt'))
+                .where(Note.id.in_(all_source_ids))
+            ).all()
+            notes_by_id = {row.id: row for row in rows}
+        
         messages = []
-        for message in chat.messages:
-            message_data = {
+        for message in chat_messages:
+            source_notes = [notes_by_id[note_id] for note_id in source_ids_by_message.get(message.id, [])
+                            if note_id in notes_by_id]
+            messages.append({
                 'id': message.id,
                 'content': message.content,
                 'is_user': message.is_user,
                 'created_at': message.created_at.isoformat(),
-                'sources': []
-            }
-            
-            if message.sources and not message.is_user:
-                source_ids = json.loads(message.sources)
-                sources = Note.query.filter(Note.id.in_(source_ids)).all()
-                message_data['sources'] = [{
+                'sources': [{
                     'note_id': note.id,
                     'title': note.title,
-                    'excerpt': note.content[:150] + '...' if len(note.content) > 150 else note.content
-                } for note in sources]
-            
-            messages.append(message_data)
+                    'excerpt': note.excerpt[:150] + '...' if len(note.excerpt) > 150 else note.excerpt
+                } for note in source_notes]
+            })
         
         return jsonify({
             'success': True,
             'messages': messages,
-            'chat_title': chat.title
+            'chat_title': chat_title
         })
         
+    except ChatHistoryWriteError as e:
+        current_app.logger.error(f"Get messages error: {str(e)}")
+        return jsonify({'error': 'Some messages of this chat could not be saved yet, please try again'}), 503
     except Exception as e:
         current_app.logger.error(f"Get messages error: {str(e)}")
         return jsonify({'error': 'Failed to get messages'}), 500
@@ -187,7 +307,7 @@ def get_chat_messages(chat_id):
 def get_note_details(note_id):
     """Get detailed information about a specific note"""
     try:
-        note = Note.query.filter_by(id=note_id, user_id=current_user.id).first()
+        note = _note_detail_query().filter_by(id=note_id, user_id=current_user.id).first()
         if not note:
             return jsonify({'error': 'Note not found'}), 404
         
@@ -219,7 +339,7 @@ def notes_viewer():
 def view_note_popup(note_id):
     """View a specific note in a popup window"""
     try:
-        note = Note.query.filter_by(id=note_id, user_id=current_user.id).first()
+        note = _note_detail_query().filter_by(id=note_id, user_id=current_user.id).first()
         if not note:
             return "Note not found", 404
         
@@ -233,5 +353,5 @@ def view_note_popup(note_id):
 @login_required
 def get_suggestions():
     """Get suggested questions"""
-    suggestions = chatbot_service.get_suggested_questions(current_user.id)
+    suggestions = get_suggestions_for(current_user.id)
     return jsonify({'suggestions': suggestions})
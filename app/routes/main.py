@@ -1,7 +1,13 @@
-from flask import Blueprint, render_template, redirect, url_for, send_from_directory, current_app, abort
+from flask import Blueprint, render_template, redirect, url_for, send_from_directory, current_app, abort, Response
 from flask_login import login_required, current_user
+from app import db
 from app.models import Note, Subject
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload, raiseload
 import os
+import logging
+import mimetypes
+import posixpath
 
 main_bp = Blueprint('main', __name__)
 
@@ -14,17 +20,18 @@ def index():
 @main_bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Get recent notes
-    recent_notes = Note.query.filter_by(user_id=current_user.id)\
+    # Get recent notes with their subjects; nothing else may lazy-load while rendering
+    recent_notes = Note.query.options(joinedload(Note.subject), raiseload('*'))\
+                            .filter_by(user_id=current_user.id)\
                             .order_by(Note.updated_at.desc())\
                             .limit(5)\
                             .all()
     
-    # Get subjects count
-    subjects_count = Subject.query.filter_by(user_id=current_user.id).count()
-    
-    # Get total notes count
-    notes_count = Note.query.filter_by(user_id=current_user.id).count()
+    # Get subjects and notes counts in one statement
+    subjects_count, notes_count = db.session.execute(select(
+        select(func.count(Subject.id)).where(Subject.user_id == current_user.id).scalar_subquery(),
+        select(func.count(Note.id)).where(Note.user_id == current_user.id).scalar_subquery()
+    )).one()
     
     return render_template('main/dashboard.html', 
                          recent_notes=recent_notes,
@@ -35,45 +42,34 @@ def dashboard():
 @login_required
 def uploaded_file(filename):
     """Serve uploaded files securely"""
-    import logging
-    import os
-    
-    logging.info(f"Requested file: {filename}")
-    logging.info(f"Current working directory: {os.getcwd()}")
-    logging.info(f"Current user: {current_user.id}")
+    # Collapse any ".." segments so the prefix check sees the real target
+    filename = posixpath.normpath(filename)
     
     # Security check: ensure the file belongs to the current user
-    user_path = str(current_user.id)
-    is_user_file = filename.startswith(user_path + '/')
-    is_user_profile = filename.startswith(f'profiles/profile_{current_user.id}_')
+    # (their upload folder or their profile images)
+    allowed_prefixes = (f'{current_user.id}/', f'profiles/profile_{current_user.id}_')
     
-    logging.info(f"User path: {user_path}")
-    logging.info(f"Is user file: {is_user_file}")
-    logging.info(f"Is user profile: {is_user_profile}")
-    
-    if not (is_user_file or is_user_profile):
+    if not filename.startswith(allowed_prefixes):
         logging.warning(f"Access denied for file: {filename} by user: {current_user.id}")
         abort(403)  # Forbidden if trying to access another user's files
     
-    upload_directory = current_app.config['UPLOAD_FOLDER']
-    
-    # Ensure absolute path for upload directory
-    if not os.path.isabs(upload_directory):
-        upload_directory = os.path.join(os.getcwd(), upload_directory)
-    
-    full_path = os.path.join(upload_directory, filename)
-    
-    logging.info(f"Upload directory: {upload_directory}")
-    logging.info(f"Looking for file at: {full_path}")
-    logging.info(f"File exists: {os.path.exists(full_path)}")
-    
-    # Check if file exists
-    if not os.path.exists(full_path):
-        logging.error(f"File not found: {full_path}")
-        abort(404)
+    accel_prefix = current_app.config.get('X_ACCEL_REDIRECT_PREFIX')
+    if accel_prefix:
+        # nginx serves the file from its internal location; no bytes pass through Python
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+        response.cache_control.private = True
+        response.cache_control.max_age = 3600
+        return response
     
-    # Use the absolute upload directory and the relative filename
-    return send_from_directory(upload_directory, filename)
+    # With USE_X_SENDFILE enabled, send_from_directory emits an X-Sendfile header instead of the body.
+    # send_from_directory 404s on missing files and answers If-None-Match /
+    # If-Modified-Since with 304 so cached images are not re-sent
+    response = send_from_directory(current_app.config['UPLOAD_FOLDER_ABS'], filename, conditional=True, max_age=3600)
+    # Uploads are per-user, so only the browser (not shared proxies) may cache them
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
 @main_bp.route('/debug/note/<int:note_id>')
 @login_required
@@ -1,11 +1,15 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, session
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from app.models import Note, Subject
+from sqlalchemy import case, tuple_
+from sqlalchemy.orm import joinedload
+from app.models import Note, Subject, bulk_insert, note_search_filter
+from app.uploads import move_upload, ensure_dir, remove_file, upload_sha256
 from app import db
 from app.services.text_extraction import TextExtractionService
-from app.services.ai_classification import SubjectClassificationService
+from app.services.ai_classification import classification_service
 from app.services.vector_embeddings import VectorEmbeddingService
+from app.services.background_jobs import BackgroundJobQueue
 import os
 import logging
 from datetime import datetime
@@ -16,37 +20,42 @@ notes_bp = Blueprint('notes', __name__)
 
 # Initialize services
 text_extraction_service = TextExtractionService()
-classification_service = SubjectClassificationService()
 vector_service = VectorEmbeddingService()
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
+# Runs image processing for uploads off the request thread
+upload_jobs = BackgroundJobQueue()
+
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'})
+
+def file_extension(filename):
+    """Lower-cased extension of a filename, or '' when it has none"""
+    _, dot, extension = filename.rpartition('.')
+    return extension.lower() if dot else ''
 
 def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return file_extension(filename) in ALLOWED_EXTENSIONS
 
 def save_uploaded_file(file, user_id, subject_name=None):
     """Save uploaded file with organized naming convention"""
     if file and allowed_file(file.filename):
-        # Create secure filename
-        original_filename = secure_filename(file.filename)
-        file_extension = original_filename.rsplit('.', 1)[1].lower()
+        # The extension is one of ALLOWED_EXTENSIONS, so it is already safe to reuse
+        extension = file_extension(file.filename)
         
         # Create organized filename: user_id/subject/date_uuid.ext
         date_str = datetime.now().strftime('%Y%m%d')
         unique_id = str(uuid.uuid4())[:8]
-        filename = f"{date_str}_{unique_id}.{file_extension}"
+        filename = f"{date_str}_{unique_id}.{extension}"
         
         # Create directory structure
         upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], str(user_id))
         if subject_name:
             upload_dir = os.path.join(upload_dir, secure_filename(subject_name))
         
-        os.makedirs(upload_dir, exist_ok=True)
+        ensure_dir(upload_dir)
         
-        # Save file
+        # Save file (moves the spooled upload into place)
         file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
+        move_upload(file, file_path)
         
         # Return both full path and relative path
         relative_path = os.path.relpath(file_path, current_app.config['UPLOAD_FOLDER'])
@@ -60,13 +69,17 @@ def list_notes():
     subject_id = request.args.get('subject_id', type=int)
     search_query = request.args.get('q', '')
     
-    # Base query
-    query = Note.query.filter_by(user_id=current_user.id)
+    flash_finished_upload_jobs()
+    
+    # Base query; the subject is joined in because every row renders its name
+    query = Note.query.options(joinedload(Note.subject)).filter_by(user_id=current_user.id)
     
     # Apply filters
     if subject_id:
         query = query.filter_by(subject_id=subject_id)
     
+    # id breaks ties between notes saved in the same instant so pages never overlap
+    order_by = (Note.updated_at.desc(), Note.id.desc())
     if search_query:
         # Use vector search if available, otherwise fall back to SQL search
         if vector_service.enabled:
@@ -75,21 +88,20 @@ def list_notes():
                 user_id=current_user.id,
                 n_results=50
             )
-            note_ids = [result['note_id'] for result in search_results]
+            note_ids = list(dict.fromkeys(result['note_id'] for result in search_results))
             if note_ids:
                 query = query.filter(Note.id.in_(note_ids))
+                # Keep the relevance ranking from the vector search across pages
+                order_by = (case({note_id: rank for rank, note_id in enumerate(note_ids)}, value=Note.id),)
             else:
                 # No semantic matches found
                 query = query.filter(False)  # Return empty result
         else:
             # Fallback to SQL text search
-            query = query.filter(
-                Note.title.contains(search_query) | 
-                Note.content.contains(search_query)
-            )
+            query = query.filter(note_search_filter(search_query))
     
     # Pagination
-    notes = query.order_by(Note.updated_at.desc()).paginate(
+    notes = query.order_by(*order_by).paginate(
         page=page, per_page=10, error_out=False
     )
     
@@ -115,185 +127,307 @@ def create_note():
         # Get user subjects for classification
         user_subjects = Subject.query.filter_by(user_id=current_user.id).all()
         subject_names = [s.name for s in user_subjects]
+        subject_id_by_name = {s.name: s.id for s in user_subjects}
+        subject_descriptions = {s.name: s.description for s in user_subjects if s.description}
         
         if not subject_names:
             flash('Please create at least one subject before uploading notes', 'error')
             return redirect(url_for('subjects.list_subjects'))
         
+        # An image this user already uploaded is not processed again
+        image_sha256 = upload_sha256(image_file)
+        existing_note = Note.query.filter_by(user_id=current_user.id, image_sha256=image_sha256)\
+                                  .order_by(Note.id).first()
+        if existing_note:
+            flash('This image was already uploaded, here is the note created from it', 'info')
+            return redirect(url_for('notes.view_note', note_id=existing_note.id))
+        
         # Save uploaded image first (without subject folder since we don't know yet)
-        result = save_uploaded_file(image_file, current_user.id)
+        full_path, relative_path = save_uploaded_file(image_file, current_user.id)
         
-        if not result:
+        if not full_path:
             flash('Failed to upload image', 'error')
             return render_template('notes/create.html', subjects=get_user_subjects())
         
-        full_path, relative_path = result
+        # OCR, classification and embedding take seconds, so they run in the background;
+        # the outcome is flashed on the notes list once the job has finished
+        job_id = upload_jobs.submit(
+            current_app._get_current_object(),
+            current_user.id,
+            create_notes_from_upload,
+            full_path, relative_path, image_sha256, subject_id_by_name, current_user.id, subject_descriptions
+        )
+        session['upload_jobs'] = session.get('upload_jobs', []) + [job_id]
         
-        # Extract and clean text from image
-        extracted_text, confidence_score = text_extraction_service.extract_text_from_image(full_path)
+        flash('Your image is being processed, the new notes will appear here shortly', 'info')
+        return redirect(url_for('notes.list_notes'))
+    
+    return render_template('notes/create.html', subjects=get_user_subjects())
+
+def create_notes_from_upload(full_path, relative_path, image_sha256, subject_id_by_name, user_id,
+                             subject_descriptions=None):
+    """
+    Extract text from an image uploaded through the note form, classify it and
+    create the resulting notes
+    
+    Args:
+        full_path (str): Absolute path of the saved image
+        relative_path (str): Path stored on the notes
+        image_sha256 (str): Digest of the image
+        subject_id_by_name (Dict[str, int]): The user's subjects
+        user_id (int): Owner of the notes
+        subject_descriptions (Dict[str, str]): Descriptions of the subjects that have one
+        
+    Returns:
+        Tuple[Dict, int]: Result body and HTTP status code
+    """
+    # Extract and clean text from image
+    extracted_text, confidence_score = text_extraction_service.extract_text_from_image(full_path)
+    
+    if not extracted_text or extracted_text.startswith('Error') or extracted_text == "No text found in image":
+        # Clean up uploaded file
+        remove_file(full_path)
+        return {'error': 'No text could be extracted from the image'}, 400
+    
+    # Use multi-subject classification to create multiple notes if needed
+    if classification_service.enabled:
+        classification_results = classification_service.classify_multi_subject_text(
+            extracted_text, list(subject_id_by_name), subject_descriptions
+        )
+        logging.info(f"Classification results count: {len(classification_results)}")
+        for i, result in enumerate(classification_results):
+            logging.info(f"Result {i+1}: Subject={result['subject']}, Title={result['title']}")
+    else:
+        logging.warning("Classification service not enabled, creating single note")
+        # Fallback: create single note with General subject
+        classification_results = [{
+            'subject': 'General',
+            'title': f"{datetime.now().strftime('%A, %B %d, %Y')} - Notes",
+            'content': extracted_text
+        }]
+    
+    # Build a row for each classification result
+    note_rows = []
+    for result in classification_results:
+        note_rows.append({
+            'title': result['title'],
+            'content': result['content'],
+            'extracted_text': extracted_text,  # Keep original extracted text
+            'confidence_score': confidence_score,
+            'original_image_path': relative_path,  # Same image for all notes
+            'image_sha256': image_sha256,
+            'user_id': user_id,
+            'subject_id': subject_id_by_name.get(result['subject'])
+        })
+    
+    # Insert the notes, embed them in one batch and commit once
+    try:
+        notes = bulk_insert(Note, note_rows, return_objects=True)
         
-        if not extracted_text or extracted_text.startswith('Error') or extracted_text == "No text found in image":
-            flash('No text could be extracted from the image', 'error')
-            # Clean up uploaded file
-            import os
-            if os.path.exists(full_path):
-                os.remove(full_path)
-            return render_template('notes/create.html', subjects=get_user_subjects())
+        vector_success = vector_service.add_notes_embeddings([{
+            'note_id': note.id,
+            'title': note.title,
+            'content': note.content,
+            'subject_name': result['subject'],
+            'user_id': user_id,
+            'created_at': note.created_at.strftime('%b %d, %Y')
+        } for note, result in zip(notes, classification_results)])
         
-        # Use multi-subject classification to create multiple notes if needed
-        if classification_service.enabled:
-            classification_results = classification_service.classify_multi_subject_text(
-                extracted_text, subject_names
-            )
-            logging.info(f"Classification results count: {len(classification_results)}")
-            for i, result in enumerate(classification_results):
-                logging.info(f"Result {i+1}: Subject={result['subject']}, Title={result['title']}")
-        else:
-            logging.warning("Classification service not enabled, creating single note")
-            # Fallback: create single note with General subject
-            from datetime import datetime
-            classification_results = [{
-                'subject': 'General',
-                'title': f"{datetime.now().strftime('%A, %B %d, %Y')} - Notes",
-                'content': extracted_text
-            }]
+        if vector_success:
+            for note in notes:
+                note.is_embedded = True
         
-        created_notes = []
+        db.session.commit()
         
-        # Create notes for each classification result
-        for i, result in enumerate(classification_results):
-            subject_name = result['subject']
-            
-            # Find subject ID
-            subject_id = None
-            subject = next((s for s in user_subjects if s.name == subject_name), None)
-            if subject:
-                subject_id = subject.id
-            
-            # All notes should reference the same original image
-            note_image_path = relative_path
-            
-            # Create note
-            note = Note(
-                title=result['title'],
-                content=result['content'],
-                extracted_text=extracted_text,  # Keep original extracted text
-                confidence_score=confidence_score,
-                original_image_path=note_image_path,  # Same image for all notes
-                user_id=current_user.id,
-                subject_id=subject_id
-            )
-            
-            try:
-                db.session.add(note)
-                db.session.commit()
-                
-                # Add to vector database
-                vector_success = vector_service.add_note_embeddings(
-                    note.id, note.title, note.content, subject_name, current_user.id, 
-                    note.created_at.strftime('%b %d, %Y')
-                )
-                
-                if vector_success:
-                    note.is_embedded = True
-                    db.session.commit()
-                
-                created_notes.append(note)
-                
-            except Exception as e:
-                db.session.rollback()
-                flash(f'Failed to create note: {result["title"]}', 'error')
-        
-        if created_notes:
-            if len(created_notes) == 1:
-                flash('Note created successfully!', 'success')
-                return redirect(url_for('notes.view_note', note_id=created_notes[0].id))
-            else:
-                flash(f'{len(created_notes)} notes created successfully!', 'success')
-                return redirect(url_for('notes.list_notes'))
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error creating notes: {e}")
+        return {'error': 'Failed to create notes. Please try again.'}, 500
+    
+    if not notes:
+        return {'error': 'Failed to create notes. Please try again.'}, 500
+    
+    message = 'Note created successfully!' if len(notes) == 1 else f'{len(notes)} notes created successfully!'
+    return {
+        'success': True,
+        'message': message,
+        'notes': [note.id for note in notes]
+    }, 200
+
+def flash_finished_upload_jobs():
+    """Flash the outcome of this session's note form uploads that have finished"""
+    if 'upload_jobs' not in session:
+        return
+    
+    pending = []
+    for job_id in session['upload_jobs']:
+        job = upload_jobs.get(job_id, current_user.id)
+        if not job:
+            # Deleted after the retention period, or the database was reset
+            flash('The status of an earlier upload is unknown. Check your notes and upload it again if it is missing.', 'warning')
+            continue
+        if job['status'] in ('queued', 'running'):
+            pending.append(job_id)
+        elif job['status'] == 'finished':
+            flash(job['result']['message'], 'success')
         else:
-            flash('Failed to create notes. Please try again.', 'error')
+            flash(job['result'].get('error', 'Failed to create notes. Please try again.'), 'error')
     
-    return render_template('notes/create.html', subjects=get_user_subjects())
+    if pending:
+        session['upload_jobs'] = pending
+    else:
+        session.pop('upload_jobs')
 
 @notes_bp.route('/notes/auto-process', methods=['POST'])
 @login_required
 def auto_process_image():
-    """Automatically process an image to extract text and create notes"""
-    if 'image' not in request.files:
+    """Save uploaded images and queue a job that extracts their text and creates notes"""
+    # Accept a single 'image' field or several 'images'
+    image_files = request.files.getlist('images') or request.files.getlist('image')
+    if not image_files:
         return jsonify({'error': 'No image file provided'}), 400
     
-    image_file = request.files['image']
-    if not image_file.filename:
+    if not all(image_file.filename for image_file in image_files):
         return jsonify({'error': 'No image file selected'}), 400
     
-    if not allowed_file(image_file.filename):
+    if not all(allowed_file(image_file.filename) for image_file in image_files):
         return jsonify({'error': 'Invalid file type. Please upload an image.'}), 400
     
     try:
-        # Save uploaded image
-        result = save_uploaded_file(image_file, current_user.id)
+        # Images this user already uploaded are answered with their existing notes instead
+        # of being processed again
+        digests = [upload_sha256(image_file) for image_file in image_files]
+        existing_notes = Note.query.filter(
+            Note.user_id == current_user.id,
+            Note.image_sha256.in_(digests)
+        ).order_by(Note.id).all()
+        known_digests = {note.image_sha256 for note in existing_notes}
+        duplicates = [{
+            'id': note.id,
+            'title': note.title,
+            'content': note.content,
+            'subject_id': note.subject_id
+        } for note in existing_notes]
         
-        if not result:
-            return jsonify({'error': 'Failed to save uploaded file'}), 500
+        new_images = [(image_file, digest) for image_file, digest in zip(image_files, digests)
+                      if digest not in known_digests]
+        if not new_images:
+            return jsonify({
+                'success': True,
+                'message': 'These images were already uploaded',
+                'notes': duplicates,
+                'duplicates': duplicates
+            })
         
-        full_path, relative_path = result
+        # Save uploaded images; OCR, classification and embedding run in the background
+        uploads = []
+        for image_file, digest in new_images:
+            full_path, relative_path = save_uploaded_file(image_file, current_user.id)
+            if not full_path:
+                return jsonify({'error': 'Failed to save uploaded file'}), 500
+            uploads.append((full_path, relative_path, digest))
+        
+        job_id = upload_jobs.submit(
+            current_app._get_current_object(),
+            current_user.id,
+            process_uploaded_images,
+            uploads, current_user.id
+        )
         
-        # Extract text from image
-        extracted_text, confidence_score = text_extraction_service.extract_text_from_image(full_path)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('notes.api_job_status', job_id=job_id),
+            'duplicates': duplicates
+        }), 202
         
-        if not extracted_text.strip():
-            return jsonify({'error': 'No text could be extracted from the image'}), 400
+    except Exception as e:
+        logging.error(f"Error in auto-process: {e}")
+        return jsonify({'error': f'Failed to process image: {str(e)}'}), 500
+
+def process_uploaded_images(uploads, user_id):
+    """
+    Extract text from saved uploads, classify it and create the resulting notes
+    
+    Args:
+        uploads (List[tuple]): (full_path, relative_path, sha256) of each saved image
+        user_id (int): Owner of the notes
+        
+    Returns:
+        Tuple[Dict, int]: Response body and HTTP status code
+    """
+    try:
+        # Extract text from every image in one batched pass
+        extractions = text_extraction_service.extract_text_from_images([upload[0] for upload in uploads])
+        
+        if not any(extracted_text.strip() for extracted_text, _ in extractions):
+            return {'error': 'No text could be extracted from the image'}, 400
         
         if not classification_service.enabled:
-            return jsonify({'error': 'AI classification service not available'}), 503
+            return {'error': 'AI classification service not available'}, 503
         
         # Get user subjects
-        user_subjects = Subject.query.filter_by(user_id=current_user.id).all()
+        user_subjects = Subject.query.filter_by(user_id=user_id).all()
         subject_names = [s.name for s in user_subjects]
+        subject_id_by_name = {s.name: s.id for s in user_subjects}
+        subject_descriptions = {s.name: s.description for s in user_subjects if s.description}
         
         if not subject_names:
-            return jsonify({'error': 'No subjects found. Please create at least one subject first.'}), 400
+            return {'error': 'No subjects found. Please create at least one subject first.'}, 400
         
-        # Use multi-subject classification
-        classified_notes = classification_service.classify_multi_subject_text(
-            extracted_text, subject_names
-        )
+        # Build all note rows first so they are inserted with a single statement
+        note_rows = []
+        classified_notes = []
+        images = []
+        for (full_path, relative_path, image_sha256), (extracted_text, confidence_score) in zip(uploads, extractions):
+            images.append({
+                'image_path': relative_path,
+                'extracted_text': extracted_text,
+                'confidence_score': confidence_score
+            })
+            if not extracted_text.strip():
+                continue
+            
+            # Use multi-subject classification
+            image_notes = classification_service.classify_multi_subject_text(
+                extracted_text, subject_names, subject_descriptions
+            )
+            
+            for i, note_data in enumerate(image_notes or []):
+                # Find the subject
+                note_subject_id = None
+                if note_data['subject'] != "General":
+                    note_subject_id = subject_id_by_name.get(note_data['subject'])
+                
+                note_rows.append({
+                    'title': note_data['title'],
+                    'content': note_data['content'],
+                    'extracted_text': extracted_text if len(image_notes) == 1 else note_data['content'],
+                    'confidence_score': confidence_score,
+                    'original_image_path': relative_path if i == 0 else None,  # Only attach image to first note
+                    'image_sha256': image_sha256,
+                    'user_id': user_id,
+                    'subject_id': note_subject_id
+                })
+                classified_notes.append(note_data)
         
         if not classified_notes:
-            return jsonify({'error': 'Failed to classify the extracted text'}), 500
+            return {'error': 'Failed to classify the extracted text'}, 500
+        
+        notes = bulk_insert(Note, note_rows, return_objects=True)
+        
+        # Embed every new note in one batched call
+        vector_success = vector_service.add_notes_embeddings([{
+            'note_id': note.id,
+            'title': note.title,
+            'content': note.content,
+            'subject_name': note_data['subject'] if note_data['subject'] != "General" else '',
+            'user_id': user_id
+        } for note, note_data in zip(notes, classified_notes)])
         
         created_notes = []
         
-        # Create notes for each classified subject
-        for i, note_data in enumerate(classified_notes):
-            # Find the subject
-            note_subject_id = None
-            if note_data['subject'] != "General":
-                subject_obj = next((s for s in user_subjects if s.name == note_data['subject']), None)
-                if subject_obj:
-                    note_subject_id = subject_obj.id
-            
-            # Create the note
-            note = Note(
-                title=note_data['title'],
-                content=note_data['content'],
-                extracted_text=extracted_text if len(classified_notes) == 1 else note_data['content'],
-                confidence_score=confidence_score,
-                original_image_path=relative_path if i == 0 else None,  # Only attach image to first note
-                user_id=current_user.id,
-                subject_id=note_subject_id
-            )
-            
-            db.session.add(note)
-            db.session.flush()  # Get the note ID
-            
-            # Add to vector database
-            subject_name_for_vector = note_data['subject'] if note_data['subject'] != "General" else ''
-            vector_success = vector_service.add_note_embeddings(
-                note.id, note.title, note.content, subject_name_for_vector, current_user.id
-            )
-            
+        for note, note_data in zip(notes, classified_notes):
             if vector_success:
                 note.is_embedded = True
             
@@ -302,23 +436,38 @@ def auto_process_image():
                 'title': note.title,
                 'content': note.content,
                 'subject': note_data['subject'],
-                'subject_id': note_subject_id
+                'subject_id': note.subject_id
             })
         
         db.session.commit()
         
-        return jsonify({
+        return {
             'success': True,
-            'message': f'Successfully created {len(created_notes)} notes from the image',
+            'message': f'Successfully created {len(created_notes)} notes from {len(uploads)} image(s)',
             'notes': created_notes,
-            'extracted_text': extracted_text,
-            'confidence_score': confidence_score
-        })
+            'extracted_text': images[0]['extracted_text'],
+            'confidence_score': images[0]['confidence_score'],
+            'images': images
+        }, 200
         
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error in auto-process: {e}")
-        return jsonify({'error': f'Failed to process image: {str(e)}'}), 500
+        return {'error': f'Failed to process image: {str(e)}'}, 500
+
+@notes_bp.route('/notes/api/job/<job_id>')
+@login_required
+def api_job_status(job_id):
+    """Status of a background upload job, with its result once finished"""
+    job = upload_jobs.get(job_id, current_user.id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'result': job['result']
+    })
 
 @notes_bp.route('/notes/<int:note_id>')
 @login_required
@@ -338,11 +487,12 @@ def view_note(note_id):
         )
         if similar_results:
             similar_note_ids = [r['note_id'] for r in similar_results]
-            similar_notes_query = Note.query.filter(Note.id.in_(similar_note_ids)).all()
+            notes_by_id = {n.id: n for n in Note.query.options(joinedload(Note.subject))
+                                                  .filter(Note.id.in_(similar_note_ids)).all()}
             # Combine with relevance scores
             similar_notes = []
             for result in similar_results:
-                note_obj = next((n for n in similar_notes_query if n.id == result['note_id']), None)
+                note_obj = notes_by_id.get(result['note_id'])
                 if note_obj:
                     similar_notes.append({
                         'note': note_obj,
@@ -411,11 +561,11 @@ def delete_note(note_id):
     
     try:
         # Remove from vector database
-        vector_service.remove_note_embeddings(note_id)
+        vector_service.remove_note_embeddings(note_id, current_user.id)
         
         # Delete image file if exists
-        if note.original_image_path and os.path.exists(note.original_image_path):
-            os.remove(note.original_image_path)
+        if note.original_image_path:
+            remove_file(note.original_image_path)
         
         # Delete note from database
         db.session.delete(note)
@@ -459,10 +609,11 @@ def api_search():
         # Get full note objects
         if search_results:
             note_ids = [r['note_id'] for r in search_results]
-            notes = Note.query.filter(Note.id.in_(note_ids)).all()
+            notes_by_id = {n.id: n for n in Note.query.options(joinedload(Note.subject))
+                                                      .filter(Note.id.in_(note_ids)).all()}
             
             for result in search_results:
-                note = next((n for n in notes if n.id == result['note_id']), None)
+                note = notes_by_id.get(result['note_id'])
                 if note:
                     results.append({
                         'id': note.id,
@@ -474,14 +625,12 @@ def api_search():
                     })
     else:
         # Fallback to SQL search
-        query_filter = Note.query.filter_by(user_id=current_user.id)
+        query_filter = Note.query.options(joinedload(Note.subject)).filter_by(user_id=current_user.id)
         
         if subject_id:
             query_filter = query_filter.filter_by(subject_id=subject_id)
         
-        notes = query_filter.filter(
-            Note.title.contains(query) | Note.content.contains(query)
-        ).limit(10).all()
+        notes = query_filter.filter(note_search_filter(query)).limit(10).all()
         
         for note in notes:
             results.append({
@@ -494,6 +643,23 @@ def api_search():
     
     return jsonify(results)
 
+def encode_note_cursor(note):
+    """Opaque cursor pointing just after a note in (updated_at, id) descending order"""
+    return f"{note.updated_at.isoformat()}_{note.id}"
+
+def decode_note_cursor(cursor):
+    """
+    Parse a cursor made by encode_note_cursor
+    
+    Returns:
+        tuple: (updated_at, note_id), or None if the cursor is malformed
+    """
+    try:
+        updated_at, _, note_id = cursor.rpartition('_')
+        return datetime.fromisoformat(updated_at), int(note_id)
+    except (AttributeError, ValueError):
+        return None
+
 def get_user_subjects():
     """Helper function to get current user's subjects"""
     return Subject.query.filter_by(user_id=current_user.id).order_by(Subject.name).all()
@@ -503,9 +669,22 @@ def get_user_subjects():
 def api_list_notes():
     """API endpoint to get user's notes for the side panel"""
     try:
-        notes = Note.query.filter_by(user_id=current_user.id)\
-                         .order_by(Note.updated_at.desc())\
-                         .limit(50).all()
+        per_page = 50
+        query = Note.query.options(joinedload(Note.subject)).filter_by(user_id=current_user.id)
+        
+        # Keyset pagination: continue after the last note of the previous page instead of
+        # skipping rows with OFFSET
+        cursor = request.args.get('cursor')
+        if cursor:
+            position = decode_note_cursor(cursor)
+            if not position:
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+            query = query.filter(tuple_(Note.updated_at, Note.id) < position)
+        
+        # One extra row tells whether there is a next page
+        notes = query.order_by(Note.updated_at.desc(), Note.id.desc()).limit(per_page + 1).all()
+        next_cursor = encode_note_cursor(notes[per_page - 1]) if len(notes) > per_page else None
+        notes = notes[:per_page]
         
         notes_data = []
         for note in notes:
@@ -528,7 +707,8 @@ def api_list_notes():
         
         return jsonify({
             'success': True,
-            'notes': notes_data
+            'notes': notes_data,
+            'next_cursor': next_cursor
         })
     except Exception as e:
         current_app.logger.error(f"Error in api_list_notes: {e}")
@@ -542,7 +722,8 @@ def api_list_notes():
 def api_get_note(note_id):
     """API endpoint to get a specific note's details"""
     try:
-        note = Note.query.filter_by(id=note_id, user_id=current_user.id).first()
+        note = Note.query.options(joinedload(Note.subject))\
+                        .filter_by(id=note_id, user_id=current_user.id).first()
         
         if not note:
             return jsonify({
@@ -4,15 +4,16 @@ from werkzeug.utils import secure_filename
 import os
 import io
 from app import db
-from app.models import User
+from app.models import User, UserProfileImage
+from app.uploads import ensure_dir, remove_file
 
 profile = Blueprint('profile', __name__)
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif'})
 
 def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, extension = filename.rpartition('.')
+    return bool(dot) and extension.lower() in ALLOWED_EXTENSIONS
 
 @profile.route('/profile')
 @login_required
@@ -47,20 +48,23 @@ def edit_profile():
                     
                     # Ensure upload directory exists
                     upload_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'profiles')
-                    os.makedirs(upload_folder, exist_ok=True)
+                    ensure_dir(upload_folder)
                     
-                    # Save file
+                    # Read the upload once and reuse the bytes for the disk copy and the database
+                    image_data = file.read()
                     file_path = os.path.join(upload_folder, filename)
-                    file.save(file_path)
-                    
-                    # Read file data for database storage
-                    with open(file_path, 'rb') as f:
-                        image_data = f.read()
+                    with open(file_path, 'wb') as f:
+                        f.write(image_data)
                     
                     # Update user profile image path and binary data
                     current_user.profile_image = f"profiles/{filename}"
-                    current_user.profile_image_data = image_data
-                    current_user.profile_image_mimetype = file.content_type
+                    etag = UserProfileImage.compute_etag(image_data)
+                    if current_user.image:
+                        current_user.image.data = image_data
+                        current_user.image.mimetype = file.content_type
+                        current_user.image.etag = etag
+                    else:
+                        current_user.image = UserProfileImage(data=image_data, mimetype=file.content_type, etag=etag)
             
             # Update other profile fields
             current_user.email = request.form.get('email', current_user.email)
@@ -83,9 +87,7 @@ def delete_profile():
     try:
         # Delete user's profile image if exists
         if current_user.profile_image:
-            image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], current_user.profile_image)
-            if os.path.exists(image_path):
-                os.remove(image_path)
+            remove_file(os.path.join(current_app.config['UPLOAD_FOLDER'], current_user.profile_image))
         
         # Delete user account
         db.session.delete(current_user)
@@ -103,17 +105,27 @@ def delete_profile():
 @profile.route('/profile/image/<int:user_id>')
 def profile_image(user_id):
     """Serve profile image from database"""
-    user = User.query.get_or_404(user_id)
+    # The image bytes are deferred, so they are only loaded once we know the client's copy is stale
+    image = UserProfileImage.query.get(user_id)
     
-    if not user.profile_image_data:
+    if not image:
         # Return default avatar or 404
         return '', 404
     
-    return Response(
-        user.profile_image_data,
-        mimetype=user.profile_image_mimetype or 'image/jpeg',
-        headers={
-            'Cache-Control': 'public, max-age=3600',
-            'Content-Disposition': f'inline; filename="profile_{user_id}.jpg"'
-        }
+    if image.etag and image.etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(image.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+        return response
+    
+    # The URL stays the same when the image is replaced, so clients revalidate with the ETag
+    # after max_age instead of treating the image as immutable
+    return send_file(
+        io.BytesIO(image.data),
+        mimetype=image.mimetype or 'image/jpeg',
+        download_name=f"profile_{user_id}.jpg",
+        conditional=True,
+        etag=image.etag or UserProfileImage.compute_etag(image.data),
+        max_age=3600
     )
@@ -1,6 +1,8 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
 from flask_login import login_required, current_user
-from app.models import Subject
+from sqlalchemy import func, update, delete
+from sqlalchemy.exc import IntegrityError
+from app.models import Subject, Note
 from app import db
 
 subjects_bp = Blueprint('subjects', __name__)
@@ -8,10 +10,16 @@ subjects_bp = Blueprint('subjects', __name__)
 @subjects_bp.route('/subjects')
 @login_required
 def list_subjects():
-    subjects = Subject.query.filter_by(user_id=current_user.id)\
-                           .order_by(Subject.created_at.desc())\
-                           .all()
-    return render_template('subjects/list.html', subjects=subjects)
+    # Note counts come from one grouped query instead of loading each subject's notes
+    rows = db.session.query(Subject, func.count(Note.id))\
+                     .outerjoin(Note, Note.subject_id == Subject.id)\
+                     .filter(Subject.user_id == current_user.id)\
+                     .group_by(Subject.id)\
+                     .order_by(Subject.created_at.desc())\
+                     .all()
+    subjects = [subject for subject, _ in rows]
+    note_counts = {subject.id: note_count for subject, note_count in rows}
+    return render_template('subjects/list.html', subjects=subjects, note_counts=note_counts)
 
 @subjects_bp.route('/subjects/create', methods=['GET', 'POST'])
 @login_required
@@ -25,16 +33,6 @@ def create_subject():
             flash('Subject name is required', 'error')
             return render_template('subjects/create.html')
         
-        # Check if subject name already exists for this user
-        existing_subject = Subject.query.filter_by(
-            name=name, 
-            user_id=current_user.id
-        ).first()
-        
-        if existing_subject:
-            flash('Subject with this name already exists', 'error')
-            return render_template('subjects/create.html')
-        
         subject = Subject(
             name=name,
             description=description,
@@ -45,22 +43,35 @@ def create_subject():
         try:
             db.session.add(subject)
             db.session.commit()
+            subjects_changed(current_user.id)
             flash('Subject created successfully!', 'success')
             return redirect(url_for('subjects.list_subjects'))
+        except IntegrityError:
+            # uq_subject_user_name: this user already has a subject with this name
+            db.session.rollback()
+            flash('Subject with this name already exists', 'error')
+            return render_template('subjects/create.html')
         except Exception as e:
             db.session.rollback()
             flash('Failed to create subject. Please try again.', 'error')
     
     return render_template('subjects/create.html')
 
-@subjects_bp.route('/subjects/<int:subject_id>/edit', methods=['GET', 'POST'])
-@login_required
-def edit_subject(subject_id):
-    subject = Subject.query.filter_by(
+def subjects_changed(user_id):
+    """Drop the chatbot's cached copy of a user's subjects"""
+    from app.services.rag_chatbot import subject_cache
+    subject_cache.invalidate(user_id)
+
+def get_user_subject_or_404(subject_id):
+    """Helper function to load one of the current user's subjects"""
+    return Subject.query.filter_by(
         id=subject_id, 
         user_id=current_user.id
     ).first_or_404()
-    
+
+@subjects_bp.route('/subjects/<int:subject_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_subject(subject_id):
     if request.method == 'POST':
         name = request.form.get('name')
         description = request.form.get('description', '')
@@ -68,47 +79,58 @@ def edit_subject(subject_id):
         
         if not name:
             flash('Subject name is required', 'error')
-            return render_template('subjects/edit.html', subject=subject)
-        
-        # Check if subject name already exists for this user (excluding current subject)
-        existing_subject = Subject.query.filter_by(
-            name=name, 
-            user_id=current_user.id
-        ).filter(Subject.id != subject_id).first()
-        
-        if existing_subject:
-            flash('Subject with this name already exists', 'error')
-            return render_template('subjects/edit.html', subject=subject)
-        
-        subject.name = name
-        subject.description = description
-        subject.color = color
+            return render_template('subjects/edit.html', subject=get_user_subject_or_404(subject_id))
         
+        # Ownership check and update in one statement
         try:
-            db.session.commit()
-            flash('Subject updated successfully!', 'success')
-            return redirect(url_for('subjects.list_subjects'))
+            result = db.session.execute(
+                update(Subject)
+                .where(Subject.id == subject_id, Subject.user_id == current_user.id)
+                .values(name=name, description=description, color=color)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                db.session.commit()
+                subjects_changed(current_user.id)
+                flash('Subject updated successfully!', 'success')
+                return redirect(url_for('subjects.list_subjects'))
+            db.session.rollback()
+        except IntegrityError:
+            # uq_subject_user_name: another subject of this user already has the name
+            db.session.rollback()
+            flash('Subject with this name already exists', 'error')
+            return render_template('subjects/edit.html', subject=get_user_subject_or_404(subject_id))
         except Exception as e:
             db.session.rollback()
             flash('Failed to update subject. Please try again.', 'error')
+        else:
+            # No row matched: the subject does not exist or belongs to someone else
+            abort(404)
     
-    return render_template('subjects/edit.html', subject=subject)
+    return render_template('subjects/edit.html', subject=get_user_subject_or_404(subject_id))
 
 @subjects_bp.route('/subjects/<int:subject_id>/delete', methods=['POST'])
 @login_required
 def delete_subject(subject_id):
-    subject = Subject.query.filter_by(
-        id=subject_id, 
-        user_id=current_user.id
-    ).first_or_404()
-    
     try:
-        # Delete associated notes will be handled by cascade
-        db.session.delete(subject)
-        db.session.commit()
-        flash('Subject deleted successfully!', 'success')
+        # Delete the subject's notes with one bulk statement (the ORM cascade would load
+        # every note and delete them one by one), then the subject if this user owns it
+        Note.query.filter_by(subject_id=subject_id, user_id=current_user.id)\
+                  .delete(synchronize_session=False)
+        result = db.session.execute(
+            delete(Subject)
+            .where(Subject.id == subject_id, Subject.user_id == current_user.id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            db.session.commit()
+            subjects_changed(current_user.id)
+            flash('Subject deleted successfully!', 'success')
+            return redirect(url_for('subjects.list_subjects'))
+        db.session.rollback()
     except Exception as e:
         db.session.rollback()
         flash('Failed to delete subject. Please try again.', 'error')
+        return redirect(url_for('subjects.list_subjects'))
     
-    return redirect(url_for('subjects.list_subjects'))
+    abort(404)
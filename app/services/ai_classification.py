@@ -1,26 +1,432 @@
-import ollama
+import asyncio
+import copy
+import json
 import logging
+import numpy as np
+import os
+import queue
+import re
+import textwrap
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from itertools import chain
 from typing import List, Optional, Dict, Tuple
 from datetime import datetime
+from functools import lru_cache
+from app.services.llm_cache import LLMCache, NearDuplicateCache, MISS
+from app.services.ollama_client import ollama_client, AsyncOrjsonClient
+
+# How long Ollama keeps llama3 (and the embedding model) loaded after a request. The server
+# default is 5m, after which the next upload pays a multi-second reload; holding the model
+# keeps its weights (~5 GB for llama3 8B at 4-bit) in RAM/VRAM for the whole period, so
+# lower it (e.g. "10m", or "0" to unload right away) on machines that need the memory back
+OLLAMA_KEEP_ALIVE = os.environ.get('INKLING_OLLAMA_KEEP_ALIVE', '24h')
+
+# Context size of every llama3 request (classification, multi-subject splitting, OCR cleanup,
+# chat answers). Ollama restarts the model runner whenever num_ctx changes, so it is never
+# computed per text: longer inputs are cut into parts that fit (see split_for_context)
+LLAMA3_NUM_CTX = 4096
+
+# Longest text sent in one multi-subject request; the answer echoes the text back as JSON,
+# so text, prompt and answer together stay within LLAMA3_NUM_CTX
+MULTI_SUBJECT_MAX_CHARS = 5000
+
+# Ollama model used to embed texts for the semantic answer cache and subject matching
+EMBEDDING_MODEL = "nomic-embed-text"
+
+# Minimum cosine similarity for an answer to be mapped onto a subject by embedding
+SUBJECT_SIMILARITY_THRESHOLD = 0.6
+
+# How far the best subject's similarity to a note must lead the runner-up for the
+# note to be classified from embeddings alone, without asking the chat model
+EMBEDDING_CLASSIFICATION_MARGIN = 0.05
+
+# Subject (name, description) embeddings kept between classifications, least recently used dropped first
+SUBJECT_EMBEDDINGS_MAX_ENTRIES = 1024
+
+# Fixed instructions first and the subject list last, so every classification for the same
+# subjects sends a byte-identical system message the server can serve from its KV cache
+CLASSIFY_SUBJECT_SYSTEM_PROMPT = """You classify text extracted from handwritten notes into exactly one subject.
+
+Instructions:
+- Return ONLY one of the EXACT subject names listed below
+- Match the text content to the most relevant subject
+- Consider technical terms, topics, and context
+- If multiple subjects could apply, choose the most dominant one
+- If no subject matches well, return "NONE"
+- Do not add any explanation or extra text
+
+Subjects:
+{subjects}"""
+
+# Same context as every other llama3 request, so the shared prefix stays in the KV cache
+CLASSIFY_SUBJECT_OPTIONS = {'num_ctx': LLAMA3_NUM_CTX}
+
+# classify_subject requests arriving within this many seconds of each other are answered by
+# one chat request (at most CLASSIFY_BATCH_SIZE texts, which fits in LLAMA3_NUM_CTX)
+CLASSIFY_BATCH_WINDOW = 0.01
+CLASSIFY_BATCH_SIZE = 8
+CLASSIFY_BATCH_OPTIONS = {'num_ctx': LLAMA3_NUM_CTX, 'temperature': 0}
+
+CLASSIFY_BATCH_PROMPT = textwrap.dedent("""\
+    You classify texts extracted from handwritten notes. Each numbered document below lists its own subjects.
+
+    Instructions:
+    - For every document, choose ONLY one of the EXACT subject names listed for that document
+    - Match the text content to the most relevant subject
+    - Consider technical terms, topics, and context
+    - If no subject matches well, use "NONE"
+
+    Return ONLY a JSON object with one label per document, in document order:
+
+    {{"labels": ["SUBJECT_FOR_DOCUMENT_1", "SUBJECT_FOR_DOCUMENT_2"]}}
+
+    {documents}""")
+
+CLASSIFY_BATCH_DOCUMENT = textwrap.dedent("""\
+    Document {number}
+    Subjects: {subjects}
+    Text:
+    {text}
+    """)
+
+MULTI_SUBJECT_PROMPT = textwrap.dedent("""\
+    Analyze text extracted from handwritten notes. Determine if it contains content related to multiple subjects or just one subject.
+
+    Available subjects (use EXACTLY these names, or "General" if no subject matches well): {subjects}
+
+    Instructions:
+    1. If the text relates to only ONE subject, return a single entry with the entire text as content.
+    2. If the text relates to MULTIPLE subjects, split it into one section per subject. Each section contains only the content relevant to that subject, and no original content may be lost.
+    3. Give every entry a descriptive title about its main topic WITHOUT including the subject name.
+
+    Return ONLY a JSON object in this EXACT format:
+
+    {{
+        "notes": [
+            {{
+                "subject": "EXACT_SUBJECT_NAME_FROM_LIST",
+                "title": "Descriptive Title Without Subject Name",
+                "content": "Relevant content for this subject"
+            }}
+        ]
+    }}
+
+    Text to analyze:
+    {text}""")
+
+# Start of the item array in a streamed answer: {"notes": [ ... or a bare [ ...
+_ARRAY_START = re.compile(r'\s*(?:\{\s*"notes"\s*:\s*)?\[')
+
+class _BatchScheduler:
+    """
+    Collects classification requests from concurrent callers for a short window and
+    answers them with one chat request, so the instructions are prefilled and the HTTP
+    round trip paid once per batch rather than once per note
+    """
+    
+    def __init__(self, classify_one, classify_many, window: float = CLASSIFY_BATCH_WINDOW,
+                 max_batch: int = CLASSIFY_BATCH_SIZE):
+        self.classify_one = classify_one
+        self.classify_many = classify_many
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+    
+    def submit(self, text: str, available_subjects: List[str]) -> Future:
+        """
+        Queue a text for classification
+        
+        Args:
+            text (str): The text to classify
+            available_subjects (List[str]): Subject names the text may be given
+            
+        Returns:
+            Future: Resolves to the model's raw answer for the text
+        """
+        future = Future()
+        self._queue.put((text, available_subjects, future))
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        return future
+    
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+    
+    def _dispatch(self, batch) -> None:
+        answers = None
+        if len(batch) > 1:
+            try:
+                answers = self.classify_many([(text, subjects) for text, subjects, _ in batch])
+            except Exception as e:
+                logging.warning(f"Batched classification of {len(batch)} texts failed, classifying one by one: {e}")
+        
+        for i, (text, subjects, future) in enumerate(batch):
+            if answers is not None:
+                future.set_result(answers[i])
+                continue
+            try:
+                future.set_result(self.classify_one(text, subjects))
+            except Exception as e:
+                future.set_exception(e)
+
+class JSONArrayStreamParser:
+    """
+    Incremental parser for a streamed {"notes": [...]} (or [...]) JSON answer that
+    returns each array item as soon as its text is complete
+    """
+    
+    def __init__(self):
+        self.buffer = ''
+        self.finished = False
+        self._position = None
+        self._decoder = json.JSONDecoder()
+    
+    def feed(self, text: str) -> List:
+        """
+        Add streamed text
+        
+        Args:
+            text (str): Next piece of the answer
+            
+        Returns:
+            List: Items completed by this piece, in order
+        """
+        self.buffer += text
+        if self._position is None:
+            match = _ARRAY_START.match(self.buffer)
+            if not match:
+                return []
+            self._position = match.end()
+        
+        items = []
+        while not self.finished:
+            position = self._position
+            while position < len(self.buffer) and self.buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(self.buffer):
+                break
+            if self.buffer[position] == ']':
+                self.finished = True
+                break
+            try:
+                item, self._position = self._decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                break  # The item is still being written
+            items.append(item)
+        return items
+
+def split_for_context(text: str, max_chars: int) -> List[str]:
+    """
+    Cut text into parts of at most max_chars characters, at paragraph breaks where
+    possible, then at line breaks, sentence ends and spaces
+
+    Args:
+        text (str): Text too long for one model request
+        max_chars (int): Longest part
+
+    Returns:
+        List[str]: Non-empty parts, in order
+    """
+    parts = []
+    text = text.strip()
+    while len(text) > max_chars:
+        window = text[:max_chars + 1]
+        for separator in ('\n\n', '\n', '. ', ' '):
+            cut = window.rfind(separator, max_chars // 2)
+            if cut != -1:
+                cut += len(separator.rstrip())
+                break
+        else:
+            cut = max_chars
+        parts.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        parts.append(text)
+    return parts
+
+@lru_cache(maxsize=256)
+def _subjects_block(subjects: Tuple[str, ...]) -> str:
+    """Subject list as rendered in the classification system prompt"""
+    return "\n".join(f"- {subject}" for subject in subjects)
+
+# Strategy 5 of subject matching: common names for subjects
+SUBJECT_MAPPINGS = {
+    'ml': 'machine learning',
+    'ai': 'machine learning',
+    'artificial intelligence': 'machine learning', 
+    'dl': 'deep learning',
+    'neural networks': 'deep learning',
+    'neural network': 'deep learning',
+    'literature': 'english',
+    'shakespeare': 'english',
+    'poetry': 'english',
+    'writing': 'english',
+    'math': 'mathematics',
+    'calculus': 'mathematics',
+    'algebra': 'mathematics',
+    'physics': 'physics',
+    'chemistry': 'chemistry',
+    'biology': 'biology',
+    'history': 'history',
+    'science': 'general science'
+}
+
+@dataclass(frozen=True)
+class SubjectIndex:
+    """Lookup tables for matching model answers against one list of subjects"""
+    by_lower: Dict[str, str]
+    entries: Tuple[Tuple[str, str], ...]
+    inverted: Dict[str, Tuple[int, ...]]
+    word_counts: Tuple[int, ...]
+    mapped: Dict[str, str]
+
+@lru_cache(maxsize=32)
+def _build_subject_index(subjects: Tuple[str, ...]) -> SubjectIndex:
+    """
+    Build the subject matching tables once per subject list
+    
+    Args:
+        subjects (Tuple[str, ...]): Available subjects, in the order they are matched
+        
+    Returns:
+        SubjectIndex: lowercase -> subject, (lowercase, subject) entries, word -> subject
+        positions with each subject's word count, and SUBJECT_MAPPINGS resolved to the
+        subjects that exist
+    """
+    by_lower = {}
+    entries = []
+    inverted = defaultdict(list)
+    word_counts = []
+    for position, subject in enumerate(subjects):
+        subject_lower = subject.lower()
+        # The first subject wins when two differ only in case
+        by_lower.setdefault(subject_lower, subject)
+        entries.append((subject_lower, subject))
+        
+        subject_words = set(subject_lower.split())
+        for word in subject_words:
+            inverted[word].append(position)
+        word_counts.append(len(subject_words))
+    
+    mapped = {alias: by_lower[target] for alias, target in SUBJECT_MAPPINGS.items() if target in by_lower}
+    return SubjectIndex(
+        by_lower=by_lower,
+        entries=tuple(entries),
+        inverted={word: tuple(positions) for word, positions in inverted.items()},
+        word_counts=tuple(word_counts),
+        mapped=mapped
+    )
 
 class SubjectClassificationService:
     def __init__(self):
         self.model_name = "llama3"
-        self.enabled = True
+        self.cache = LLMCache(self.model_name, embed=self._embed)
+        self.near_duplicates = NearDuplicateCache()
+        # (subject name, description) -> normalized embedding, LRU
+        self._subject_embeddings = OrderedDict()
+        self._subject_embeddings_lock = threading.Lock()
+        # Subject embeddings are skipped until then after an embedding failure
+        self._subject_embeddings_retry_at = 0.0
+        self._scheduler = _BatchScheduler(self._classify_subject_one, self._classify_subject_batch)
+        
+        # Ollama availability is probed on first use and re-checked at most once a minute
+        self._available = False
+        self._last_probe = None
+        self._probe_interval = 60
+        self._probe_lock = threading.Lock()
+        # Set by warm_up(); the model is then loaded again whenever Ollama comes back
+        self._keep_warm = False
+    
+    @property
+    def enabled(self) -> bool:
+        """Whether Ollama answered the most recent availability probe"""
+        self._probe_if_stale()
+        return self._available
+    
+    @property
+    def subject_embeddings_enabled(self) -> bool:
+        """Whether subject embeddings may be used (re-tried once _probe_interval has passed since a failure)"""
+        return time.monotonic() >= self._subject_embeddings_retry_at
+    
+    def _subject_embeddings_failed(self, error: Exception, consequence: str) -> None:
+        if self.subject_embeddings_enabled:
+            logging.warning(f"Subject embeddings unavailable, {consequence} for {self._probe_interval}s: {error}")
+        self._subject_embeddings_retry_at = time.monotonic() + self._probe_interval
+    
+    def _probe_if_stale(self) -> None:
+        with self._probe_lock:
+            now = time.monotonic()
+            first_probe = self._last_probe is None
+            if not first_probe and now - self._last_probe < self._probe_interval:
+                return
+            self._last_probe = now
+            was_available = self._available
+            try:
+                # Test if Ollama is available
+                ollama_client.list()
+                self._available = True
+                if not was_available and self._keep_warm:
+                    threading.Thread(target=self._load_model, daemon=True).start()
+            except Exception as e:
+                # Warn when Ollama is first found missing, not on every re-check
+                if first_probe or self._available:
+                    logging.warning(f"Ollama not available: {e}")
+                self._available = False
+    
+    def warm_up(self) -> None:
+        """
+        Probe Ollama and load the chat model on a background thread, so the first
+        upload finds it resident. Importing this module starts nothing; create_app
+        calls this once.
+        """
+        threading.Thread(target=self._warm_up, name='ollama-warm-up', daemon=True).start()
+    
+    def _warm_up(self) -> None:
+        if self.enabled:
+            self._load_model()
+        self._keep_warm = True
+    
+    def _load_model(self) -> None:
+        """Load the chat model with a one-token request so it is resident before the first real one"""
         try:
-            # Test if Ollama is available
-            ollama.list()
+            ollama_client.chat(
+                model=self.model_name,
+                messages=[{'role': 'user', 'content': 'Hi'}],
+                options={'num_predict': 1, 'num_ctx': LLAMA3_NUM_CTX},
+                keep_alive=OLLAMA_KEEP_ALIVE
+            )
+            logging.info(f"Ollama model {self.model_name} loaded (keep_alive={OLLAMA_KEEP_ALIVE})")
         except Exception as e:
-            logging.warning(f"Ollama not available: {e}")
-            self.enabled = False
+            logging.warning(f"Could not warm up Ollama model {self.model_name}: {e}")
     
-    def classify_subject(self, text: str, available_subjects: List[str]) -> Optional[str]:
+    def classify_subject(self, text: str, available_subjects: List[str],
+                         subject_descriptions: Optional[Dict[str, str]] = None) -> Optional[str]:
         """
         Classify text into one of the available subjects using Llama3
         
         Args:
             text (str): The text to classify
             available_subjects (List[str]): List of available subject names
+            subject_descriptions (Dict[str, str]): Optional description of each subject
             
         Returns:
             Optional[str]: The most appropriate subject name or None
@@ -28,65 +434,229 @@ class SubjectClassificationService:
         if not self.enabled or not available_subjects:
             return None
         
+        # Limit text length for better performance (truncated once, for the prompt and cache key)
+        text = text[:1000]
+        
+        cached = self.cache.get('classify_subject', text, available_subjects)
+        if cached is not MISS:
+            return cached
+        
+        # A clear winner by embedding similarity needs no chat completion
+        subject = self._classify_by_embedding(text, available_subjects, subject_descriptions)
+        if subject:
+            self.cache.put('classify_subject', text, available_subjects, subject)
+            return subject
+        
         try:
-            # Create prompt for subject classification
-            subjects_list = ", ".join(available_subjects)
-            prompt = f"""
-            Given the following text extracted from handwritten notes, classify it into one of these EXACT subjects: {subjects_list}
-
-            Text to classify:
-            {text[:1000]}  # Limit text length for better performance
-
-            Instructions:
-            - Return ONLY one of these EXACT subject names: {subjects_list}
-            - Match the text content to the most relevant subject
-            - Consider technical terms, topics, and context
-            - If multiple subjects could apply, choose the most dominant one
-            - If no subject matches well, return "NONE"
-            - Do not add any explanation or extra text
-
-            Available subjects again: {subjects_list}
+            # Concurrent uploads share a chat request (see _BatchScheduler)
+            predicted_subject = self._scheduler.submit(text, available_subjects).result()
+            subject = self._resolve_predicted_subject(predicted_subject, available_subjects)
+            self.cache.put('classify_subject', text, available_subjects, subject)
+            return subject
+                
+        except Exception as e:
+            logging.error(f"Error in subject classification: {e}")
+            return None
+    
+    async def _aclassify_subject(self, text: str, available_subjects: List[str],
+                                 subject_descriptions: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """classify_subject for coroutines; the model request goes through the same batch scheduler"""
+        text = text[:1000]
+        
+        cached = self.cache.get('classify_subject', text, available_subjects)
+        if cached is not MISS:
+            return cached
+        
+        subject = await asyncio.to_thread(self._classify_by_embedding, text, available_subjects, subject_descriptions)
+        if subject:
+            self.cache.put('classify_subject', text, available_subjects, subject)
+            return subject
+        
+        try:
+            predicted_subject = await asyncio.wrap_future(self._scheduler.submit(text, available_subjects))
+            # The embedding fallback makes its own (blocking) Ollama call
+            subject = await asyncio.to_thread(self._resolve_predicted_subject, predicted_subject, available_subjects)
+            self.cache.put('classify_subject', text, available_subjects, subject)
+            return subject
+                
+        except Exception as e:
+            logging.error(f"Error in subject classification: {e}")
+            return None
+    
+    def _classify_subject_one(self, text: str, available_subjects: List[str]) -> str:
+        """Ask the model for the subject of a single text"""
+        response = ollama_client.chat(
+            model=self.model_name,
+            messages=self._classify_subject_messages(text, available_subjects),
+            options=CLASSIFY_SUBJECT_OPTIONS,
+            keep_alive=OLLAMA_KEEP_ALIVE
+        )
+        return response['message']['content'].strip()
+    
+    def _classify_subject_batch(self, requests: List[Tuple[str, List[str]]]) -> List[str]:
+        """
+        Ask the model for the subjects of several texts in one request
+        
+        Args:
+            requests (List[Tuple[str, List[str]]]): (text, available subjects) pairs
             
-            Subject:"""
-
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ]
+        Returns:
+            List[str]: The model's answer for each text, in order
+        """
+        documents = "\n".join(
+            CLASSIFY_BATCH_DOCUMENT.format(
+                number=number,
+                subjects=", ".join(sorted(set(subjects))),
+                text=text
             )
+            for number, (text, subjects) in enumerate(requests, 1)
+        )
+        response = ollama_client.chat(
+            model=self.model_name,
+            messages=[
+                {
+                    'role': 'user',
+                    'content': CLASSIFY_BATCH_PROMPT.format(documents=documents)
+                }
+            ],
+            format='json',
+            options=CLASSIFY_BATCH_OPTIONS,
+            keep_alive=OLLAMA_KEEP_ALIVE
+        )
+        
+        labels = json.loads(response['message']['content']).get('labels')
+        if not isinstance(labels, list) or len(labels) != len(requests):
+            raise ValueError(f"expected {len(requests)} labels, got {labels!r}")
+        return [str(label).strip() for label in labels]
+    
+    def _classify_subject_messages(self, text: str, available_subjects: List[str]) -> List[Dict[str, str]]:
+        """
+        Chat messages asking the model to pick one of the available subjects for text.
+        The system message depends only on the subject set, so Ollama can reuse its
+        cached prefix across notes; the note text is the only variable part.
+        """
+        return [
+            {
+                'role': 'system',
+                'content': CLASSIFY_SUBJECT_SYSTEM_PROMPT.format(subjects=_subjects_block(tuple(sorted(set(available_subjects)))))
+            },
+            {
+                'role': 'user',
+                'content': text
+            }
+        ]
+    
+    def _resolve_predicted_subject(self, predicted_subject: str, available_subjects: List[str]) -> Optional[str]:
+        """Map the model's answer onto one of the available subjects"""
+        # First try exact match
+        if predicted_subject in available_subjects:
+            return predicted_subject
+        elif predicted_subject.upper() == "NONE":
+            return None
+        
+        # Use the enhanced matching logic
+        closest_match = self._find_closest_subject_match(predicted_subject, available_subjects)
+        if closest_match:
+            logging.info(f"Single classification: mapped '{predicted_subject}' to '{closest_match}'")
+            return closest_match
+        
+        # Final fallback: the subject whose name embeds closest to the answer
+        if not self.subject_embeddings_enabled:
+            return None
+        try:
+            embedding_match = self._find_subject_by_embedding(predicted_subject, available_subjects)
+        except Exception as e:
+            self._subject_embeddings_failed(e, "skipping the embedding fallback")
+            return None
+        if embedding_match:
+            logging.info(f"Embedding match: '{predicted_subject}' -> '{embedding_match}'")
+        return embedding_match
+    
+    def _embed(self, text: str) -> List[float]:
+        """Embedding of text from the Ollama embedding model"""
+        return ollama_client.embeddings(model=EMBEDDING_MODEL, prompt=text[:1000], keep_alive=OLLAMA_KEEP_ALIVE)['embedding']
+    
+    def _find_subject_by_embedding(self, predicted_subject: str, available_subjects: List[str]) -> Optional[str]:
+        """
+        Find the subject whose name is semantically closest to the model's answer
+        
+        Subject name embeddings are kept between calls, so usually only the
+        answer itself is embedded.
+        
+        Args:
+            predicted_subject (str): The subject predicted by AI
+            available_subjects (List[str]): List of available subjects
             
-            predicted_subject = response['message']['content'].strip()
+        Returns:
+            Optional[str]: The closest subject, or None if none is similar enough
+        """
+        scores = self._subject_matrix(available_subjects) @ self._normalized_embedding(predicted_subject)
+        best = int(scores.argmax())
+        if scores[best] > SUBJECT_SIMILARITY_THRESHOLD:
+            return available_subjects[best]
+        return None
+    
+    def _classify_by_embedding(self, text: str, available_subjects: List[str],
+                               subject_descriptions: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """
+        Classify text by comparing its embedding with the embeddings of the subjects'
+        names and descriptions. The text's embedding is the one the answer cache
+        computed (and memoized) for its semantic lookup, so it costs no extra request.
+        
+        Args:
+            text (str): The text to classify
+            available_subjects (List[str]): List of available subject names
+            subject_descriptions (Dict[str, str]): Optional description of each subject
             
-            # First try exact match
-            if predicted_subject in available_subjects:
-                return predicted_subject
-            elif predicted_subject.upper() == "NONE":
-                return None
-            else:
-                # Use the enhanced matching logic
-                closest_match = self._find_closest_subject_match(predicted_subject, available_subjects)
-                if closest_match:
-                    logging.info(f"Single classification: mapped '{predicted_subject}' to '{closest_match}'")
-                    return closest_match
-                
-                # Final fallback: use content-based keywords to match
-                keywords = self.extract_keywords(text)
-                if keywords:
-                    for keyword in keywords:
-                        keyword_match = self._find_closest_subject_match(keyword, available_subjects)
-                        if keyword_match:
-                            logging.info(f"Keyword-based match: '{keyword}' -> '{keyword_match}'")
-                            return keyword_match
-                
-                return None
-                
+        Returns:
+            Optional[str]: The most similar subject when it leads the runner-up by
+            EMBEDDING_CLASSIFICATION_MARGIN, otherwise None (ambiguous, or no embedding model)
+        """
+        if not self.subject_embeddings_enabled or len(available_subjects) < 2:
+            return None
+        
+        embedding = self.cache.embedding(text)
+        if embedding is None:
+            return None
+        try:
+            scores = self._subject_matrix(available_subjects, subject_descriptions) @ embedding
         except Exception as e:
-            logging.error(f"Error in subject classification: {e}")
+            self._subject_embeddings_failed(e, "classifying with chat only")
             return None
+        
+        runner_up, best = np.partition(scores, -2)[-2:]
+        if best - runner_up > EMBEDDING_CLASSIFICATION_MARGIN:
+            subject = available_subjects[int(scores.argmax())]
+            logging.info(f"Embedding classification: '{subject}' (margin {best - runner_up:.3f})")
+            return subject
+        return None
+    
+    def _subject_matrix(self, available_subjects: List[str], subject_descriptions: Optional[Dict[str, str]] = None):
+        """
+        (N, D) float32 matrix of normalized subject embeddings, one row per subject. A subject
+        with a description is embedded as "name: description", otherwise by its name alone
+        """
+        rows = []
+        for subject in available_subjects:
+            key = (subject, (subject_descriptions or {}).get(subject) or '')
+            with self._subject_embeddings_lock:
+                row = self._subject_embeddings.get(key)
+                if row is not None:
+                    self._subject_embeddings.move_to_end(key)
+            if row is None:
+                description = key[1]
+                row = self._normalized_embedding(f"{subject}: {description}" if description else subject)
+                with self._subject_embeddings_lock:
+                    self._subject_embeddings[key] = row
+                    while len(self._subject_embeddings) > SUBJECT_EMBEDDINGS_MAX_ENTRIES:
+                        self._subject_embeddings.popitem(last=False)
+            rows.append(row)
+        return np.stack(rows)
+    
+    def _normalized_embedding(self, text: str):
+        vector = np.asarray(self._embed(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
     
     def extract_keywords(self, text: str) -> List[str]:
         """
@@ -101,6 +671,10 @@ class SubjectClassificationService:
         if not self.enabled:
             return []
         
+        cached = self.cache.get('extract_keywords', text[:1500], ())
+        if cached is not MISS:
+            return list(cached)
+        
         try:
             prompt = f"""
             Extract the main keywords and topics from this text. Focus on:
@@ -115,14 +689,16 @@ class SubjectClassificationService:
             Return only a comma-separated list of keywords (maximum 10):
             """
 
-            response = ollama.chat(
+            response = ollama_client.chat(
                 model=self.model_name,
                 messages=[
                     {
                         'role': 'user',
                         'content': prompt
                     }
-                ]
+                ],
+                options={'num_ctx': LLAMA3_NUM_CTX},
+                keep_alive=OLLAMA_KEEP_ALIVE
             )
             
             keywords_text = response['message']['content'].strip()
@@ -135,6 +711,7 @@ class SubjectClassificationService:
                 if keyword and len(keyword) > 2:
                     cleaned_keywords.append(keyword)
             
+            self.cache.put('extract_keywords', text[:1500], (), tuple(cleaned_keywords))
             return cleaned_keywords
             
         except Exception as e:
@@ -155,77 +732,52 @@ class SubjectClassificationService:
         if not predicted_subject or not available_subjects:
             return None
         
+        index = _build_subject_index(tuple(available_subjects))
         predicted_lower = predicted_subject.lower().strip()
         
         # Strategy 1: Exact match (case insensitive)
-        for subject in available_subjects:
-            if subject.lower() == predicted_lower:
-                return subject
+        exact_match = index.by_lower.get(predicted_lower)
+        if exact_match:
+            return exact_match
         
         # Strategy 2: Contains match (predicted contains available subject)
-        for subject in available_subjects:
-            if subject.lower() in predicted_lower:
+        for subject_lower, subject in index.entries:
+            if subject_lower in predicted_lower:
                 return subject
         
         # Strategy 3: Available subject contains predicted
-        for subject in available_subjects:
-            if predicted_lower in subject.lower():
+        for subject_lower, subject in index.entries:
+            if predicted_lower in subject_lower:
                 return subject
         
-        # Strategy 4: Partial word matching
+        # Strategy 4: Partial word matching, counting shared words through the inverted index
         predicted_words = set(predicted_lower.split())
+        common_counts = Counter(chain.from_iterable(index.inverted.get(word, ()) for word in predicted_words))
         best_match = None
         best_score = 0
         
-        for subject in available_subjects:
-            subject_words = set(subject.lower().split())
-            common_words = predicted_words.intersection(subject_words)
-            if common_words:
-                score = len(common_words) / max(len(predicted_words), len(subject_words))
-                if score > best_score and score >= 0.5:  # At least 50% word overlap
-                    best_score = score
-                    best_match = subject
+        # In subject order, so the first of equally good subjects wins
+        for position in sorted(common_counts):
+            score = common_counts[position] / max(len(predicted_words), index.word_counts[position])
+            if score > best_score and score >= 0.5:  # At least 50% word overlap
+                best_score = score
+                best_match = index.entries[position][1]
         
         if best_match:
             return best_match
         
         # Strategy 5: Common subject name mappings
-        subject_mappings = {
-            'ml': 'machine learning',
-            'ai': 'machine learning',
-            'artificial intelligence': 'machine learning', 
-            'dl': 'deep learning',
-            'neural networks': 'deep learning',
-            'neural network': 'deep learning',
-            'literature': 'english',
-            'shakespeare': 'english',
-            'poetry': 'english',
-            'writing': 'english',
-            'math': 'mathematics',
-            'calculus': 'mathematics',
-            'algebra': 'mathematics',
-            'physics': 'physics',
-            'chemistry': 'chemistry',
-            'biology': 'biology',
-            'history': 'history',
-            'science': 'general science'
-        }
-        
-        mapped_subject = subject_mappings.get(predicted_lower)
-        if mapped_subject:
-            for subject in available_subjects:
-                if subject.lower() == mapped_subject:
-                    return subject
-        
-        return None
+        return index.mapped.get(predicted_lower)
 
-    def classify_multi_subject_text(self, text: str, available_subjects: List[str]) -> List[Dict[str, str]]:
+    def classify_multi_subject_text(self, text: str, available_subjects: List[str],
+                                    subject_descriptions: Optional[Dict[str, str]] = None) -> List[Dict[str, str]]:
         """
         Analyze text and split it into multiple notes if it contains content for different subjects
         
         Args:
             text (str): The text to analyze and split
             available_subjects (List[str]): List of available subject names
+            subject_descriptions (Dict[str, str]): Optional description of each subject
             
         Returns:
             List[Dict]: List of dictionaries with 'subject', 'content', and 'title' keys
@@ -233,158 +785,217 @@ class SubjectClassificationService:
         if not self.enabled or not available_subjects or not text.strip():
             return []
         
+        return asyncio.run(self.aclassify_multi_subject_text(text, available_subjects, subject_descriptions))
+    
+    async def aclassify_multi_subject_text(self, text: str, available_subjects: List[str],
+                                           subject_descriptions: Optional[Dict[str, str]] = None) -> List[Dict[str, str]]:
+        """
+        Async version of classify_multi_subject_text. Sections whose subject the model
+        made up are reclassified by content while the rest of the answer is still
+        streaming; like classify_subject, those requests go through the batch scheduler,
+        which answers the ones that arrive together with a single chat request.
+        
+        Args:
+            text (str): The text to analyze and split
+            available_subjects (List[str]): List of available subject names
+            subject_descriptions (Dict[str, str]): Optional description of each subject
+            
+        Returns:
+            List[Dict]: List of dictionaries with 'subject', 'content', and 'title' keys
+        """
+        if not self.enabled or not available_subjects or not text.strip():
+            return []
+        
+        # Answers carry the note text itself, so only an identical text may reuse one
+        cached = self.cache.get('classify_multi_subject_text', text, available_subjects, semantic=False)
+        if cached is not MISS:
+            return copy.deepcopy(cached)
+        
+        # A near-identical text (e.g. the same page photographed again) that was a single
+        # note gets the same subject and title without asking the model
+        subjects_key = tuple(sorted(set(available_subjects)))
+        near_duplicate = self.near_duplicates.get(subjects_key, text[:1000])
+        if near_duplicate is not MISS:
+            logging.info(f"Near-duplicate text, reusing subject '{near_duplicate['subject']}'")
+            return [dict(near_duplicate, content=text.strip())]
+        
+        if len(text) > MULTI_SUBJECT_MAX_CHARS:
+            # Too long for one request: split each part on its own, concurrently
+            parts = await asyncio.gather(*(
+                self.aclassify_multi_subject_text(part, available_subjects, subject_descriptions)
+                for part in split_for_context(text, MULTI_SUBJECT_MAX_CHARS)
+            ))
+            result = list(chain.from_iterable(parts))
+            if result:
+                self.cache.put('classify_multi_subject_text', text, available_subjects,
+                               copy.deepcopy(result), semantic=False)
+            return result
+        
+        # httpx async clients are bound to the event loop that uses them, so one per call
+        aclient = AsyncOrjsonClient()
+        
         try:
-            subjects_list = ", ".join(available_subjects)
             current_date = datetime.now().strftime("%A, %B %d, %Y")
             
-            prompt = f"""
-            Analyze the following text extracted from handwritten notes. Determine if it contains content related to multiple subjects or just one subject.
-
-            Available subjects (use EXACTLY these names): {subjects_list}
-
-            Text to analyze:
-            {text}
-
-            Instructions:
-            1. If the text relates to only ONE subject:
-               - Return a single entry with the EXACT subject name from the list above
-               - Use the entire text as content
-               - Generate a descriptive title WITHOUT including the subject name
-
-            2. If the text relates to MULTIPLE subjects:
-               - Split the text into separate sections for each subject
-               - Use EXACTLY the subject names from this list: {subjects_list}
-               - Each section should contain only content relevant to that subject
-               - Generate appropriate titles for each section WITHOUT subject names
-               - Preserve all original content (don't lose any information)
-
-            3. For each note, generate a descriptive title WITHOUT including the subject name. Focus on the main topic or content of that section.
-
-            4. If no subject matches well, use "General" as the subject
-
-            5. CRITICAL: Only use these exact subject names: {subjects_list} or "General"
-
-            IMPORTANT: Return ONLY valid JSON in this EXACT format. Do not include any explanations, prefixes, or additional text:
-
-            [
-                {{
-                    "subject": "EXACT_SUBJECT_NAME_FROM_LIST",
-                    "title": "Descriptive Title Without Subject Name",
-                    "content": "Relevant content for this subject"
-                }},
-                {{
-                    "subject": "Another Subject",
-                    "title": "Another Title", 
-                    "content": "Content for second subject"
-                }}
-            ]"""
+            # Subjects are listed once, in canonical order, and the text comes last
+            prompt = MULTI_SUBJECT_PROMPT.format(
+                subjects=", ".join(sorted(set(available_subjects))),
+                text=text
+            )
 
-            response = ollama.chat(
+            # JSON mode makes the server emit only a JSON object, so nothing has to be stripped.
+            # The answer is streamed so each note can be validated (and, if its subject is
+            # unknown, reclassified) while the model is still writing the next one.
+            stream = await aclient.chat(
                 model=self.model_name,
                 messages=[
                     {
                         'role': 'user',
                         'content': prompt
                     }
-                ]
+                ],
+                format='json',
+                options=self._multi_subject_options(text),
+                stream=True,
+                keep_alive=OLLAMA_KEEP_ALIVE
             )
             
-            response_text = response['message']['content'].strip()
+            # Well-formed items with their subjects mapped onto the available ones
+            items = []
+            reclassifications = {}
             
-            # Clean up the response to ensure valid JSON
-            # Remove any text before the first '[' or after the last ']'
-            start_idx = response_text.find('[')
-            end_idx = response_text.rfind(']')
-            
-            if start_idx != -1 and end_idx != -1:
-                response_text = response_text[start_idx:end_idx+1]
+            def accept(item):
+                if not (isinstance(item, dict) and 'subject' in item and 'content' in item):
+                    return
+                # Validate subject exists and find closest match
+                subject = item['subject']
+                
+                if subject not in available_subjects and subject != "General":
+                    # Try multiple matching strategies for closest match
+                    closest_match = self._find_closest_subject_match(subject, available_subjects)
+                    if closest_match:
+                        logging.info(f"Mapped subject '{subject}' to '{closest_match}'")
+                        subject = closest_match
+                    else:
+                        # If no close match found, try content-based classification (while streaming)
+                        reclassifications[len(items)] = asyncio.create_task(
+                            self._aclassify_subject(item['content'], available_subjects, subject_descriptions)
+                        )
+                
+                items.append((item, subject))
             
-            # Try to parse JSON response
-            import json
+            parser = JSONArrayStreamParser()
             try:
-                result = json.loads(response_text)
+                async for chunk in stream:
+                    for item in parser.feed(chunk['message']['content']):
+                        accept(item)
                 
-                # Validate and clean the result
-                validated_result = []
-                for item in result:
-                    if isinstance(item, dict) and 'subject' in item and 'content' in item:
-                        # Validate subject exists and find closest match
-                        subject = item['subject']
-                        original_subject = subject
-                        
-                        if subject not in available_subjects and subject != "General":
-                            # Try multiple matching strategies for closest match
-                            closest_match = self._find_closest_subject_match(subject, available_subjects)
-                            if closest_match:
-                                subject = closest_match
-                                logging.info(f"Mapped subject '{original_subject}' to '{subject}'")
-                            else:
-                                # If no close match found, try content-based classification
-                                content_based_subject = self.classify_subject(item['content'], available_subjects)
-                                if content_based_subject:
-                                    subject = content_based_subject
-                                    logging.info(f"Used content-based classification: '{original_subject}' -> '{subject}'")
-                                else:
-                                    subject = "General"
-                                    logging.info(f"No match found for '{original_subject}', using General")
-                        
-                        # Generate title if not provided or invalid
-                        title = item.get('title', '').strip()
-                        
-                        # Remove subject prefix completely if it exists
-                        if title.startswith(f"{subject} - "):
-                            title = title[len(f"{subject} - "):]
-                        elif title.startswith(subject):
-                            title = title[len(subject):].lstrip(" -")
-                        
-                        # If no meaningful title, generate one from content
-                        if not title or title.lower() in ["notes", subject.lower()]:
-                            # Generate a descriptive title from the first few words of content
-                            content_words = item['content'].strip().split()
-                            if len(content_words) >= 5:
-                                title = " ".join(content_words[:6])  # Reduced from 8 to 6 words
-                                # Limit title length to 60 characters max
-                                if len(title) > 60:
-                                    title = title[:57] + "..."
-                            else:
-                                title = f"{current_date} Notes"
-                        else:
-                            # Ensure existing title is not too long
-                            if len(title) > 60:
-                                title = title[:57] + "..."
-                        
-                        validated_result.append({
-                            'subject': subject,
-                            'title': title,
-                            'content': item['content'].strip()
-                        })
+                if not parser.finished:
+                    # Not a {"notes": [...]} or [...] document (or cut off): parse it whole
+                    items.clear()
+                    for task in reclassifications.values():
+                        task.cancel()
+                    reclassifications.clear()
+                    
+                    result = json.loads(parser.buffer)
+                    if isinstance(result, dict):
+                        result = result['notes'] if 'notes' in result else [result]
+                    for item in result:
+                        accept(item)
                 
-                return validated_result
+                content_based_subjects = await asyncio.gather(*reclassifications.values())
+            except (json.JSONDecodeError, TypeError):
+                logging.error(f"Failed to parse JSON response from LLaMA3: {parser.buffer}")
+                return self._single_note_fallback(text)
+            finally:
+                for task in reclassifications.values():
+                    task.cancel()
+            
+            for index, content_based_subject in zip(reclassifications, content_based_subjects):
+                item, original_subject = items[index]
+                if content_based_subject:
+                    logging.info(f"Used content-based classification: '{original_subject}' -> '{content_based_subject}'")
+                    items[index] = (item, content_based_subject)
+                else:
+                    logging.info(f"No match found for '{original_subject}', using General")
+                    items[index] = (item, "General")
+            
+            # Validate and clean the result
+            validated_result = []
+            for item, subject in items:
+                # Generate title if not provided or invalid
+                title = item.get('title', '').strip()
                 
-            except json.JSONDecodeError:
-                logging.error(f"Failed to parse JSON response from LLaMA3: {response_text}")
-                # Fallback: treat as single subject
-                subject = self.classify_subject(text, available_subjects) or "General"
-                content_words = text.strip().split()
-                fallback_title = " ".join(content_words[:6]) if len(content_words) >= 5 else f"{current_date} Notes"
-                if len(fallback_title) > 60:
-                    fallback_title = fallback_title[:57] + "..."
-                return [{
-                    'subject': subject,
-                    'title': fallback_title,
-                    'content': text.strip()
-                }]
+                # Remove subject prefix completely if it exists
+                if title.startswith(f"{subject} - "):
+                    title = title[len(f"{subject} - "):]
+                elif title.startswith(subject):
+                    title = title[len(subject):].lstrip(" -")
+                
+                # If no meaningful title, generate one from content
+                if not title or title.lower() in ["notes", subject.lower()]:
+                    # Generate a descriptive title from the first few words of content
+                    content_words = item['content'].strip().split()
+                    if len(content_words) >= 5:
+                        title = " ".join(content_words[:6])  # Reduced from 8 to 6 words
+                        # Limit title length to 60 characters max
+                        if len(title) > 60:
+                            title = title[:57] + "..."
+                    else:
+                        title = f"{current_date} Notes"
+                else:
+                    # Ensure existing title is not too long
+                    if len(title) > 60:
+                        title = title[:57] + "..."
                 
+                validated_result.append({
+                    'subject': subject,
+                    'title': title,
+                    'content': item['content'].strip()
+                })
+            
+            if validated_result:
+                self.cache.put('classify_multi_subject_text', text, available_subjects,
+                               copy.deepcopy(validated_result), semantic=False)
+            if len(validated_result) == 1:
+                self.near_duplicates.put(subjects_key, text[:1000], {
+                    'subject': validated_result[0]['subject'],
+                    'title': validated_result[0]['title']
+                })
+            return validated_result
+            
         except Exception as e:
             logging.error(f"Error in multi-subject classification: {e}")
-            # Fallback: treat as single subject
-            subject = self.classify_subject(text, available_subjects) or "General"
-            content_words = text.strip().split()
-            fallback_title = " ".join(content_words[:6]) if len(content_words) >= 5 else f"{datetime.now().strftime('%A, %B %d, %Y')} Notes"
-            if len(fallback_title) > 60:
-                fallback_title = fallback_title[:57] + "..."
-            return [{
-                'subject': subject,
-                'title': fallback_title,
-                'content': text.strip()
-            }]
+            return self._single_note_fallback(text)
+        finally:
+            await aclient.aclose()
+    
+    def _multi_subject_options(self, text: str) -> Dict:
+        """
+        Deterministic decoding capped at what echoing the text back as JSON needs
+        (roughly one token per four characters, plus room for titles and keys)
+        """
+        return {
+            'num_ctx': LLAMA3_NUM_CTX,
+            'temperature': 0,
+            'num_predict': 512 + len(text) // 3,
+            'stop': ["\n\n\n"]
+        }
+    
+    def _single_note_fallback(self, text: str) -> List[Dict[str, str]]:
+        """
+        The whole text as one General note. The multi-subject call is deterministic,
+        so it is not retried with another model call when it fails.
+        """
+        content_words = text.strip().split()
+        fallback_title = " ".join(content_words[:6]) if len(content_words) >= 5 else f"{datetime.now().strftime('%A, %B %d, %Y')} Notes"
+        if len(fallback_title) > 60:
+            fallback_title = fallback_title[:57] + "..."
+        return [{
+            'subject': "General",
+            'title': fallback_title,
+            'content': text.strip()
+        }]
+
+# Shared instance, so availability probes and caches are not repeated per caller
+classification_service = SubjectClassificationService()
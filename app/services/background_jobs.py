@@ -0,0 +1,152 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, insert, select, update
+
+# Reported for a job whose process stopped before finishing it
+INTERRUPTED_ERROR = 'Processing was interrupted by a server restart. Please upload the image again.'
+
+
+class BackgroundJobQueue:
+    """
+    Runs slow request work (OCR, classification, embedding) on worker threads
+    and records each job's status in the background_job table, so clients can
+    poll for the result through any app process.
+
+    A job function returns (body, status_code) like a JSON view would; the body
+    is stored once the job finishes. A job runs in the process that accepted it,
+    which refreshes the heartbeat of its unfinished jobs every heartbeat_interval
+    seconds. A queued or running job whose heartbeat stops (its process exited or
+    was restarted) is reported as failed. Finished jobs are deleted after
+    retention seconds.
+    """
+
+    def __init__(self, max_workers: int = 2, retention: float = 3600, heartbeat_interval: float = 10):
+        self.retention = retention
+        self.heartbeat_interval = heartbeat_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='background-job')
+        # job_id -> app, for the unfinished jobs of this process
+        self._active = {}
+        self._heartbeat = None
+        self._lock = threading.Lock()
+
+    def submit(self, app, user_id: int, func, *args) -> str:
+        """
+        Queue func(*args) to run inside an application context
+
+        Args:
+            app: Flask application the job needs (database, config)
+            user_id (int): Owner of the job; only they can read its status
+            func: Callable returning (body dict, HTTP status code)
+
+        Returns:
+            str: Job ID
+        """
+        from app import db
+        from app.models import BackgroundJob
+
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        with app.app_context(), db.engine.begin() as connection:
+            connection.execute(
+                delete(BackgroundJob).where(BackgroundJob.finished_at < now - timedelta(seconds=self.retention))
+            )
+            connection.execute(insert(BackgroundJob).values(
+                id=job_id,
+                user_id=user_id,
+                status='queued',
+                worker=f"{socket.gethostname()}:{os.getpid()}",
+                heartbeat_at=now,
+                created_at=now
+            ))
+
+        with self._lock:
+            self._active[job_id] = app
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name='background-job-heartbeat', daemon=True)
+                self._heartbeat.start()
+        self._executor.submit(self._run, job_id, app, func, args)
+        return job_id
+
+    def get(self, job_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+        """Snapshot of a job, or None if it does not exist or belongs to another user"""
+        from app import db
+        from app.models import BackgroundJob
+
+        with db.engine.begin() as connection:
+            job = connection.execute(
+                select(BackgroundJob.__table__).where(BackgroundJob.id == job_id, BackgroundJob.user_id == user_id)
+            ).mappings().first()
+            if job is None:
+                return None
+            job = dict(job)
+
+            stale_before = datetime.utcnow() - timedelta(seconds=3 * self.heartbeat_interval)
+            if job['status'] in ('queued', 'running') and job['heartbeat_at'] < stale_before:
+                job.update(status='failed', result={'error': INTERRUPTED_ERROR}, status_code=500,
+                           finished_at=datetime.utcnow())
+                connection.execute(
+                    update(BackgroundJob)
+                    .where(BackgroundJob.id == job_id, BackgroundJob.status.in_(('queued', 'running')))
+                    .values(status=job['status'], result=job['result'], status_code=job['status_code'],
+                            finished_at=job['finished_at'])
+                )
+        return job
+
+    def _run(self, job_id, app, func, args) -> None:
+        try:
+            self._update(app, job_id, status='running')
+            try:
+                with app.app_context():
+                    body, status_code = func(*args)
+                status = 'finished' if status_code < 400 else 'failed'
+            except Exception as e:
+                logging.error(f"Background job {job_id} failed: {e}")
+                body, status_code, status = {'error': str(e)}, 500, 'failed'
+            self._update(app, job_id, status=status, result=body, status_code=status_code,
+                         finished_at=datetime.utcnow())
+        except Exception as e:
+            logging.error(f"Could not record the status of background job {job_id}: {e}")
+        finally:
+            with self._lock:
+                self._active.pop(job_id, None)
+
+    def _update(self, app, job_id, **fields) -> None:
+        from app import db
+        from app.models import BackgroundJob
+
+        with app.app_context(), db.engine.begin() as connection:
+            connection.execute(update(BackgroundJob).where(BackgroundJob.id == job_id).values(**fields))
+
+    def _beat(self) -> None:
+        """Refresh the heartbeat of this process's unfinished jobs until there are none"""
+        from app import db
+        from app.models import BackgroundJob
+
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                if not self._active:
+                    self._heartbeat = None
+                    return
+                job_ids_by_app = {}
+                for job_id, app in self._active.items():
+                    job_ids_by_app.setdefault(app, []).append(job_id)
+
+            for app, job_ids in job_ids_by_app.items():
+                try:
+                    with app.app_context(), db.engine.begin() as connection:
+                        connection.execute(
+                            update(BackgroundJob)
+                            .where(BackgroundJob.id.in_(job_ids))
+                            .values(heartbeat_at=datetime.utcnow())
+                        )
+                except Exception as e:
+                    logging.warning(f"Could not refresh background job heartbeats: {e}")
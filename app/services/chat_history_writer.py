@@ -0,0 +1,188 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select, update, func
+
+
+class ChatHistoryWriteError(Exception):
+    """Queued chat messages could not be written; they stay queued for the next attempt"""
+
+
+class ChatHistoryWriter:
+    """
+    Persists chat messages on a background thread so the HTTP response does not
+    wait on the database. Messages queued within max_delay of each other are
+    written together in a single transaction, and a failed write is retried with
+    exponential backoff. Messages that still cannot be written are held, not
+    dropped: they are retried with the next batch, and flush() writes a chat's
+    queued and held messages on the calling thread, raising ChatHistoryWriteError
+    if that fails too. Whatever is left when the process exits is written before
+    it does (a killed process loses what it had not written yet).
+    """
+
+    def __init__(self, max_batch: int = 50, max_delay: float = 0.05,
+                 max_attempts: int = 5, retry_delay: float = 0.1):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # (app, chat_id, messages) items, oldest first: not yet picked up by the
+        # background thread, and given up on by it
+        self._pending = []
+        self._held = []
+        # chat_id -> items the background thread is writing right now
+        self._writing = Counter()
+        self._thread = None
+        self._cond = threading.Condition()
+        atexit.register(self._flush_at_exit)
+
+    def enqueue(self, app, chat_id: int, messages: List[Dict[str, Any]]) -> None:
+        """
+        Queue messages for a chat
+
+        Args:
+            app: Flask application whose database the messages belong to
+            chat_id (int): Chat the messages are added to (its updated_at is bumped)
+            messages (List[Dict]): ChatMessage column values, without chat_id
+        """
+        # Timestamped now, so messages written after a retry still sort where they were sent
+        now = datetime.utcnow()
+        messages = [dict(message, created_at=message.get('created_at', now)) for message in messages]
+        with self._cond:
+            self._pending.append((app, chat_id, messages))
+            self._ensure_started()
+            self._cond.notify_all()
+
+    def flush(self, chat_id: Optional[int] = None) -> None:
+        """
+        Write the queued and held messages of a chat on the calling thread, after
+        the background thread has finished writing any of them it already took
+
+        Args:
+            chat_id (int): Chat whose messages must be in the database; every chat when None
+
+        Raises:
+            ChatHistoryWriteError: Some messages could not be written (they are held for later)
+        """
+        def selected(item):
+            return chat_id is None or item[1] == chat_id
+
+        with self._cond:
+            self._cond.wait_for(
+                lambda: not (sum(self._writing.values()) if chat_id is None else self._writing[chat_id])
+            )
+            items = [item for item in self._held + self._pending if selected(item)]
+            self._held = [item for item in self._held if not selected(item)]
+            self._pending = [item for item in self._pending if not selected(item)]
+
+        if not items:
+            return
+        failed = self._write_with_retries(items)
+        if failed:
+            with self._cond:
+                self._held[:0] = failed
+            raise ChatHistoryWriteError(
+                f"{sum(len(messages) for _, _, messages in failed)} chat messages could not be written"
+            )
+
+    def _flush_at_exit(self) -> None:
+        try:
+            self.flush()
+        except ChatHistoryWriteError as e:
+            for _, chat_id, messages in self._held:
+                logging.error(f"Chat messages for chat {chat_id} were lost at exit: {messages}")
+            logging.error(f"Error writing chat history at exit: {e}")
+
+    def _ensure_started(self) -> None:
+        # Called with self._cond held
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='chat-history-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                # Give messages queued right after the first a chance to join its batch
+                self._cond.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.max_delay)
+                # Messages held after earlier failures go first, with the new ones
+                batch = self._held + self._pending[:self.max_batch]
+                self._held = []
+                del self._pending[:self.max_batch]
+                self._writing.update(chat_id for _, chat_id, _ in batch)
+            if not batch:
+                continue
+
+            try:
+                failed = self._write_with_retries(batch)
+            except Exception as e:
+                logging.error(f"Error writing chat history: {e}")
+                failed = batch
+            with self._cond:
+                self._held.extend(failed)
+                self._writing.subtract(chat_id for _, chat_id, _ in batch)
+                self._writing = +self._writing
+                self._cond.notify_all()
+
+    def _write_with_retries(self, batch) -> List:
+        """
+        Write a batch, retrying what fails
+
+        Returns:
+            List: The items that still could not be written
+        """
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            batch = self._write(batch)
+            if not batch:
+                return []
+        logging.error(
+            f"Could not write {sum(len(messages) for _, _, messages in batch)} chat messages after "
+            f"{self.max_attempts} attempts, holding them until the next write"
+        )
+        return batch
+
+    def _write(self, batch) -> List:
+        """
+        Write a batch of queued items
+
+        Returns:
+            List: The items that could not be written
+        """
+        from app import db
+        from app.models import Chat, ChatMessage, bulk_insert
+
+        # Group by application so each write happens inside the right app context
+        by_app = {}
+        for app, chat_id, messages in batch:
+            by_app.setdefault(app, []).append((chat_id, messages))
+
+        failed = []
+        for app, items in by_app.items():
+            with app.app_context():
+                try:
+                    # Chats deleted since the messages were queued get none (SQLite does
+                    # not enforce the foreign key, so they would be left orphaned)
+                    chat_ids = set(db.session.scalars(
+                        select(Chat.id).where(Chat.id.in_({chat_id for chat_id, _ in items}))
+                    ))
+                    rows = [dict(message, chat_id=chat_id)
+                            for chat_id, messages in items if chat_id in chat_ids
+                            for message in messages]
+                    if rows:
+                        bulk_insert(ChatMessage, rows)
+                        db.session.execute(
+                            update(Chat).where(Chat.id.in_(chat_ids)).values(updated_at=func.now())
+                        )
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logging.warning(f"Error writing chat history, will retry: {e}")
+                    failed.extend((app, chat_id, messages) for chat_id, messages in items)
+        return failed
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+import numpy as np
+
+# Returned by LLMCache.get when nothing is cached (None is a valid cached answer)
+MISS = object()
+
+# After an embedding failure the semantic tier pauses for EMBED_RETRY_DELAY seconds,
+# doubling with each further failure up to EMBED_RETRY_MAX_DELAY
+EMBED_RETRY_DELAY = 30
+EMBED_RETRY_MAX_DELAY = 600
+
+
+class LLMCache:
+    """
+    Cache for LLM answers so repeated or near-duplicate notes skip the model.
+
+    The exact tier is an LRU keyed on a digest of the model, prompt template,
+    text and sorted subject list. The semantic tier keeps the embeddings of
+    recent texts per (template, subjects) scope and reuses an answer when a new
+    text embeds within similarity_threshold of a cached one. The semantic tier
+    is only used when an embed function is given, and is paused with exponential
+    backoff after an embedding failure (e.g. the model is still loading or not pulled).
+    """
+
+    def __init__(self, model: str, embed: Optional[Callable[[str], Any]] = None,
+                 max_entries: int = 512, similarity_threshold: float = 0.92,
+                 max_semantic_per_scope: int = 64):
+        self.model = model
+        self.embed = embed
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.max_semantic_per_scope = max_semantic_per_scope
+        self._exact = OrderedDict()
+        self._semantic = {}
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+        # Consecutive embedding failures, and when embedding may be tried again
+        self._embed_failures = 0
+        self._embed_retry_at = 0.0
+
+    def get(self, template_id: str, text: str, subjects: Iterable[str], semantic: bool = True) -> Any:
+        """
+        Look up a cached answer
+
+        Args:
+            template_id (str): Name of the prompt the answer came from
+            text (str): Text that was sent to the model
+            subjects (Iterable[str]): Subject names included in the prompt
+            semantic (bool): Also accept answers for similar texts
+
+        Returns:
+            Any: The cached answer, or MISS
+        """
+        subjects = tuple(sorted(subjects))
+        key = self._key(template_id, text, subjects)
+        with self._lock:
+            if key in self._exact:
+                self._exact.move_to_end(key)
+                return self._exact[key]
+
+        if not semantic:
+            return MISS
+        embedding = self.embedding(text)
+        if embedding is None:
+            return MISS
+
+        with self._lock:
+            entries = self._semantic.get((template_id, subjects))
+            if not entries:
+                return MISS
+            similarities = np.stack([entry[0] for entry in entries]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                logging.info(f"LLM cache: reusing '{template_id}' answer (similarity {similarities[best]:.3f})")
+                return entries[best][1]
+        return MISS
+
+    def put(self, template_id: str, text: str, subjects: Iterable[str], value: Any, semantic: bool = True) -> None:
+        """Store an answer for a text (and its embedding, when semantic lookups apply)"""
+        subjects = tuple(sorted(subjects))
+        key = self._key(template_id, text, subjects)
+        embedding = self.embedding(text) if semantic else None
+        with self._lock:
+            self._exact[key] = value
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+            if embedding is not None:
+                entries = self._semantic.setdefault((template_id, subjects), [])
+                entries.append((embedding, value))
+                del entries[:-self.max_semantic_per_scope]
+
+    def clear(self) -> None:
+        """Drop every cached answer"""
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+            self._embeddings.clear()
+
+    def _key(self, template_id: str, text: str, subjects: Hashable) -> str:
+        payload = json.dumps({
+            'model': self.model,
+            'prompt': template_id,
+            'text': text,
+            'subjects': subjects
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def embedding(self, text: str):
+        """
+        Normalized float32 embedding of text, or None while embeddings are unavailable.
+        Memoized, so get(), put() and callers comparing the same text embed it once.
+        """
+        if self.embed is None or not text.strip():
+            return None
+
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        with self._lock:
+            if digest in self._embeddings:
+                self._embeddings.move_to_end(digest)
+                return self._embeddings[digest]
+
+        if time.monotonic() < self._embed_retry_at:
+            return None
+        try:
+            vector = np.asarray(self.embed(text), dtype=np.float32)
+        except Exception as e:
+            self._embed_failures += 1
+            delay = min(EMBED_RETRY_MAX_DELAY, EMBED_RETRY_DELAY * 2 ** (self._embed_failures - 1))
+            self._embed_retry_at = time.monotonic() + delay
+            logging.warning(f"LLM cache embeddings unavailable, using exact matches only for {delay}s: {e}")
+            return None
+        self._embed_failures = 0
+
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        with self._lock:
+            self._embeddings[digest] = vector
+            while len(self._embeddings) > self.max_entries:
+                self._embeddings.popitem(last=False)
+        return vector
+
+
+def simhash(text: str) -> int:
+    """
+    64-bit SimHash of a text's character 3-grams (case and whitespace insensitive).
+    Texts that differ in a few characters get fingerprints a few bits apart.
+    """
+    normalized = ' '.join(text.lower().split())
+    grams = [normalized[i:i + 3] for i in range(max(1, len(normalized) - 2))]
+    digests = b''.join(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest() for gram in grams)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(grams), 64)
+    # Each bit of the fingerprint is the majority vote of that bit over all 3-grams
+    votes = bits.sum(axis=0) * 2 > len(grams)
+    return int.from_bytes(np.packbits(votes).tobytes(), 'big')
+
+
+class NearDuplicateCache:
+    """
+    LRU of answers keyed by SimHash fingerprint, for texts that are almost identical
+    (e.g. two OCR passes over the same page) rather than merely similar in meaning.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_distance: int = 3):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope: Hashable, text: str) -> Any:
+        """
+        Look up the answer for a text within max_distance bits of a cached one
+
+        Args:
+            scope: Anything else the answer depends on (e.g. the subject list)
+            text (str): Text to look up
+
+        Returns:
+            Any: The cached answer, or MISS
+        """
+        fingerprint = simhash(text)
+        with self._lock:
+            for key in reversed(self._entries):
+                if key[0] == scope and bin(key[1] ^ fingerprint).count('1') <= self.max_distance:
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+        return MISS
+
+    def put(self, scope: Hashable, text: str, value: Any) -> None:
+        """Store the answer for a text"""
+        key = (scope, simhash(text))
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
@@ -0,0 +1,103 @@
+import json
+from typing import Any, AsyncIterator, Iterator, Mapping
+
+import httpx
+import ollama
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _encode_body(kwargs):
+    """Replace a json= request body with the same payload serialized by orjson"""
+    if orjson is not None and 'json' in kwargs:
+        kwargs['content'] = orjson.dumps(kwargs.pop('json'))
+    return kwargs
+
+
+class OrjsonClient(ollama.Client):
+    """
+    Ollama client that serializes request bodies (prompts of several KB with the
+    notes in them) and parses streamed and non-streamed answers with orjson when it
+    is installed. Behaves exactly like ollama.Client otherwise.
+    """
+
+    def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        return super()._request(method, url, **_encode_body(kwargs))
+
+    def _stream(self, method: str, url: str, **kwargs) -> Iterator[Mapping[str, Any]]:
+        with self._client.stream(method, url, **_encode_body(kwargs)) as r:
+            try:
+                r.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                e.response.read()
+                raise ollama.ResponseError(e.response.text, e.response.status_code) from None
+
+            for line in r.iter_lines():
+                partial = _loads(line)
+                if e := partial.get('error'):
+                    raise ollama.ResponseError(e)
+                yield partial
+
+    def _request_stream(self, *args, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream(*args, **kwargs)
+        return _loads(self._request(*args, **kwargs).content)
+
+
+class AsyncOrjsonClient(ollama.AsyncClient):
+    """
+    ollama.AsyncClient counterpart of OrjsonClient. httpx async clients are bound
+    to the event loop that uses them, so create one per loop and close it when
+    done, e.g. with `async with AsyncOrjsonClient() as client:`.
+    """
+
+    def __init__(self, host=None, **kwargs):
+        # The connection pool is created here and handed to the httpx client ollama
+        # builds (ollama passes extra keyword arguments on), so aclose() can release it
+        self._transport = kwargs.setdefault('transport', httpx.AsyncHTTPTransport())
+        super().__init__(host, **kwargs)
+
+    async def aclose(self) -> None:
+        """Close the client's connections"""
+        await self._transport.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        return await super()._request(method, url, **_encode_body(kwargs))
+
+    async def _stream(self, method: str, url: str, **kwargs) -> AsyncIterator[Mapping[str, Any]]:
+        async def inner():
+            async with self._client.stream(method, url, **_encode_body(kwargs)) as r:
+                try:
+                    r.raise_for_status()
+                except httpx.HTTPStatusError as e:
+                    await e.response.aread()
+                    raise ollama.ResponseError(e.response.text, e.response.status_code) from None
+
+                async for line in r.aiter_lines():
+                    partial = _loads(line)
+                    if e := partial.get('error'):
+                        raise ollama.ResponseError(e)
+                    yield partial
+
+        return inner()
+
+    async def _request_stream(self, *args, stream: bool = False, **kwargs):
+        if stream:
+            return await self._stream(*args, **kwargs)
+        response = await self._request(*args, **kwargs)
+        return _loads(response.content)
+
+
+# Shared by the services; reads OLLAMA_HOST like the module-level ollama functions
+ollama_client = OrjsonClient()
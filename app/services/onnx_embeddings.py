@@ -0,0 +1,154 @@
+import logging
+import math
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+try:
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+except ImportError:
+    onnxruntime = None
+
+# Tokens per text; all-MiniLM-L6-v2 was trained with (and sentence-transformers truncates at) 256
+MAX_SEQ_LENGTH = 256
+
+QUANTIZED_MODEL_FILE = 'model_quantized.onnx'
+
+# Single-threaded inference sessions run side by side, one per core by default
+ONNX_SESSIONS = int(os.environ.get('ONNX_SESSIONS') or os.cpu_count() or 1)
+
+
+class OnnxEmbeddingModel:
+    """
+    all-MiniLM-L6-v2 exported to ONNX and dynamically quantized to int8, run with
+    ONNX Runtime on the CPU. The int8 matmuls use VNNI dot-product instructions
+    where the CPU has them. encode() mirrors SentenceTransformer.encode (mean pooling
+    over the attention mask, optional normalization) for the arguments this app uses.
+
+    Batches are spread over a pool of single-threaded sessions, one per worker
+    thread (ONNX Runtime releases the GIL while it runs), instead of one session
+    whose intra-op threads would contend for the same cores.
+    """
+
+    device = 'cpu'
+
+    def __init__(self, model_dir: str, num_sessions: int = ONNX_SESSIONS):
+        """
+        Args:
+            model_dir (str): Directory holding the quantized model and its tokenizer
+            num_sessions (int): Inference sessions (and threads) to run in parallel
+        """
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        sessions = [
+            onnxruntime.InferenceSession(
+                os.path.join(model_dir, QUANTIZED_MODEL_FILE),
+                options,
+                providers=['CPUExecutionProvider']
+            )
+            for _ in range(max(1, num_sessions))
+        ]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._input_names = {model_input.name for model_input in sessions[0].get_inputs()}
+        self._dimension = sessions[0].get_outputs()[0].shape[-1]
+        self._set_sessions(sessions)
+
+    def _set_sessions(self, sessions) -> None:
+        self._num_sessions = len(sessions)
+        # Idle sessions; a worker takes one for each batch and puts it back afterwards
+        self._idle_sessions = queue.Queue()
+        for session in sessions:
+            self._idle_sessions.put(session)
+        self._pool = ThreadPoolExecutor(len(sessions)) if len(sessions) > 1 else None
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dimension
+
+    def encode(self, texts: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False) -> np.ndarray:
+        """
+        Embed texts in batches of at most batch_size, smaller when that keeps every
+        session busy
+
+        Returns:
+            numpy.ndarray: One float32 row per text
+        """
+        if not texts:
+            return np.zeros((0, self._dimension), dtype=np.float32)
+
+        batch_size = max(1, min(batch_size, math.ceil(len(texts) / self._num_sessions)))
+        # Tokenized here, in the calling thread: the Rust tokenizer is not safe to share across threads
+        batches = [
+            self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors='np'
+            )
+            for start in range(0, len(texts), batch_size)
+        ]
+
+        if self._pool is None or len(batches) == 1:
+            rows = [self._embed_batch(tokens) for tokens in batches]
+        else:
+            rows = list(self._pool.map(self._embed_batch, batches))
+
+        embeddings = np.concatenate(rows)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+    def _embed_batch(self, tokens) -> np.ndarray:
+        """Run one tokenized batch through an idle session and mean-pool the token vectors"""
+        feed = {name: value.astype(np.int64) for name, value in tokens.items() if name in self._input_names}
+        session = self._idle_sessions.get()
+        try:
+            hidden = session.run(None, feed)[0]
+        finally:
+            self._idle_sessions.put(session)
+
+        # Mean of the token vectors, ignoring padding
+        mask = tokens['attention_mask'][..., np.newaxis].astype(np.float32)
+        embeddings = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return embeddings.astype(np.float32, copy=False)
+
+
+def load_onnx_model(model_name: str, cache_dir: str) -> Optional[OnnxEmbeddingModel]:
+    """
+    Load the int8 ONNX version of a sentence-transformers model, exporting and
+    quantizing it into cache_dir the first time
+
+    Args:
+        model_name (str): Hugging Face model id, e.g. 'sentence-transformers/all-MiniLM-L6-v2'
+        cache_dir (str): Directory the quantized model is kept in
+
+    Returns:
+        Optional[OnnxEmbeddingModel]: The model, or None when ONNX Runtime and optimum
+        are not installed or the export fails
+    """
+    if onnxruntime is None:
+        return None
+
+    try:
+        if not os.path.exists(os.path.join(cache_dir, QUANTIZED_MODEL_FILE)):
+            logging.info(f"Exporting {model_name} to ONNX with int8 weights in {cache_dir}")
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            quantizer = ORTQuantizer.from_pretrained(model)
+            quantizer.quantize(
+                save_dir=cache_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(cache_dir)
+        return OnnxEmbeddingModel(cache_dir)
+    except Exception as e:
+        logging.warning(f"ONNX embedding model unavailable, using PyTorch: {e}")
+        return None
@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+
+class QueryCache:
+    """
+    Cache of chatbot answers keyed by question embedding.
+
+    Entries are sharded by (user_id, scope), where scope holds everything else the
+    answer depends on (subject filter, context size). Embeddings are quantized to
+    int8 on insertion (a quarter of the memory, and cosine similarity is unaffected
+    by the per-vector scale), and each shard stacks them into one contiguous (N, D)
+    int8 matrix the first time it is searched after a change, so a lookup is a single
+    batched similarity call (SimSIMD's int8 kernels when installed, otherwise numpy).
+    An answer is reused when a new question embeds within
+    similarity_threshold of a cached one. Entries expire after ttl_seconds, the
+    least recently used are evicted beyond max_size, and a user's entries are
+    dropped whenever their notes change.
+    """
+
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 600,
+                 similarity_threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        # (user_id, scope) -> {'entries': [entry, ...], 'matrix': stacked embeddings or None}
+        self._shards = {}
+        # id(entry) -> (shard key, entry), in least recently used order
+        self._lru = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, user_id: int, scope: Hashable, embedding) -> Optional[Dict[str, Any]]:
+        """
+        Look up the answer to a question close to a cached one
+
+        Args:
+            user_id (int): Owner of the answer
+            scope: Any other parameters the answer depends on
+            embedding: Question embedding
+
+        Returns:
+            Optional[Dict]: The cached result, or None on a miss
+        """
+        key = (user_id, scope)
+        with self._lock:
+            self._expire(key)
+            shard = self._shards.get(key)
+            if shard is None:
+                return None
+            if shard['matrix'] is None:
+                shard['matrix'] = np.stack([entry['emb'] for entry in shard['entries']])
+            similarities = cosine_similarities(shard['matrix'], quantize(embedding))
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            entry = shard['entries'][best]
+            self._lru.move_to_end(id(entry))
+            return entry['result']
+
+    def put(self, user_id: int, scope: Hashable, embedding, result: Dict[str, Any]) -> None:
+        """Store the result for a question"""
+        key = (user_id, scope)
+        entry = {'emb': quantize(embedding), 'result': result, 'ts': time.monotonic()}
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = self._shards[key] = {'entries': [], 'matrix': None}
+            shard['entries'].append(entry)
+            shard['matrix'] = None
+            self._lru[id(entry)] = (key, entry)
+            while len(self._lru) > self.max_size:
+                _, (old_key, old_entry) = self._lru.popitem(last=False)
+                self._remove(old_key, [old_entry])
+
+    def invalidate_user(self, user_id: Optional[int]) -> None:
+        """Drop every cached answer for a user"""
+        with self._lock:
+            for key in [key for key in self._shards if key[0] == user_id]:
+                for entry in self._shards.pop(key)['entries']:
+                    self._lru.pop(id(entry), None)
+
+    def clear(self) -> None:
+        """Drop every cached answer"""
+        with self._lock:
+            self._shards.clear()
+            self._lru.clear()
+
+    def _expire(self, key) -> None:
+        shard = self._shards.get(key)
+        if shard is None:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        expired = [entry for entry in shard['entries'] if entry['ts'] < cutoff]
+        if expired:
+            for entry in expired:
+                self._lru.pop(id(entry), None)
+            self._remove(key, expired)
+
+    def _remove(self, key, entries) -> None:
+        shard = self._shards.get(key)
+        if shard is None:
+            return
+        removed = {id(entry) for entry in entries}
+        shard['entries'] = [entry for entry in shard['entries'] if id(entry) not in removed]
+        shard['matrix'] = None
+        if not shard['entries']:
+            del self._shards[key]
+
+
+def quantize(embedding):
+    """
+    Symmetric int8 quantization of an embedding (values scaled so the largest is +/-127)
+
+    Args:
+        embedding: Float vector
+
+    Returns:
+        numpy.ndarray: int8 vector
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    scale = float(np.max(np.abs(vector))) / 127 if vector.size else 0
+    if not scale:
+        return np.zeros(vector.shape, dtype=np.int8)
+    return np.round(vector / scale).astype(np.int8)
+
+
+def cosine_similarities(matrix, vector):
+    """
+    Cosine similarity of an int8 vector to every row of an int8 matrix
+
+    Args:
+        matrix: (N, D) int8 array
+        vector: (D,) int8 array
+
+    Returns:
+        numpy.ndarray: N similarities (0 for all-zero vectors)
+    """
+    if simsimd is not None:
+        return 1 - np.asarray(simsimd.cdist(vector[np.newaxis], matrix, metric='cosine'))[0]
+    # Accumulate in int32: int8 products overflow int8
+    dots = (matrix @ vector.astype(np.int32)).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+
+# Answers shared by every chatbot instance and invalidated by the vector service on note writes
+query_cache = QueryCache()
@@ -1,21 +1,242 @@
 import logging
-from typing import List, Dict, Any, Optional
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from app.services.vector_embeddings import VectorEmbeddingService
-from app.services.ai_classification import SubjectClassificationService
-import ollama
+from app.services.ai_classification import classification_service, OLLAMA_KEEP_ALIVE, LLAMA3_NUM_CTX
+from app.services.query_cache import query_cache
+from flask import current_app
+from app.services.ollama_client import ollama_client
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Answers come from the full model; short utility prompts (chat titles) go to a 1B
+# 4-bit model that needs a fraction of the compute per token. Pull both, and run the
+# server with OLLAMA_MAX_LOADED_MODELS=3 so that neither of them nor nomic-embed-text
+# (classification cache and subject matching) is unloaded when another one is used
+BIG_MODEL = 'llama3'
+SMALL_MODEL = 'llama3.2:1b-instruct-q4_0'
+
+# Notes scoring lower than this are neither given to the model nor shown as sources
+MIN_SOURCE_RELEVANCE = 0.3
+
+# Questions answered at once by search_and_answer_batch: one per request the Ollama server
+# runs in parallel (OLLAMA_NUM_PARALLEL, see .env.example), since more would only queue there
+BATCH_ANSWER_WORKERS = int(os.environ.get('OLLAMA_NUM_PARALLEL') or 4)
+
+# Answer returned when Ollama fails mid-generation; never cached
+GENERATION_FAILED_ANSWER = "I'm having trouble generating an answer right now. Please try again later."
+
+# Everything that is the same on every question goes in the system message, ahead of the
+# notes and question, so Ollama can reuse the cached prefix instead of re-reading it
+RAG_SYSTEM_PROMPT = """You are a helpful study assistant that answers questions based on the user's personal study notes. You have access to notes from multiple subjects and should be aware of the subject context. Be concise and accurate.
+
+INSTRUCTIONS:
+1. If the question asks about a specific subject, focus on notes from that subject
+2. If multiple subjects are relevant, mention which subjects contain relevant information
+3. Provide specific references to note titles when possible
+4. If the context doesn't contain enough information to answer the question, say so clearly
+5. Keep your response concise but informative
+6. When mentioning information, indicate which subject/note it comes from"""
+
+RAG_USER_TEMPLATE = """AVAILABLE SUBJECTS IN NOTES:
+{subjects}
+
+RELEVANT NOTES FOUND:
+{notes}
+
+USER QUESTION: {question}
+
+Answer:"""
+
+CONTEXT_NOTE_TEMPLATE = "Note {index} - Subject: {subject} (Title: {title}):\n{text}\n"
+
+# Characters of each note's text given to the model; long OCR'd notes are cut rather
+# than letting their middle crowd out the other notes and the question
+CONTEXT_NOTE_MAX_CHARS = 800
+
+# When the best note scores at least CONFIDENT_RELEVANCE, notes scoring below
+# RELEVANCE_CLIFF times its score are left out of the prompt (sources still list them)
+CONFIDENT_RELEVANCE = 0.85
+RELEVANCE_CLIFF = 0.6
+
+# The context size shared by every llama3 request, so answering never reloads the model
+RAG_ANSWER_OPTIONS = {'num_ctx': LLAMA3_NUM_CTX}
+
+CHAT_TITLE_PROMPT = """Generate a short, descriptive title (max 6 words) for a chat conversation that starts with this question: "{question}"
+
+The title should capture the main topic or subject being asked about. Do not include quotes or extra formatting.
+
+Examples:
+- "What is photosynthesis?" → "Photosynthesis Questions"
+- "Help me understand calculus derivatives" → "Calculus Derivatives Help"
+- "Explain quantum physics concepts" → "Quantum Physics Concepts"
+
+Question: {question}
+Title:"""
+
+# A six-word title never needs more tokens than this
+CHAT_TITLE_OPTIONS = {'num_predict': 12}
+
+TITLE_WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9+#'-]*")
+
+# Question filler that says nothing about a chat's topic
+TITLE_STOPWORDS = frozenset("""
+    about above after again all also and any are because been before being between both but can
+    could did does doing don down during each explain few for from further give had has have having
+    help her here hers him his how into its itself just know learn learned let like made make many
+    may more most much must mine myself need not notes now off once only other our ours out over own
+    please same say she should show some such summarize summary tell than that the their theirs them
+    then there these they thing things this those through too under understand until use used very
+    want was way were what when where which while who whom why will with would you your yours
+""".split())
+
+# Words that point a question at a subject, keyed by the subject they suggest
+SUBJECT_KEYWORDS = {
+    'math': ['math', 'mathematics', 'calculus', 'algebra', 'geometry', 'trigonometry'],
+    'physics': ['physics', 'mechanics', 'thermodynamics', 'electricity', 'magnetism'],
+    'chemistry': ['chemistry', 'organic', 'inorganic', 'chemical', 'molecule'],
+    'biology': ['biology', 'anatomy', 'physiology', 'genetics', 'cell'],
+    'computer science': ['programming', 'coding', 'algorithm', 'data structure', 'software'],
+    'history': ['history', 'historical', 'ancient', 'medieval', 'modern'],
+    'literature': ['literature', 'poetry', 'novel', 'author', 'writing'],
+    'economics': ['economics', 'market', 'economy', 'finance', 'money']
+}
+
+# Seconds a user's subject names are reused before they are read from the database again
+SUBJECT_CACHE_TTL = 30
+
+class KeywordMatcher:
+    """
+    Finds which of a fixed set of keywords occur in a text with a single scan: an
+    Aho-Corasick automaton when pyahocorasick is installed, otherwise one compiled
+    regex alternation. Both report the same matches: scanning left to right, the
+    longest keyword starting at each position, never overlapping an earlier match
+    (so "biology" is found once, not also as "bio").
+    """
+    
+    def __init__(self, keywords: Dict[str, Any]):
+        """
+        Args:
+            keywords (Dict[str, Any]): Keyword to the value reported when it is found
+        """
+        self._values = dict(keywords)
+        self._automaton = None
+        self._pattern = None
+        if not self._values:
+            return
+        
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword, value in self._values.items():
+                self._automaton.add_word(keyword, (len(keyword), value))
+            self._automaton.make_automaton()
+        else:
+            # Longest first, so a keyword wins over any keyword it contains
+            self._pattern = re.compile("|".join(
+                re.escape(keyword) for keyword in sorted(self._values, key=len, reverse=True)
+            ))
+    
+    def find(self, text: str) -> Iterator[Any]:
+        """Values of the keywords found in text, in the order they occur"""
+        if self._automaton is not None:
+            # The automaton reports every match, overlapping ones included; keep what the
+            # regex alternation would match
+            matches = sorted((
+                (end - length + 1, -length, value)
+                for end, (length, value) in self._automaton.iter(text)
+            ), key=lambda match: match[:2])
+            next_start = 0
+            for start, negative_length, value in matches:
+                if start >= next_start:
+                    next_start = start - negative_length
+                    yield value
+        elif self._pattern is not None:
+            for match in self._pattern.finditer(text):
+                yield self._values[match.group()]
+
+# Every SUBJECT_KEYWORDS keyword, scanned for in one pass; built once at import
+SUBJECT_KEYWORD_MATCHER = KeywordMatcher({
+    keyword: subject_name
+    for subject_name, keywords in SUBJECT_KEYWORDS.items()
+    for keyword in keywords
+})
+
+@dataclass(frozen=True)
+class UserSubjects:
+    """What the chatbot derives from one user's subjects"""
+    names: Tuple[str, ...]
+    matcher: KeywordMatcher
+    subject_for_keywords: Dict[str, str]
+    suggestions: Tuple[str, ...]
+
+class SubjectCache:
+    """
+    Per-user UserSubjects, rebuilt at most every ttl
+    seconds, or sooner when the subject routes invalidate the user
+    """
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # user_id -> (expiry, value)
+        self._entries = {}
+        # user_id -> number of invalidations, so a rebuild racing one is not stored
+        self._versions = {}
+        self._lock = threading.RLock()
+    
+    def get(self, user_id: int, build):
+        """
+        The cached value for a user, or build(user_id) on a miss
+        
+        Args:
+            user_id (int): User whose subjects the value comes from
+            build: Function reading the subjects and returning the value
+        """
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            version = self._versions.get(user_id, 0)
+        
+        value = build(user_id)
+        with self._lock:
+            if self._versions.get(user_id, 0) == version:
+                self._entries[user_id] = (time.monotonic() + self.ttl, value)
+        return value
+    
+    def invalidate(self, user_id: int) -> None:
+        """Forget a user's value after their subjects change"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+# Shared by every chatbot instance and invalidated by the subject routes
+subject_cache = SubjectCache(SUBJECT_CACHE_TTL)
 
 class RAGChatbotService:
     def __init__(self):
         self.vector_service = VectorEmbeddingService()
-        self.classification_service = SubjectClassificationService()
-        self.enabled = False
-        
-        # Check if services are available
+        self.classification_service = classification_service
+        self._pool = ThreadPoolExecutor(max_workers=BATCH_ANSWER_WORKERS)
+    
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether both services are available. Checked per question rather than here, so
+        the embedding model is only loaded by the first question that needs it
+        """
         if self.vector_service.enabled and self.classification_service.enabled:
-            self.enabled = True
-            logging.info("RAG Chatbot service initialized successfully")
-        else:
-            logging.warning("RAG Chatbot service disabled - dependencies not available")
+            return True
+        logging.warning("RAG Chatbot service disabled - dependencies not available")
+        return False
     
     def search_and_answer(self, question: str, user_id: int, max_context_notes: int = 3) -> Dict[str, Any]:
         """
@@ -29,199 +250,259 @@ class RAGChatbotService:
         Returns:
             Dict containing answer, sources, and metadata
         """
+        for kind, value in self.search_and_answer_stream(question, user_id, max_context_notes):
+            if kind == "result":
+                return value
+    
+    def search_and_answer_batch(self, questions: List[Tuple[str, int]],
+                                max_context_notes: int = 3) -> List[Dict[str, Any]]:
+        """
+        Answer several questions (e.g. from different users) concurrently
+        
+        Args:
+            questions (List[Tuple[str, int]]): (question, user_id) pairs
+            max_context_notes (int): Maximum number of notes to use as context
+            
+        Returns:
+            List[Dict]: search_and_answer's result for each pair, in order
+        """
+        # The same question from the same user is answered once
+        unique = list(dict.fromkeys(questions))
+        app = current_app._get_current_object()
+        
+        def answer(pair):
+            # Subject lookups need an app context (and their own session) in the worker
+            with app.app_context():
+                return self.search_and_answer(pair[0], pair[1], max_context_notes)
+        
+        answers = dict(zip(unique, self._pool.map(answer, unique)))
+        return [dict(answers[pair]) for pair in questions]
+    
+    def search_and_answer_stream(self, question: str, user_id: int,
+                                 max_context_notes: int = 3) -> Iterator[Tuple[str, Any]]:
+        """
+        search_and_answer that yields the answer while Ollama is still generating it
+        
+        Args:
+            question (str): User's question
+            user_id (int): User ID for note filtering
+            max_context_notes (int): Maximum number of notes to use as context
+            
+        Yields:
+            ("token", str) for each piece of a newly generated answer, then
+            ("result", Dict) with the same fields search_and_answer returns
+        """
         if not self.enabled:
-            return {
+            yield "result", {
                 "answer": "Sorry, the chatbot service is currently unavailable.",
                 "sources": [],
                 "sources_detailed": [],
                 "confidence": 0.0
             }
+            return
         
         try:
             # Detect if the question mentions specific subjects
             subject_filter = self._detect_subject_in_question(question, user_id)
             
+            # The same or a near-identical question answered recently needs no generation
+            question_vector = self.vector_service.embed_many([question])[0]
+            cache_scope = (subject_filter, max_context_notes)
+            cached = query_cache.get(user_id, cache_scope, question_vector)
+            if cached is not None:
+                yield "result", dict(cached)
+                return
+            
             # Search for relevant notes using vector similarity
             search_results = self.vector_service.search_notes(
                 query=question,
                 user_id=user_id,
-                n_results=max_context_notes * 2,  # Get more to filter later
-                subject_filter=subject_filter
+                n_results=max_context_notes,
+                subject_filter=subject_filter,
+                query_vector=question_vector,
+                min_score=MIN_SOURCE_RELEVANCE
             )
             
             if not search_results:
-                return {
+                yield "result", {
                     "answer": "I couldn't find any relevant notes to answer your question. Try asking about topics you have notes on.",
                     "sources": [],
                     "sources_detailed": [],
                     "confidence": 0.0
                 }
+                return
             
-            # Build context from search results
-            context = self._build_context(search_results)
-            
-            # Generate answer using Ollama
-            answer = self._generate_answer(question, context)
-            
-            # Extract source information - filter for high relevance only
-            sources = []
-            sources_detailed = []
-            
-            for result in search_results:
-                # Only include sources with relevance score > 0.3 (adjust threshold as needed)
-                if result.get("relevance_score", 0) > 0.3:
-                    # Basic source info for web display
-                    sources.append({
-                        "note_id": result["note_id"],
-                        "title": result["title"],
-                        "relevance_score": result["relevance_score"],
-                        "excerpt": result.get("matched_text", "")[:150] + "..." if len(result.get("matched_text", "")) > 150 else result.get("matched_text", "")
-                    })
-                    
-                    # Detailed source info for tkinter display
-                    sources_detailed.append({
-                        "note_id": result["note_id"],
-                        "title": result["title"],
-                        "content": result.get("matched_text", ""),
-                        "subject": result.get("subject_name", ""),
-                        "created_at": result.get("created_at", ""),
-                        "similarity_score": result["relevance_score"]
-                    })
-            
-            # Limit to top 3 most relevant sources
-            sources = sources[:max_context_notes]
-            sources_detailed = sources_detailed[:max_context_notes]
-            
-            return {
-                "answer": answer,
-                "sources": sources,
-                "sources_detailed": sources_detailed,
-                "confidence": min([r["relevance_score"] for r in search_results])
-            }
+            # Build context from the results worth reading
+            context = self._build_context(self._context_results(search_results))
+            sources, sources_detailed, confidence = self._select_sources(search_results, max_context_notes)
             
         except Exception as e:
             logging.error(f"Error in RAG chatbot: {e}")
-            return {
+            yield "result", {
                 "answer": "Sorry, I encountered an error while processing your question.",
                 "sources": [],
                 "sources_detailed": [],
                 "confidence": 0.0
             }
+            return
+        
+        # Generate answer using Ollama, passing each piece on as it arrives
+        pieces = []
+        failed = False
+        try:
+            for piece in self._generate_answer_stream(question, context):
+                pieces.append(piece)
+                yield "token", piece
+        except Exception as e:
+            logging.error(f"Error generating answer with Ollama: {e}")
+            failed = True
+        
+        result = {
+            "answer": GENERATION_FAILED_ANSWER if failed else "".join(pieces).strip(),
+            "sources": sources,
+            "sources_detailed": sources_detailed,
+            "confidence": confidence
+        }
+        if not failed:
+            query_cache.put(user_id, cache_scope, question_vector, dict(result))
+        yield "result", result
     
-    def _build_context(self, search_results: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Build context with subject organization from search results"""
-        context_parts = []
-        subjects_info = {}
+    def _select_sources(self, search_results: List[Dict[str, Any]],
+                        max_context_notes: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], float]:
+        """
+        Source lists (web and detailed) for the most relevant search results, and the
+        answer's confidence (the best relevance score), gathered in one pass
+        """
+        sources = []
+        sources_detailed = []
+        max_score = 0.0
         
-        for i, result in enumerate(search_results, 1):
-            subject = result.get('subject', 'No Subject')
+        for result in search_results:
+            score = result.get("relevance_score", 0)
+            if score > max_score:
+                max_score = score
+            
+            # search_notes already dropped results below MIN_SOURCE_RELEVANCE
+            if len(sources) >= max_context_notes:
+                continue
             
-            # Organize by subject
-            if subject not in subjects_info:
-                subjects_info[subject] = []
+            note_id = result["note_id"]
+            title = result["title"]
+            matched_text = result.get("matched_text", "")
             
-            subjects_info[subject].append({
-                'index': i,
-                'title': result['title'],
-                'content': result.get('matched_text', ''),
-                'relevance': result.get('relevance_score', 0)
+            # Basic source info for web display
+            sources.append({
+                "note_id": note_id,
+                "title": title,
+                "relevance_score": score,
+                "excerpt": matched_text[:150] + "..." if len(matched_text) > 150 else matched_text
             })
             
-            # Build context part
-            context_parts.append(
-                f"Note {i} - Subject: {subject} (Title: {result['title']}):\n{result.get('matched_text', '')}\n"
+            # Detailed source info for tkinter display
+            sources_detailed.append({
+                "note_id": note_id,
+                "title": title,
+                "content": matched_text,
+                "subject": result.get("subject_name", ""),
+                "created_at": result.get("created_at", ""),
+                "similarity_score": score
+            })
+        
+        return sources, sources_detailed, max_score
+    
+    def _context_results(self, search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        The search results to put in the prompt: all of them, unless the best one is a
+        confident match and the rest fall off a cliff behind it (every token of context
+        adds to the time before the first token of the answer)
+        """
+        top_score = search_results[0].get('relevance_score', 0)
+        if top_score < CONFIDENT_RELEVANCE:
+            return search_results
+        cutoff = next(
+            (i for i, result in enumerate(search_results)
+             if result.get('relevance_score', 0) < top_score * RELEVANCE_CLIFF),
+            len(search_results)
+        )
+        return search_results[:cutoff]
+    
+    def _build_context(self, search_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Build the notes section of the prompt and the per-subject note counts from search results"""
+        subjects = [result.get('subject', 'No Subject') for result in search_results]
+        context_parts = [
+            CONTEXT_NOTE_TEMPLATE.format(
+                index=i,
+                subject=subject,
+                title=result['title'],
+                text=self._truncate(result.get('matched_text', ''), CONTEXT_NOTE_MAX_CHARS)
             )
+            for i, (subject, result) in enumerate(zip(subjects, search_results), 1)
+        ]
         
         return {
             'context_text': "\n".join(context_parts),
-            'subjects_info': subjects_info,
+            'subject_counts': Counter(subjects),
             'total_notes': len(search_results)
         }
     
-    def _generate_answer(self, question: str, context: Dict[str, Any]) -> str:
-        """Generate answer using Ollama with subject-aware prompting"""
-        try:
-            # Build subject summary
-            subjects_summary = []
-            for subject, notes in context['subjects_info'].items():
-                note_count = len(notes)
-                subjects_summary.append(f"- {subject}: {note_count} note{'s' if note_count > 1 else ''}")
-            
-            subjects_text = "\n".join(subjects_summary) if subjects_summary else "No specific subjects identified"
-            
-            # Create enhanced prompt with subject awareness
-            prompt = f"""You are a helpful assistant that answers questions based on the user's personal study notes. You have access to notes from multiple subjects and should be aware of the subject context.
-
-AVAILABLE SUBJECTS IN NOTES:
-{subjects_text}
-
-RELEVANT NOTES FOUND:
-{context['context_text']}
-
-USER QUESTION: {question}
-
-INSTRUCTIONS:
-1. If the question asks about a specific subject, focus on notes from that subject
-2. If multiple subjects are relevant, mention which subjects contain relevant information
-3. Provide specific references to note titles when possible
-4. If the context doesn't contain enough information to answer the question, say so clearly
-5. Keep your response concise but informative
-6. When mentioning information, indicate which subject/note it comes from
-
-Answer:"""
-
-            response = ollama.chat(
-                model='llama3',
-                messages=[
-                    {
-                        'role': 'system',
-                        'content': 'You are a helpful study assistant that answers questions based on personal notes. Be aware of different subjects and provide subject-specific responses when appropriate. Be concise and accurate.'
-                    },
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ]
-            )
-            
-            return response['message']['content'].strip()
-            
-        except Exception as e:
-            logging.error(f"Error generating answer with Ollama: {e}")
-            return "I'm having trouble generating an answer right now. Please try again later."
+    @staticmethod
+    def _truncate(text: str, max_chars: int) -> str:
+        """Cut text to at most max_chars, at a word boundary when there is one"""
+        if len(text) <= max_chars:
+            return text
+        return text[:max_chars].rsplit(' ', 1)[0] + "..."
+    
+    def _generate_answer_stream(self, question: str, context: Dict[str, Any]) -> Iterator[str]:
+        """Generate answer using Ollama with subject-aware prompting, yielding it piece by piece"""
+        # Build subject summary
+        subjects_summary = [
+            f"- {subject}: {note_count} note{'s' if note_count > 1 else ''}"
+            for subject, note_count in context['subject_counts'].items()
+        ]
+        
+        subjects_text = "\n".join(subjects_summary) if subjects_summary else "No specific subjects identified"
+        
+        stream = ollama_client.chat(
+            model=BIG_MODEL,
+            messages=[
+                {
+                    'role': 'system',
+                    'content': RAG_SYSTEM_PROMPT
+                },
+                {
+                    'role': 'user',
+                    'content': RAG_USER_TEMPLATE.format(
+                        subjects=subjects_text,
+                        notes=context['context_text'],
+                        question=question
+                    )
+                }
+            ],
+            options=RAG_ANSWER_OPTIONS,
+            stream=True,
+            keep_alive=OLLAMA_KEEP_ALIVE
+        )
+        
+        for chunk in stream:
+            yield chunk['message']['content']
 
     def _detect_subject_in_question(self, question: str, user_id: int) -> str:
         """Detect if the question mentions a specific subject"""
         try:
-            # Get user's subjects from database
-            from app.models import Subject
-            user_subjects = Subject.query.filter_by(user_id=user_id).all()
+            user_subjects = subject_cache.get(user_id, self._load_user_subjects)
+            name_matcher = user_subjects.matcher
+            subject_for_keywords = user_subjects.subject_for_keywords
             
             question_lower = question.lower()
             
             # Check for exact subject name matches
-            for subject in user_subjects:
-                if subject.name.lower() in question_lower:
-                    return subject.name
+            for subject_name in name_matcher.find(question_lower):
+                return subject_name
             
-            # Check for common subject keywords
-            subject_keywords = {
-                'math': ['math', 'mathematics', 'calculus', 'algebra', 'geometry', 'trigonometry'],
-                'physics': ['physics', 'mechanics', 'thermodynamics', 'electricity', 'magnetism'],
-                'chemistry': ['chemistry', 'organic', 'inorganic', 'chemical', 'molecule'],
-                'biology': ['biology', 'anatomy', 'physiology', 'genetics', 'cell'],
-                'computer science': ['programming', 'coding', 'algorithm', 'data structure', 'software'],
-                'history': ['history', 'historical', 'ancient', 'medieval', 'modern'],
-                'literature': ['literature', 'poetry', 'novel', 'author', 'writing'],
-                'economics': ['economics', 'market', 'economy', 'finance', 'money']
-            }
-            
-            for subject_name, keywords in subject_keywords.items():
-                if any(keyword in question_lower for keyword in keywords):
-                    # Check if user has a subject that matches
-                    for subject in user_subjects:
-                        if subject_name.lower() in subject.name.lower() or subject.name.lower() in subject_name.lower():
-                            return subject.name
+            # Check for common subject keywords the user has a matching subject for
+            for keyword_subject in SUBJECT_KEYWORD_MATCHER.find(question_lower):
+                if keyword_subject in subject_for_keywords:
+                    return subject_for_keywords[keyword_subject]
             
             return None  # No specific subject detected
             
@@ -229,25 +510,56 @@ Answer:"""
             logging.error(f"Error detecting subject in question: {e}")
             return None
     
-    def generate_chat_title(self, question: str) -> str:
-        """Generate a descriptive title for a chat based on the first question"""
+    def _load_user_subjects(self, user_id: int) -> UserSubjects:
+        """
+        The user's subject names, a matcher for them, the user's subject for each
+        SUBJECT_KEYWORDS entry that has one, and their suggested questions (cached in
+        subject_cache)
+        """
+        # Get user's subjects from database
+        from app.models import Subject
+        subject_names = [name for (name,) in Subject.query.filter_by(user_id=user_id).with_entities(Subject.name)]
+        
+        names = {}
+        for subject_name in subject_names:
+            names.setdefault(subject_name.lower(), subject_name)
+        
+        subject_for_keywords = {}
+        for keyword_subject in SUBJECT_KEYWORDS:
+            for subject_name in subject_names:
+                if keyword_subject in subject_name.lower() or subject_name.lower() in keyword_subject:
+                    subject_for_keywords[keyword_subject] = subject_name
+                    break
+        
+        return UserSubjects(
+            names=tuple(subject_names),
+            matcher=KeywordMatcher(names),
+            subject_for_keywords=subject_for_keywords,
+            suggestions=tuple(self._suggested_questions(subject_names[:3]))
+        )
+    
+    def generate_chat_title(self, question: str, user_id: Optional[int] = None) -> str:
+        """
+        Generate a descriptive title for a chat based on the first question
+        
+        Args:
+            question (str): First question of the chat
+            user_id (Optional[int]): Owner of the chat, to name the subject asked about
+            
+        Returns:
+            str: Title from the question's keywords, or from Ollama when it has too few
+        """
+        title = self._keyword_chat_title(question, user_id)
+        if title:
+            return title
+        
         try:
             # Use Ollama to generate a concise title
-            prompt = f"""Generate a short, descriptive title (max 6 words) for a chat conversation that starts with this question: "{question}"
-
-The title should capture the main topic or subject being asked about. Do not include quotes or extra formatting.
-
-Examples:
-- "What is photosynthesis?" → "Photosynthesis Questions"
-- "Help me understand calculus derivatives" → "Calculus Derivatives Help"
-- "Explain quantum physics concepts" → "Quantum Physics Concepts"
-
-Question: {question}
-Title:"""
-
-            response = ollama.chat(
-                model='llama3',
-                messages=[{'role': 'user', 'content': prompt}]
+            response = ollama_client.chat(
+                model=SMALL_MODEL,
+                messages=[{'role': 'user', 'content': CHAT_TITLE_PROMPT.format(question=question)}],
+                options=CHAT_TITLE_OPTIONS,
+                keep_alive=OLLAMA_KEEP_ALIVE
             )
             
             title = response['message']['content'].strip()
@@ -263,32 +575,31 @@ Title:"""
             # Fallback: extract key words from question
             words = question.split()[:4]
             return " ".join(words).title() + "..."
+    
+    def _keyword_chat_title(self, question: str, user_id: Optional[int] = None) -> Optional[str]:
+        """Title made of the first three content words of the question, or None if it has fewer than two"""
+        keywords = {}
+        for word in TITLE_WORD_PATTERN.findall(question):
+            # Contractions count as their first word ("how's" is "how")
+            if len(word) > 2 and word.lower().split("'")[0] not in TITLE_STOPWORDS:
+                keywords.setdefault(word.lower(), word if word.isupper() else word.capitalize())
+        if len(keywords) < 2:
+            return None
+        
+        title = " ".join(list(keywords.values())[:3])
+        if user_id is not None:
+            subject = self._detect_subject_in_question(question, user_id)
+            if subject and subject.lower() not in title.lower():
+                title = f"{title} - {subject}"
+        
+        if len(title) > 50:
+            title = title[:47] + "..."
+        return title
 
     def get_suggested_questions(self, user_id: int) -> List[str]:
-        """Generate suggested questions based on user's notes and subjects"""
+        """Suggested questions based on user's subjects, built when the subjects are loaded"""
         try:
-            # Get user's subjects
-            from app.models import Subject
-            user_subjects = Subject.query.filter_by(user_id=user_id).limit(3).all()
-            
-            suggestions = [
-                "What are the main topics in my notes?",
-                "Can you summarize my recent notes?",
-                "What have I been studying recently?",
-                "What questions should I review for my exams?"
-            ]
-            
-            # Add subject-specific suggestions
-            if user_subjects:
-                for subject in user_subjects[:2]:  # Limit to 2 subjects
-                    suggestions.append(f"What have I learned about {subject.name}?")
-                
-                # Add a general subject overview question
-                subject_names = [s.name for s in user_subjects]
-                if len(subject_names) > 1:
-                    suggestions.append(f"Compare my notes on {subject_names[0]} and {subject_names[1]}")
-            
-            return suggestions[:5]  # Return max 5 suggestions
+            return list(subject_cache.get(user_id, self._load_user_subjects).suggestions)
             
         except Exception as e:
             logging.error(f"Error generating suggestions: {e}")
@@ -297,3 +608,24 @@ Title:"""
                 "What topics do I have notes on?",
                 "Summarize my study materials"
             ]
+    
+    @staticmethod
+    def _suggested_questions(subject_names: List[str]) -> List[str]:
+        """Generate suggested questions for a user's first subjects"""
+        suggestions = [
+            "What are the main topics in my notes?",
+            "Can you summarize my recent notes?",
+            "What have I been studying recently?",
+            "What questions should I review for my exams?"
+        ]
+        
+        # Add subject-specific suggestions
+        if subject_names:
+            for subject_name in subject_names[:2]:  # Limit to 2 subjects
+                suggestions.append(f"What have I learned about {subject_name}?")
+            
+            # Add a general subject overview question
+            if len(subject_names) > 1:
+                suggestions.append(f"Compare my notes on {subject_names[0]} and {subject_names[1]}")
+        
+        return suggestions[:5]  # Return max 5 suggestions
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+import numpy as np
+
+
+class SearchCache:
+    """
+    Two-tier cache for semantic search results.
+
+    The exact tier is keyed on the raw query so a repeated search skips both the
+    embedding and the vector lookup. The semantic tier keeps recent query
+    embeddings per scope (as float16, half the memory of the model's float32)
+    and reuses results when a new query embeds to nearly the same vector.
+    Entries expire after ttl seconds and are dropped whenever the owning user's
+    embeddings change.
+    """
+
+    def __init__(self, ttl: float = 60, max_entries: int = 1024,
+                 similarity_threshold: float = 0.95, max_semantic_per_scope: int = 32):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.max_semantic_per_scope = max_semantic_per_scope
+        self._exact = OrderedDict()
+        self._semantic = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, scope: Hashable, query: str) -> Optional[List[Any]]:
+        """
+        Look up results for an exact query
+
+        Args:
+            user_id (int): Owner of the results
+            scope: Any other search parameters (subject filter, result count)
+            query (str): Search query
+
+        Returns:
+            Optional[List]: Cached results, or None on a miss
+        """
+        key = (user_id, scope, query)
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+            expires, results = entry
+            if expires < time.monotonic():
+                del self._exact[key]
+                return None
+            self._exact.move_to_end(key)
+            return results
+
+    def get_similar(self, user_id: int, scope: Hashable, embedding) -> Optional[List[Any]]:
+        """
+        Look up results for a query whose embedding is close to a cached one
+
+        Args:
+            user_id (int): Owner of the results
+            scope: Any other search parameters (subject filter, result count)
+            embedding: Query embedding
+
+        Returns:
+            Optional[List]: Cached results, or None on a miss
+        """
+        with self._lock:
+            entries = self._semantic.get((user_id, scope))
+            if not entries:
+                return None
+            now = time.monotonic()
+            entries[:] = [entry for entry in entries if entry[0] >= now]
+            if not entries:
+                return None
+            matrix = np.stack([entry[1] for entry in entries]).astype(np.float32)
+            similarities = matrix @ self._normalize(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                return entries[best][2]
+            return None
+
+    def put(self, user_id: int, scope: Hashable, query: str, results: List[Any], embedding=None) -> None:
+        """Store results for a query (and its embedding, if given)"""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            key = (user_id, scope, query)
+            self._exact[key] = (expires, results)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+            if embedding is not None:
+                entries = self._semantic.setdefault((user_id, scope), [])
+                entries.append((expires, self._normalize(embedding).astype(np.float16), results))
+                del entries[:-self.max_semantic_per_scope]
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Drop cached results for a user, or for everyone when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._exact.clear()
+                self._semantic.clear()
+                return
+            for key in [key for key in self._exact if key[0] == user_id]:
+                del self._exact[key]
+            for key in [key for key in self._semantic if key[0] == user_id]:
+                del self._semantic[key]
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -1,9 +1,42 @@
 import os
 from google.cloud import vision
-from PIL import Image
+from PIL import Image, ImageFilter, ImageOps
 import io
 import logging
-import ollama
+import numpy as np
+from app.services.ollama_client import ollama_client
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from app.services.ai_classification import OLLAMA_KEEP_ALIVE, LLAMA3_NUM_CTX, split_for_context
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Vision API limit on images per batch_annotate_images request
+VISION_BATCH_SIZE = 16
+
+# Longest image side sent for OCR: small scans are upscaled (at most 2x) so strokes are
+# several pixels wide, large camera photos are downscaled to keep requests small
+OCR_MIN_SIDE = 1600
+OCR_MAX_SIDE = 3200
+
+# Whitespace (including line breaks) and stray spaces before punctuation in OCR text
+WHITESPACE_RUN = re.compile(r'\s+')
+SPACE_BEFORE_PUNCTUATION = re.compile(r' ([.,;:!?])')
+
+# Streamed cleanup stops once the answer is this many times longer than the OCR text
+# (plus some slack for a short preamble the model may add), or once its last
+# REPETITION_WINDOW characters have already appeared twice
+CLEANING_MAX_GROWTH = 1.5
+CLEANING_SLACK = 100
+REPETITION_WINDOW = 60
+
+# Longest OCR text cleaned in one request: the prompt, the text and an answer of about the
+# same length fit in LLAMA3_NUM_CTX. Longer texts are cleaned part by part
+CLEANING_MAX_CHARS = 4000
 
 class TextExtractionService:
     def __init__(self):
@@ -34,10 +67,13 @@ class TextExtractionService:
         # Initialize Ollama for text cleaning
         self.ollama_enabled = True
         try:
-            ollama.list()
+            ollama_client.list()
         except Exception as e:
             logging.warning(f"Ollama not available for text cleaning: {e}")
             self.ollama_enabled = False
+        
+        # OCR and cleaning are remote calls, so threads (not processes) overlap them
+        self.executor = ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) * 2))
     
     def extract_text_from_image(self, image_path):
         """
@@ -49,44 +85,162 @@ class TextExtractionService:
         Returns:
             tuple: (extracted_text, confidence_score)
         """
+        return self.extract_text_from_images([image_path])[0]
+    
+    def extract_text_from_images(self, image_paths: List[str]) -> List[Tuple[str, float]]:
+        """
+        Extract text from several images with batched Vision requests, cleaning the
+        results concurrently
+        
+        Args:
+            image_paths (List[str]): Paths to the image files
+            
+        Returns:
+            List[tuple]: (extracted_text, confidence_score) for each image, in order
+        """
         if not self.enabled:
-            return "Text extraction service not available", 0.0
+            return [("Text extraction service not available", 0.0) for _ in image_paths]
         
+        # Every image is read and preprocessed on the pool up front, so later batches are
+        # prepared while earlier ones are with the Vision API, and each batch's texts are
+        # cleaned while the next batch is being annotated
+        image_loads = [self.executor.submit(self._load_image_for_ocr, path) for path in image_paths]
+        
+        formatted = []
+        for start in range(0, len(image_loads), VISION_BATCH_SIZE):
+            raw_texts = self._annotate_batch(image_loads[start:start + VISION_BATCH_SIZE])
+            formatted.extend(self.executor.submit(self._format_extracted_text, raw_text) for raw_text in raw_texts)
+        
+        return [future.result() for future in formatted]
+    
+    def _annotate_batch(self, image_loads):
+        """Run text detection for up to VISION_BATCH_SIZE images (futures of their bytes) in one API call"""
         try:
-            # Read and process the image
-            with io.open(image_path, 'rb') as image_file:
-                content = image_file.read()
-            
-            image = vision.Image(content=content)
-            
-            # Perform text detection using batch annotation
-            features = [vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)]
-            request = vision.AnnotateImageRequest(image=image, features=features)
-            
-            response = self.client.batch_annotate_images(requests=[request])
-            annotations = response.responses[0]
-            
-            if annotations.error.message:
-                raise Exception(f'API Error: {annotations.error.message}')
+            requests = []
+            for image_load in image_loads:
+                # Wait for the image to be read and processed
+                image = vision.Image(content=image_load.result())
+                
+                # Perform text detection using batch annotation
+                features = [vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)]
+                requests.append(vision.AnnotateImageRequest(image=image, features=features))
             
-            if not annotations.text_annotations:
-                return "No text found in image", 0.0
+            response = self.client.batch_annotate_images(requests=requests)
             
-            # Get the full text (first annotation contains all text)
-            full_text = annotations.text_annotations[0].description
-            confidence = 0.95  # Default confidence for text detection
+            results = []
+            for annotations in response.responses:
+                if annotations.error.message:
+                    results.append(Exception(f'API Error: {annotations.error.message}'))
+                elif not annotations.text_annotations:
+                    results.append(None)
+                else:
+                    # Get the full text (first annotation contains all text)
+                    results.append(annotations.text_annotations[0].description)
+            return results
             
-            # Use LLaMA3 for text cleaning if available, otherwise use basic formatting
-            if self.ollama_enabled:
-                formatted_text = self.clean_text_with_llama(full_text)
-            else:
-                formatted_text = self.format_to_sentences(full_text)
+        except Exception as e:
+            return [e] * len(image_loads)
+    
+    def _load_image_for_ocr(self, image_path):
+        """Image bytes to send for OCR: preprocessed JPEG, or the original file if that fails"""
+        try:
+            if cv2 is not None:
+                return self._encode_for_ocr_cv2(image_path)
+            with Image.open(image_path) as img:
+                buffer = io.BytesIO()
+                self._enhance_for_ocr(img).save(buffer, 'JPEG', quality=90)
+                return buffer.getvalue()
+        except Exception as e:
+            logging.warning(f"Image preprocessing failed, sending original: {e}")
+            with io.open(image_path, 'rb') as image_file:
+                return image_file.read()
+    
+    def _enhance_for_ocr(self, img):
+        """
+        Normalize a photo of handwriting for text detection
+        
+        Args:
+            img (PIL.Image): Uploaded image
             
-            return formatted_text, confidence
+        Returns:
+            PIL.Image: Upright, grayscale, contrast-stretched image within the OCR size range
+        """
+        # Phone cameras store rotation in EXIF; apply it so lines are horizontal
+        img = ImageOps.exif_transpose(img)
+        
+        # Grayscale with the histogram stretched (ignoring the extreme 1%) lifts faint pencil
+        img = ImageOps.autocontrast(img.convert('L'), cutoff=1)
+        
+        scale = self._ocr_scale(max(img.size))
+        if scale != 1.0:
+            new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img = img.resize(new_size, Image.LANCZOS)
+        
+        # Light denoise without blurring stroke edges
+        return img.filter(ImageFilter.MedianFilter(3))
+    
+    def _encode_for_ocr_cv2(self, image_path):
+        """
+        _enhance_for_ocr with OpenCV, whose filters run as vectorized native code rather
+        than PIL's per-pixel paths
+        
+        Args:
+            image_path (str): Path to the uploaded image
             
-        except Exception as e:
-            logging.error(f"Error extracting text from image: {e}")
-            return f"Error extracting text: {str(e)}", 0.0
+        Returns:
+            bytes: The enhanced image as JPEG
+        """
+        # Reading straight to grayscale also applies the EXIF rotation
+        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError(f"OpenCV could not read {image_path}")
+        
+        # Stretch the histogram between the 1st and 99th percentiles (autocontrast with cutoff=1)
+        low, high = np.percentile(img, (1, 99))
+        if high > low:
+            alpha = 255.0 / (high - low)
+            img = cv2.convertScaleAbs(img, alpha=alpha, beta=-low * alpha)
+        
+        scale = self._ocr_scale(max(img.shape))
+        if scale != 1.0:
+            new_size = (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale)))
+            img = cv2.resize(img, new_size, interpolation=cv2.INTER_LANCZOS4)
+        
+        # Light denoise without blurring stroke edges
+        img = cv2.medianBlur(img, 3)
+        
+        ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if not ok:
+            raise ValueError("OpenCV could not encode the image as JPEG")
+        return buffer.tobytes()
+    
+    @staticmethod
+    def _ocr_scale(longest_side):
+        """Resize factor that brings an image's longest side into the OCR size range"""
+        if longest_side < OCR_MIN_SIDE:
+            return min(2.0, OCR_MIN_SIDE / longest_side)
+        if longest_side > OCR_MAX_SIDE:
+            return OCR_MAX_SIDE / longest_side
+        return 1.0
+    
+    def _format_extracted_text(self, full_text):
+        """Turn one annotation result into (extracted_text, confidence_score)"""
+        if isinstance(full_text, Exception):
+            logging.error(f"Error extracting text from image: {full_text}")
+            return f"Error extracting text: {str(full_text)}", 0.0
+        
+        if full_text is None:
+            return "No text found in image", 0.0
+        
+        confidence = 0.95  # Default confidence for text detection
+        
+        # Use LLaMA3 for text cleaning if available, otherwise use basic formatting
+        if self.ollama_enabled:
+            formatted_text = self.clean_text_with_llama(full_text)
+        else:
+            formatted_text = self.format_to_sentences(full_text)
+        
+        return formatted_text, confidence
     
     def clean_text_with_llama(self, text: str) -> str:
         """
@@ -101,6 +255,11 @@ class TextExtractionService:
         if not text or not text.strip() or not self.ollama_enabled:
             return self.format_to_sentences(text)
         
+        if len(text) > CLEANING_MAX_CHARS:
+            return "\n\n".join(
+                self.clean_text_with_llama(part) for part in split_for_context(text, CLEANING_MAX_CHARS)
+            )
+        
         try:
             prompt = f"""
             You are a text cleaning assistant. The following text was extracted from a handwritten note using OCR. Clean it up and format it into proper, readable sentences while preserving all the meaningful content.
@@ -120,17 +279,38 @@ class TextExtractionService:
 
             Cleaned text:"""
 
-            response = ollama.chat(
+            stream = ollama_client.chat(
                 model="llama3",
                 messages=[
                     {
                         'role': 'user',
                         'content': prompt
                     }
-                ]
+                ],
+                options=self._cleaning_options(text),
+                stream=True,
+                keep_alive=OLLAMA_KEEP_ALIVE
             )
             
-            cleaned_text = response['message']['content'].strip()
+            # Stop reading once the model runs away (far longer than the input) or loops
+            max_length = len(text) * CLEANING_MAX_GROWTH + CLEANING_SLACK
+            pieces = []
+            length = 0
+            for chunk in stream:
+                pieces.append(chunk['message']['content'])
+                length += len(pieces[-1])
+                if length > max_length:
+                    logging.warning("LLaMA3 text cleaning ran past the input length, stopping early")
+                    break
+                if length >= 3 * REPETITION_WINDOW:
+                    repeated = self._cut_repetition(''.join(pieces))
+                    if repeated is not None:
+                        logging.warning("LLaMA3 text cleaning started repeating itself, stopping early")
+                        pieces = [repeated]
+                        break
+            stream.close()
+            
+            cleaned_text = ''.join(pieces).strip()
             
             # Remove common prefixes that LLaMA might add
             prefixes_to_remove = [
@@ -159,6 +339,38 @@ class TextExtractionService:
             # Fallback to basic sentence formatting
             return self.format_to_sentences(text)
     
+    def _cleaning_options(self, text: str) -> dict:
+        """
+        Generation options for cleaning text: the shared llama3 context (texts are at most
+        CLEANING_MAX_CHARS long) and an answer capped near the text's length
+        """
+        return {
+            'num_ctx': LLAMA3_NUM_CTX,
+            'num_predict': max(512, len(text) // 2),
+            'repeat_penalty': 1.2,
+            'stop': ['\n\n\n', 'Raw text:']
+        }
+    
+    @staticmethod
+    def _cut_repetition(text: str):
+        """
+        Text up to where it starts repeating, if its last REPETITION_WINDOW characters
+        already occur twice before; None otherwise
+        """
+        tail = text[-REPETITION_WINDOW:]
+        first = text.find(tail)
+        second = text.find(tail, first + 1)
+        # The tail always occurs at the end; a loop needs two occurrences before that
+        if second in (-1, len(text) - len(tail)):
+            return None
+        
+        # Walk back to where the loop with this period begins and keep one pass of it
+        period = second - first
+        start = first
+        while start > 0 and text[start - 1] == text[start - 1 + period]:
+            start -= 1
+        return text[:start + period]
+    
     def format_to_sentences(self, text: str) -> str:
         """
         Convert extracted text to proper sentence form
@@ -172,19 +384,11 @@ class TextExtractionService:
         if not text or not text.strip():
             return ""
         
-        # Clean up the text
-        text = text.strip()
-        
-        # Split by newlines and clean each line
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
+        # Join the lines with single spaces (collapsing any run of whitespace)
+        combined_text = WHITESPACE_RUN.sub(' ', text.strip())
         
-        # Join lines with spaces and handle punctuation
-        combined_text = ' '.join(lines)
-        
-        # Fix common OCR issues
-        combined_text = combined_text.replace('  ', ' ')  # Remove double spaces
-        combined_text = combined_text.replace(' .', '.')  # Fix spaced periods
-        combined_text = combined_text.replace(' ,', ',')  # Fix spaced commas
+        # Fix common OCR issues: a space before punctuation
+        combined_text = SPACE_BEFORE_PUNCTUATION.sub(r'\1', combined_text)
         
         # Ensure proper sentence ending
         if combined_text and not combined_text[-1] in '.!?':
@@ -210,12 +414,8 @@ class TextExtractionService:
         try:
             # Open and preprocess the image
             with Image.open(image_path) as img:
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Enhance contrast and sharpness if needed
-                # For now, just save as is - can add more preprocessing later
+                # Same enhancement that is applied before text detection
+                img = self._enhance_for_ocr(img)
                 
                 if output_path:
                     img.save(output_path, 'JPEG', quality=95)
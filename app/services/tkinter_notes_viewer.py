@@ -6,11 +6,140 @@ import webbrowser
 from datetime import datetime
 
 
+# Height in pixels of the slot each source card occupies; fixed, so the cards in view
+# follow from the scroll position without laying out the others
+SOURCE_CARD_HEIGHT = 420
+
+# Characters of a note shown in its card until "Show more" is pressed; Tk lays out the
+# whole text of a Text widget, so long OCR'd notes are not inserted in full up front
+CONTENT_PREVIEW_CHARS = 4000
+
+# Milliseconds the display waits for more sources before rebuilding, so a burst of
+# answers is shown once
+UPDATE_DEBOUNCE_MS = 50
+
+# add_sources wakes the window as soon as data is queued; this slow heartbeat only
+# catches a wakeup that could not be delivered (e.g. before the window existed)
+QUEUE_HEARTBEAT_MS = 500
+
+
+class SourceCard:
+    """Widgets of one source card, refilled with another source when it is reused"""
+    
+    def __init__(self, viewer, parent):
+        self.frame = ttk.LabelFrame(parent, style='Custom.TFrame')
+        
+        # Subject, date, relevance and content all go in one text widget, styled with
+        # tags, rather than a label widget per line
+        self.content_text = scrolledtext.ScrolledText(
+            self.frame,
+            height=16,  # Room for the info lines above the content
+            width=60,   # Increased width
+            bg='#F8F9FA',
+            fg='#2E4057',
+            font=('Arial', 10),
+            wrap=tk.WORD,
+            padx=10,
+            pady=10
+        )
+        self.content_text.tag_configure('subject', font=('Arial', 10, 'bold'), foreground='#2E4057')
+        self.content_text.tag_configure('details', foreground='#5A6B7D')
+        self.content_text.tag_configure('heading', font=('Arial', 10, 'bold'), spacing1=8, spacing3=4)
+        self.content_text.pack(fill=tk.BOTH, expand=True, pady=5)
+        
+        # Action buttons frame
+        buttons_frame = ttk.Frame(self.frame, style='Custom.TFrame')
+        buttons_frame.pack(fill=tk.X, pady=10)
+        self.view_btn = tk.Button(
+            buttons_frame,
+            text="🔗 View in Browser",
+            bg='#6DB4EE',
+            fg='white',
+            font=('Arial', 9)
+        )
+        self.view_btn.pack(side=tk.LEFT, padx=(0, 10))
+        self.copy_btn = tk.Button(
+            buttons_frame,
+            text="📋 Copy Content",
+            bg='#2E4057',
+            fg='white',
+            font=('Arial', 9)
+        )
+        self.copy_btn.pack(side=tk.LEFT)
+        self.more_btn = tk.Button(
+            buttons_frame,
+            text="📄 Show more",
+            bg='#2E4057',
+            fg='white',
+            font=('Arial', 9),
+            command=self.show_more
+        )
+        
+        self.viewer = viewer
+        self.content = ''
+        # Canvas window item the card is shown in
+        self.item = None
+    
+    def fill(self, source):
+        """Show a source note in this card"""
+        self.frame.configure(text=f"📄 {source.get('title', 'Untitled')[:40]}")
+        
+        # (text, tags) pairs, inserted with one call; cards are refilled while hidden,
+        # so the text is laid out once when shown
+        parts = []
+        if source.get('subject'):
+            parts += [f"📚 {source['subject']}\n", 'subject']
+        if source.get('created_at'):
+            parts += [f"📅 {source['created_at']}\n", 'details']
+        if source.get('similarity_score'):
+            parts += [f"🎯 Relevance: {float(source['similarity_score']):.1%}\n", 'details']
+        
+        content = source.get('content', '')
+        self.content = content
+        if content:
+            parts += ["📝 Full Content:\n", 'heading', content[:CONTENT_PREVIEW_CHARS], ()]
+        
+        self.content_text.config(state=tk.NORMAL)
+        self.content_text.delete('1.0', tk.END)
+        if parts:
+            self.content_text.insert('1.0', *parts)
+        self.content_text.config(state=tk.DISABLED)
+        if len(content) > CONTENT_PREVIEW_CHARS:
+            self.more_btn.pack(side=tk.LEFT, padx=(10, 0))
+        else:
+            self.more_btn.pack_forget()
+        
+        if source.get('note_id'):
+            self.view_btn.configure(
+                state=tk.NORMAL,
+                command=lambda nid=source['note_id']: self.viewer.open_note_in_browser(nid)
+            )
+        else:
+            self.view_btn.configure(state=tk.DISABLED, command=lambda: None)
+        self.copy_btn.configure(command=lambda: self.viewer.copy_to_clipboard(content))
+    
+    def show_more(self):
+        """Show the rest of the note"""
+        self.content_text.config(state=tk.NORMAL)
+        self.content_text.insert(tk.END, self.content[CONTENT_PREVIEW_CHARS:])
+        self.content_text.config(state=tk.DISABLED)
+        self.more_btn.pack_forget()
+
+
 class NotesViewer:
     def __init__(self):
         self.root = None
         self.sources_queue = queue.Queue()
         self.running = False
+        self.canvas = None
+        # Sources of the current answer; cards exist only for the ones in view
+        self._source_data = []
+        # Source index -> card showing it, and cards not showing anything
+        self._cards_in_use = {}
+        self._card_pool = []
+        # after() id of the scheduled rebuild, and the sources it will show
+        self._pending_update = None
+        self._pending_sources = None
         
     def create_window(self):
         """Create the tkinter window for displaying notes"""
@@ -35,15 +164,15 @@ class NotesViewer:
         header_label = ttk.Label(main_frame, text="📚 Source Notes", style='Header.TLabel')
         header_label.pack(pady=(0, 10))
         
-        # Scrollable frame for sources
+        # Scrollable canvas: the frame at the top holds the query (or waiting message),
+        # and source cards are placed below it in fixed-height slots as they scroll into view
         canvas = tk.Canvas(main_frame, bg='#2E4057', highlightthickness=0)
-        scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=canvas.yview)
+        scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=self._yview)
         self.scrollable_frame = ttk.Frame(canvas, style='Custom.TFrame')
+        self.canvas = canvas
         
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
-        )
+        self.scrollable_frame.bind("<Configure>", lambda e: self._render_visible())
+        canvas.bind("<Configure>", lambda e: self._render_visible())
         
         canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
         canvas.configure(yscrollcommand=scrollbar.set)
@@ -55,7 +184,7 @@ class NotesViewer:
         self.show_waiting_message()
         
         # Start checking for updates
-        self.root.after(100, self.check_queue)
+        self.root.after(QUEUE_HEARTBEAT_MS, self._heartbeat)
         
         return self.root
     
@@ -63,6 +192,7 @@ class NotesViewer:
         """Show waiting message when no sources are available"""
         for widget in self.scrollable_frame.winfo_children():
             widget.destroy()
+        self._show_sources([])
             
         waiting_frame = ttk.Frame(self.scrollable_frame, style='Custom.TFrame')
         waiting_frame.pack(fill=tk.X, pady=20)
@@ -77,7 +207,7 @@ class NotesViewer:
     
     def update_sources(self, sources_data):
         """Update the sources display with new data"""
-        # Clear existing sources
+        # Clear the previous query header
         for widget in self.scrollable_frame.winfo_children():
             widget.destroy()
         
@@ -101,109 +231,75 @@ class NotesViewer:
         question_label.pack(anchor='w')
         
         # Sources
-        for i, source in enumerate(sources, 1):
-            self.create_source_widget(source, i)
+        self._show_sources(sources)
     
-    def create_source_widget(self, source, index):
-        """Create a widget for displaying a single source note"""
-        # Main source frame
-        source_frame = ttk.LabelFrame(
-            self.scrollable_frame, 
-            text=f"📄 {source.get('title', 'Untitled')[:40]}",
-            style='Custom.TFrame'
-        )
-        source_frame.pack(fill=tk.BOTH, expand=True, pady=5, padx=5)
-        
-        # Note info header
-        info_frame = ttk.Frame(source_frame, style='Custom.TFrame')
-        info_frame.pack(fill=tk.X, pady=5)
-        
-        # Subject and date in header
-        if source.get('subject'):
-            subject_label = ttk.Label(
-                info_frame,
-                text=f"📚 {source['subject']}",
-                style='Source.TLabel',
-                font=('Arial', 10, 'bold')
-            )
-            subject_label.pack(anchor='w')
-        
-        if source.get('created_at'):
-            date_label = ttk.Label(
-                info_frame,
-                text=f"📅 {source['created_at']}",
-                style='Source.TLabel'
-            )
-            date_label.pack(anchor='w')
+    def _show_sources(self, sources):
+        """Replace the displayed sources, starting again from the top"""
+        for card in self._cards_in_use.values():
+            self.canvas.itemconfigure(card.item, state='hidden')
+            self._card_pool.append(card)
+        self._cards_in_use = {}
+        self._source_data = list(sources)
+        self.canvas.yview_moveto(0)
+        self.scrollable_frame.update_idletasks()
+        self._render_visible()
+    
+    def _yview(self, *args):
+        """Scrollbar command: scroll, then show the cards that came into view"""
+        self.canvas.yview(*args)
+        self._render_visible()
+    
+    def _render_visible(self):
+        """
+        Give a card to every source whose slot intersects the viewport and take them
+        back from sources scrolled out of it, so at most a screenful of cards exists
+        """
+        if self.canvas is None:
+            return
         
-        # Relevance score
-        if source.get('similarity_score'):
-            score = float(source['similarity_score'])
-            score_text = f"🎯 Relevance: {score:.1%}"
-            score_label = ttk.Label(
-                info_frame,
-                text=score_text,
-                style='Source.TLabel'
-            )
-            score_label.pack(anchor='w')
+        header_height = self.scrollable_frame.winfo_reqheight()
+        canvas_width = self.canvas.winfo_width()
+        self.canvas.configure(scrollregion=(
+            0, 0, canvas_width, header_height + len(self._source_data) * SOURCE_CARD_HEIGHT
+        ))
         
-        # Full content display (scrollable)
-        content = source.get('content', '')
-        if content:
-            content_label = ttk.Label(
-                source_frame,
-                text="📝 Full Content:",
-                style='Source.TLabel',
-                font=('Arial', 10, 'bold')
-            )
-            content_label.pack(anchor='w', pady=(10, 5))
-            
-            content_text = scrolledtext.ScrolledText(
-                source_frame,
-                height=12,  # Increased height for full content
-                width=60,   # Increased width
-                bg='#F8F9FA',
-                fg='#2E4057',
-                font=('Arial', 10),
-                wrap=tk.WORD,
-                padx=10,
-                pady=10
-            )
-            content_text.pack(fill=tk.BOTH, expand=True, pady=5)
-            content_text.insert(tk.END, content)
-            content_text.config(state=tk.DISABLED)
+        top = self.canvas.canvasy(0) - header_height
+        bottom = top + self.canvas.winfo_height()
+        visible = range(
+            max(0, int(top // SOURCE_CARD_HEIGHT)),
+            min(len(self._source_data), int(bottom // SOURCE_CARD_HEIGHT) + 1)
+        )
         
-        # Action buttons frame
-        buttons_frame = ttk.Frame(source_frame, style='Custom.TFrame')
-        buttons_frame.pack(fill=tk.X, pady=10)
+        for index in [index for index in self._cards_in_use if index not in visible]:
+            card = self._cards_in_use.pop(index)
+            self.canvas.itemconfigure(card.item, state='hidden')
+            self._card_pool.append(card)
         
-        # View full note button
-        if source.get('note_id'):
-            view_btn = tk.Button(
-                buttons_frame,
-                text="🔗 View in Browser",
-                bg='#6DB4EE',
-                fg='white',
-                font=('Arial', 9),
-                command=lambda nid=source['note_id']: self.open_note_in_browser(nid)
+        for index in visible:
+            card = self._cards_in_use.get(index)
+            if card is None:
+                card = self._card_pool.pop() if self._card_pool else self.create_source_widget()
+                card.fill(self._source_data[index])
+                self._cards_in_use[index] = card
+            self.canvas.coords(card.item, 5, header_height + index * SOURCE_CARD_HEIGHT)
+            self.canvas.itemconfigure(
+                card.item,
+                width=max(canvas_width - 10, 1),
+                height=SOURCE_CARD_HEIGHT - 10,
+                state='normal'
             )
-            view_btn.pack(side=tk.LEFT, padx=(0, 10))
-        
-        # Copy content button
-        copy_btn = tk.Button(
-            buttons_frame,
-            text="📋 Copy Content",
-            bg='#2E4057',
-            fg='white',
-            font=('Arial', 9),
-            command=lambda: self.copy_to_clipboard(content)
-        )
-        copy_btn.pack(side=tk.LEFT)
+    
+    def create_source_widget(self):
+        """Create an empty source card on the canvas"""
+        card = SourceCard(self, self.canvas)
+        card.item = self.canvas.create_window((5, 0), window=card.frame, anchor='nw', state='hidden')
+        return card
     
     def open_note_in_browser(self, note_id):
         """Open the full note in the web browser"""
         url = f"http://localhost:5002/notes/{note_id}"
-        webbrowser.open(url)
+        # webbrowser.open can block while it launches the browser; keep the window responsive
+        threading.Thread(target=webbrowser.open, args=(url,), daemon=True).start()
     
     def copy_to_clipboard(self, text):
         """Copy text to clipboard"""
@@ -212,8 +308,8 @@ class NotesViewer:
             self.root.clipboard_append(text)
             self.root.update()  # Now it stays on the clipboard after the window is closed
             
-            # Show brief feedback
-            self.show_notification("📋 Content copied to clipboard!")
+            # Show brief feedback once the click has been handled
+            self.root.after_idle(self.show_notification, "📋 Content copied to clipboard!")
         except Exception as e:
             print(f"Failed to copy to clipboard: {e}")
     
@@ -239,19 +335,43 @@ class NotesViewer:
     
     def check_queue(self):
         """Check for new sources data from the queue"""
+        received = False
         try:
+            # Only the most recent sources are worth showing
             while True:
-                sources_data = self.sources_queue.get_nowait()
-                self.update_sources(sources_data)
+                self._pending_sources = self.sources_queue.get_nowait()
+                received = True
         except queue.Empty:
             pass
         
+        if received:
+            # Restart the wait, so the rebuild happens once the burst settles
+            if self._pending_update is not None:
+                self.root.after_cancel(self._pending_update)
+            self._pending_update = self.root.after(UPDATE_DEBOUNCE_MS, self._apply_pending_update)
+    
+    def _heartbeat(self):
+        """Fallback queue check, repeated while the window runs"""
+        self.check_queue()
         if self.running:
-            self.root.after(100, self.check_queue)
+            self.root.after(QUEUE_HEARTBEAT_MS, self._heartbeat)
+    
+    def _apply_pending_update(self):
+        """Show the sources that arrived last"""
+        self._pending_update = None
+        sources_data, self._pending_sources = self._pending_sources, None
+        self.update_sources(sources_data)
     
     def add_sources(self, sources_data):
-        """Add new sources data to the queue"""
+        """Add new sources data to the queue and wake the window to show it"""
         self.sources_queue.put(sources_data)
+        root = self.root
+        if root is not None and self.running:
+            try:
+                # Tk runs the callback on its own thread
+                root.after(0, self.check_queue)
+            except (RuntimeError, tk.TclError):
+                pass  # The heartbeat picks the data up
     
     def start(self):
         """Start the tkinter window in a separate thread"""
@@ -1,65 +1,223 @@
 import chromadb
 from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+import hashlib
+import threading
 import uuid
 import logging
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Tuple
 import os
 import re
+from app.services.onnx_embeddings import load_onnx_model
+from app.services.search_cache import SearchCache
+from app.services.query_cache import query_cache
 
-# Disable ChromaDB telemetry to avoid the capture() error
-os.environ["ANONYMIZED_TELEMETRY"] = "False"
-os.environ["CHROMA_TELEMETRY_DISABLED"] = "True"
-os.environ["POSTHOG_DISABLED"] = "True"
+# Chroma indexes each collection with HNSW; these are fixed when the collection is created.
+# M=32 links keeps recall high for 384-d MiniLM vectors, and search_ef leaves headroom for
+# the 3x over-fetch search_notes does before deduplicating chunks per note
+HNSW_SETTINGS = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 100,
+}
 
-# Try to patch the telemetry module before ChromaDB uses it
-try:
-    import chromadb.telemetry.product.posthog
-    # Monkey patch the capture method to do nothing
-    chromadb.telemetry.product.posthog.capture = lambda *args, **kwargs: None
-except ImportError:
-    pass
+# Each user's chunks live in their own collection, so a search only walks that user's
+# HNSW graph instead of filtering everyone's vectors by user_id
+USER_COLLECTION_PREFIX = "notes_emb_u"
+
+# Single collection embeddings used to be kept in; its chunks move to the owner's
+# collection the first time that user's collection is opened
+LEGACY_COLLECTION = "notes_embeddings"
+
+# Chunks encoded per step when indexing; while one step is encoded, the previous one is
+# written to Chroma on _index_writer, so encoding and storage overlap on large imports
+INDEX_BATCH_SIZE = 256
+_index_writer = ThreadPoolExecutor(max_workers=1)
+
+# Texts the embedding model encodes at once; a GPU has the memory and parallelism for more
+ENCODE_BATCH_SIZE = 64
+GPU_ENCODE_BATCH_SIZE = 128
+
+# Sentence boundaries notes are chunked at
+SENTENCE_END = re.compile(r'[.!?]+')
+# Runs of whitespace (line breaks, indentation) collapsed to one space before chunking
+WHITESPACE = re.compile(r'\s+')
+
+# Embeddings of recently encoded texts (queries, and chunks of notes that are edited and
+# saved again), keyed by a digest of the text and shared by every service instance. Rows
+# are kept as float16: half the memory, and unit-length vectors lose ~1e-4 of cosine
+EMBEDDING_CACHE_SIZE = 1024
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+# Search results shared by every service instance, so a write through one
+# instance (note routes) invalidates what another (chatbot) has cached
+search_cache = SearchCache()
 
 class VectorEmbeddingService:
     def __init__(self):
-        self.client = None
-        self.collection = None
-        self.model = None
-        self.enabled = False
+        # The Chroma client and the embedding model (torch included) are loaded on first
+        # use, so starting the app and requests that never embed anything don't pay for them
+        self._client = None
+        self.legacy_collection = None
+        self._model = None
+        self._load_lock = threading.Lock()
+        # user_id -> that user's collection
+        self._collections = {}
+        self._collections_lock = threading.Lock()
+        # Texts per encode step; raised once the model turns out to be on a GPU
+        self.encode_batch_size = ENCODE_BATCH_SIZE
+        # Set once the client or the model fail to load; they are not retried
+        self._load_failed = False
+    
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether semantic search is available. Loads the client and the model the first
+        time it is asked, so callers can still fall back to SQL search when they fail
+        """
+        if self._load_failed:
+            return False
+        try:
+            self.client
+            self.model
+        except Exception:
+            return False
+        return True
+    
+    @property
+    def client(self):
+        """The ChromaDB client, opened on first use"""
+        if self._client is None:
+            if self._load_failed:
+                raise RuntimeError("Vector embedding service is unavailable")
+            with self._load_lock:
+                if self._client is None:
+                    self._client = self._load(self._open_client)
+        return self._client
+    
+    @property
+    def model(self):
+        """The sentence embedding model, loaded on first use"""
+        if self._model is None:
+            if self._load_failed:
+                raise RuntimeError("Vector embedding service is unavailable")
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load(self._load_model)
+        return self._model
+    
+    def _load(self, loader):
+        try:
+            return loader()
+        except Exception as e:
+            logging.error(f"Failed to initialize vector embedding service: {e}")
+            self._load_failed = True
+            raise
+    
+    def _open_client(self):
+        # Initialize ChromaDB with telemetry disabled
+        persist_directory = os.path.join(os.getcwd(), 'vector_db')
+        os.makedirs(persist_directory, exist_ok=True)
+        
+        # Create client with telemetry explicitly disabled
+        settings = Settings(
+            anonymized_telemetry=False,
+            allow_reset=True
+        )
+        client = chromadb.PersistentClient(
+            path=persist_directory,
+            settings=settings
+        )
         
+        # Embeddings from before the per-user collections, if any are left
         try:
-            # Initialize ChromaDB with telemetry disabled
-            persist_directory = os.path.join(os.getcwd(), 'vector_db')
-            os.makedirs(persist_directory, exist_ok=True)
-            
-            # Create client with telemetry explicitly disabled
-            settings = Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-            self.client = chromadb.PersistentClient(
-                path=persist_directory,
-                settings=settings
+            self.legacy_collection = client.get_collection(name=LEGACY_COLLECTION)
+        except Exception:
+            self.legacy_collection = None
+        
+        logging.info("Vector embedding service initialized successfully with ChromaDB 1.0.0")
+        return client
+    
+    def _load_model(self):
+        # EMBEDDING_DEVICE pins the model to 'cuda', 'mps' or 'cpu'; when unset, a GPU
+        # is used if there is one. On the CPU the int8 ONNX Runtime export is used when
+        # onnxruntime and optimum are installed
+        device = os.environ.get('EMBEDDING_DEVICE') or self._default_device()
+        model = None
+        if device == 'cpu':
+            model = load_onnx_model(
+                'sentence-transformers/all-MiniLM-L6-v2',
+                os.path.join(os.getcwd(), 'models', 'all-MiniLM-L6-v2-onnx-int8')
             )
-            
-            # Get or create collection with new API
-            try:
-                self.collection = self.client.get_collection(name="notes_embeddings")
-            except Exception:
-                # Collection doesn't exist, create it
-                self.collection = self.client.create_collection(
-                    name="notes_embeddings",
-                    metadata={"hnsw:space": "cosine"}
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+        if str(model.device) != 'cpu':
+            self.encode_batch_size = GPU_ENCODE_BATCH_SIZE
+        logging.info(f"Embedding model running on {model.device}")
+        return model
+    
+    def _user_collection(self, user_id: int):
+        """
+        The collection holding a user's chunks, created (and filled with the user's
+        chunks from the legacy collection) on first use
+        
+        Args:
+            user_id (int): Owner of the notes (None is stored as user 0)
+        """
+        user_id = user_id or 0
+        collection = self._collections.get(user_id)
+        if collection is not None:
+            return collection
+        
+        with self._collections_lock:
+            collection = self._collections.get(user_id)
+            if collection is None:
+                collection = self.client.get_or_create_collection(
+                    name=f"{USER_COLLECTION_PREFIX}{user_id}",
+                    metadata=HNSW_SETTINGS
                 )
-            
-            # Initialize sentence transformer model
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
-            self.enabled = True
-            logging.info("Vector embedding service initialized successfully with ChromaDB 1.0.0")
-            
-        except Exception as e:
-            logging.error(f"Failed to initialize vector embedding service: {e}")
-            self.enabled = False
+                self._migrate_legacy_chunks(user_id, collection)
+                self._collections[user_id] = collection
+        return collection
+    
+    def _migrate_legacy_chunks(self, user_id: int, collection) -> None:
+        """Move a user's chunks from the legacy shared collection into their own"""
+        if self.legacy_collection is None:
+            return
+        
+        legacy = self.legacy_collection.get(
+            where={"user_id": {"$eq": user_id}},
+            include=['embeddings', 'documents', 'metadatas']
+        )
+        if not legacy['ids']:
+            return
+        
+        collection.upsert(
+            ids=legacy['ids'],
+            documents=legacy['documents'],
+            metadatas=legacy['metadatas'],
+            embeddings=legacy['embeddings']
+        )
+        self.legacy_collection.delete(ids=legacy['ids'])
+        logging.info(f"Moved {len(legacy['ids'])} chunks of user {user_id} into their own collection")
+    
+    @staticmethod
+    def _default_device() -> str:
+        """'cuda' or 'mps' when torch can see a GPU, otherwise (or without torch) 'cpu'"""
+        try:
+            import torch
+            if torch.cuda.is_available():
+                return 'cuda'
+            if torch.backends.mps.is_available():
+                return 'mps'
+        except Exception:
+            pass
+        return 'cpu'
     
     def _chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
         """
@@ -76,33 +234,82 @@ class VectorEmbeddingService:
         if not text or len(text) < chunk_size:
             return [text]
         
-        # Split by sentences first
-        sentences = re.split(r'[.!?]+', text)
+        sentences = [sentence.strip() for sentence in SENTENCE_END.split(WHITESPACE.sub(' ', text))]
+        sentences = [sentence for sentence in sentences if sentence]
+        
+        # Without the punctuation and extra whitespace the note may fit in one chunk after all
+        if sum(len(sentence) for sentence in sentences) + len(sentences) - 1 <= chunk_size:
+            return [" ".join(sentences)] if sentences else []
+        
         chunks = []
-        current_chunk = ""
+        # Sentences of the chunk being built, and the length they will have once joined
+        buffer = []
+        buffer_length = 0
         
         for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
             # If adding this sentence would exceed chunk size, start a new chunk
-            if len(current_chunk) + len(sentence) > chunk_size and current_chunk:
+            if buffer_length + len(sentence) > chunk_size and buffer:
+                current_chunk = " ".join(buffer)
                 chunks.append(current_chunk.strip())
                 # Start new chunk with overlap
                 if overlap > 0 and len(current_chunk) > overlap:
-                    current_chunk = current_chunk[-overlap:] + " " + sentence
+                    buffer = [current_chunk[-overlap:], sentence]
+                    buffer_length = overlap + 1 + len(sentence)
                 else:
-                    current_chunk = sentence
+                    buffer = [sentence]
+                    buffer_length = len(sentence)
             else:
-                current_chunk += " " + sentence if current_chunk else sentence
+                buffer_length += len(sentence) + 1 if buffer else len(sentence)
+                buffer.append(sentence)
         
         # Add the last chunk
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
+        current_chunk = " ".join(buffer).strip()
+        if current_chunk:
+            chunks.append(current_chunk)
         
         return chunks
     
+    def embed_many(self, texts: List[str]):
+        """
+        Encode texts in batched forward passes, reusing the embeddings of texts
+        encoded recently
+        
+        Args:
+            texts (List[str]): Texts to embed
+            
+        Returns:
+            numpy.ndarray: One unit-length float32 row per text
+        """
+        keys = [hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest() for text in texts]
+        with _embedding_cache_lock:
+            rows = [_embedding_cache.get(key) for key in keys]
+            for key, row in zip(keys, rows):
+                if row is not None:
+                    _embedding_cache.move_to_end(key)
+        
+        # Each distinct text that is not cached is encoded once
+        missing = list(dict.fromkeys(key for key, row in zip(keys, rows) if row is None))
+        if missing:
+            text_for_key = dict(zip(keys, texts))
+            encoded = self.model.encode(
+                [text_for_key[key] for key in missing],
+                batch_size=min(self.encode_batch_size, len(missing)),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+            new_rows = dict(zip(missing, encoded))
+            rows = [new_rows[key] if row is None else row for key, row in zip(keys, rows)]
+            with _embedding_cache_lock:
+                # astype copies, so a cached row does not keep the whole batch matrix alive
+                _embedding_cache.update((key, row.astype(np.float16)) for key, row in new_rows.items())
+                while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+                    _embedding_cache.popitem(last=False)
+        
+        if not rows:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.stack(rows).astype(np.float32, copy=False)
+    
     def add_note_embeddings(self, note_id: int, title: str, content: str, 
                           subject_name: str = "", user_id: int = None, created_at: str = "") -> bool:
         """
@@ -119,64 +326,118 @@ class VectorEmbeddingService:
         Returns:
             bool: Success status
         """
-        if not self.enabled:
+        return self.add_notes_embeddings([{
+            "note_id": note_id,
+            "title": title,
+            "content": content,
+            "subject_name": subject_name,
+            "user_id": user_id,
+            "created_at": created_at
+        }])
+    
+    def add_notes_embeddings(self, notes: List[Dict[str, Any]]) -> bool:
+        """
+        Add or update embeddings for several notes, encoding and storing their chunks in batches
+        
+        Args:
+            notes (List[Dict]): Notes with 'note_id', 'title', 'content' and optional
+                'subject_name', 'user_id' and 'created_at' keys
+            
+        Returns:
+            bool: Success status
+        """
+        if not self.enabled or not notes:
             return False
         
         try:
-            # Remove existing embeddings for this note
-            self.remove_note_embeddings(note_id)
-            
-            # Combine title and content for chunking
-            full_text = f"{title}\n\n{content}"
-            chunks = self._chunk_text(full_text)
-            
             documents = []
             metadatas = []
             ids = []
-            embeddings = []
             
-            for i, chunk in enumerate(chunks):
-                if not chunk.strip():
-                    continue
-                    
-                # Generate embedding
-                embedding = self.model.encode([chunk])[0].tolist()
+            for note in notes:
+                # Combine title and content for chunking
+                full_text = f"{note['title']}\n\n{note['content']}"
+                chunks = self._chunk_text(full_text)
                 
-                # Create unique ID for this chunk
-                chunk_id = f"note_{note_id}_chunk_{i}"
+                for i, chunk in enumerate(chunks):
+                    if not chunk.strip():
+                        continue
+                    
+                    # Create unique ID for this chunk
+                    chunk_id = f"note_{note['note_id']}_chunk_{i}"
+                    
+                    documents.append(chunk)
+                    metadatas.append({
+                        "note_id": note["note_id"],
+                        "chunk_index": i,
+                        "subject": note.get("subject_name", ""),
+                        "user_id": note.get("user_id") or 0,
+                        "title": note["title"],
+                        "created_at": note.get("created_at", "")
+                    })
+                    ids.append(chunk_id)
+            
+            # Each user's chunks replace their notes' old chunks in that user's collection
+            note_ids_by_user = {}
+            for note in notes:
+                note_ids_by_user.setdefault(note.get("user_id") or 0, []).append(note["note_id"])
+            
+            for user_id, note_ids in note_ids_by_user.items():
+                collection = self._user_collection(user_id)
                 
-                documents.append(chunk)
-                metadatas.append({
-                    "note_id": note_id,
-                    "chunk_index": i,
-                    "subject": subject_name,
-                    "user_id": user_id or 0,
-                    "title": title,
-                    "created_at": created_at
-                })
-                ids.append(chunk_id)
-                embeddings.append(embedding)
-            
-            if documents:
-                self.collection.add(
-                    documents=documents,
-                    metadatas=metadatas,
-                    ids=ids,
-                    embeddings=embeddings
+                # Remove existing embeddings for these notes
+                existing = collection.get(where={"note_id": {"$in": note_ids}})
+                if existing['ids']:
+                    collection.delete(ids=existing['ids'])
+            
+            # Generate embeddings in batched forward passes; unit-length vectors make the index's
+            # cosine distance a plain inner product. Chroma takes the float32 matrix as is, so it
+            # is not expanded into Python lists of floats first. Each batch is written while the
+            # next one is encoded
+            pending_write = None
+            for start in range(0, len(documents), INDEX_BATCH_SIZE):
+                end = start + INDEX_BATCH_SIZE
+                embeddings = self.embed_many(documents[start:end])
+                if pending_write is not None:
+                    pending_write.result()
+                pending_write = _index_writer.submit(
+                    self._write_chunks, documents[start:end], metadatas[start:end], ids[start:end], embeddings
                 )
+            if pending_write is not None:
+                pending_write.result()
             
             return True
             
         except Exception as e:
             logging.error(f"Error adding note embeddings: {e}")
             return False
+        
+        finally:
+            for user_id in {note.get("user_id") for note in notes}:
+                search_cache.invalidate(user_id)
+                query_cache.invalidate_user(user_id)
+    
+    def _write_chunks(self, documents, metadatas, ids, embeddings) -> None:
+        """Add chunks to their owners' collections"""
+        rows_by_user = {}
+        for i, metadata in enumerate(metadatas):
+            rows_by_user.setdefault(metadata["user_id"], []).append(i)
+        
+        for user_id, rows in rows_by_user.items():
+            self._user_collection(user_id).add(
+                documents=[documents[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows],
+                ids=[ids[i] for i in rows],
+                embeddings=embeddings[rows]
+            )
     
-    def remove_note_embeddings(self, note_id: int) -> bool:
+    def remove_note_embeddings(self, note_id: int, user_id: int) -> bool:
         """
         Remove all embeddings for a specific note
         
         Args:
             note_id (int): Note ID
+            user_id (int): Owner of the note (only their collection holds its chunks)
             
         Returns:
             bool: Success status
@@ -185,13 +446,17 @@ class VectorEmbeddingService:
             return False
         
         try:
+            collection = self._user_collection(user_id)
+            
             # Query for existing chunks of this note
-            results = self.collection.get(
+            results = collection.get(
                 where={"note_id": {"$eq": note_id}}
             )
             
             if results['ids']:
-                self.collection.delete(ids=results['ids'])
+                collection.delete(ids=results['ids'])
+                search_cache.invalidate(user_id)
+                query_cache.invalidate_user(user_id)
             
             return True
             
@@ -200,7 +465,8 @@ class VectorEmbeddingService:
             return False
     
     def search_notes(self, query: str, user_id: int, n_results: int = 10,
-                    subject_filter: str = None) -> List[Dict[str, Any]]:
+                    subject_filter: str = None, query_vector=None,
+                    min_score: float = 0.0) -> List[Dict[str, Any]]:
         """
         Search for relevant notes using semantic similarity
         
@@ -209,6 +475,8 @@ class VectorEmbeddingService:
             user_id (int): User ID to filter results
             n_results (int): Maximum number of results
             subject_filter (str): Optional subject filter
+            query_vector: Embedding of query, when the caller already computed it
+            min_score (float): Drop matches with a lower relevance score
             
         Returns:
             List[Dict]: Search results with note info and relevance scores
@@ -220,57 +488,76 @@ class VectorEmbeddingService:
             # Return empty for empty queries
             return []
         
+        # Repeated queries are answered from the cache without embedding them again
+        cache_scope = (subject_filter, n_results, min_score)
+        cached = search_cache.get(user_id, cache_scope, query)
+        if cached is not None:
+            return cached
+        
         try:
             # Generate query embedding
-            query_embedding = self.model.encode([query])[0].tolist()
-            
-            # Build where clause for filtering
-            if subject_filter:
-                where_clause = {"$and": [{"user_id": {"$eq": user_id}}, {"subject": {"$eq": subject_filter}}]}
-            else:
-                where_clause = {"user_id": {"$eq": user_id}}
-            
-            # Search in ChromaDB
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
+            if query_vector is None:
+                query_vector = self.embed_many([query])[0]
+            
+            # A near-identical earlier query can reuse its results
+            cached = search_cache.get_similar(user_id, cache_scope, query_vector)
+            if cached is not None:
+                search_cache.put(user_id, cache_scope, query, cached)
+                return cached
+            
+            # The user's own collection needs no user_id filter
+            where_clause = {"subject": {"$eq": subject_filter}} if subject_filter else None
+            
+            # Search in ChromaDB. Only ids, metadata and distances come back here: chunks are
+            # deduplicated per note first, and only the winners' documents are fetched
+            collection = self._user_collection(user_id)
+            results = collection.query(
+                query_embeddings=[query_vector],  # Chroma takes the float32 array as is
                 where=where_clause,
                 n_results=min(n_results * 3, 50),  # Get more results to deduplicate
-                include=['documents', 'metadatas', 'distances']
+                include=['metadatas', 'distances']
             )
             
-            if not results['documents'] or not results['documents'][0]:
+            if not results['ids'] or not results['ids'][0]:
+                search_cache.put(user_id, cache_scope, query, [], query_vector)
                 return []
             
-            # Process and deduplicate results by note_id
-            note_results = {}
-            
-            for i, (document, metadata, distance) in enumerate(zip(
-                results['documents'][0], 
-                results['metadatas'][0], 
-                results['distances'][0]
-            )):
-                note_id = metadata['note_id']
-                relevance_score = 1 - distance  # Convert distance to similarity
-                
-                if note_id not in note_results or relevance_score > note_results[note_id]['relevance_score']:
-                    note_results[note_id] = {
-                        'note_id': note_id,
-                        'title': metadata.get('title', 'Untitled'),
-                        'subject': metadata.get('subject', 'No Subject'),
-                        'subject_name': metadata.get('subject', 'No Subject'),
-                        'created_at': metadata.get('created_at', ''),
-                        'relevance_score': relevance_score,
-                        'matched_text': document[:300] + "..." if len(document) > 300 else document
-                    }
+            # Keep the best chunk of each note: order the hits by score (stable, so ties keep
+            # Chroma's order), and np.unique returns where each note first appears in that order
+            metadatas = results['metadatas'][0]
+            scores = 1 - np.asarray(results['distances'][0], dtype=np.float32)  # Distance to similarity
+            note_ids = np.array([metadata['note_id'] for metadata in metadatas])
+            order = np.argsort(-scores, kind='stable')
+            order = order[scores[order] >= min_score]
+            _, first_index = np.unique(note_ids[order], return_index=True)
+            winners = order[np.sort(first_index)][:n_results]
+            
+            sorted_results = []
+            for index in winners.tolist():
+                metadata = metadatas[index]
+                sorted_results.append({
+                    'note_id': metadata['note_id'],
+                    'title': metadata.get('title', 'Untitled'),
+                    'subject': metadata.get('subject', 'No Subject'),
+                    'subject_name': metadata.get('subject', 'No Subject'),
+                    'created_at': metadata.get('created_at', ''),
+                    'relevance_score': float(scores[index]),
+                    'chunk_id': results['ids'][0][index]
+                })
             
-            # Sort by relevance and return top results
-            sorted_results = sorted(
-                note_results.values(), 
-                key=lambda x: x['relevance_score'], 
-                reverse=True
-            )
+            # Fetch the text of the winning chunks only
+            if sorted_results:
+                chunks = collection.get(
+                    ids=[result['chunk_id'] for result in sorted_results],
+                    include=['documents']
+                )
+                documents = dict(zip(chunks['ids'], chunks['documents']))
+                for result in sorted_results:
+                    document = documents.get(result.pop('chunk_id')) or ''
+                    result['matched_text'] = document[:300] + "..." if len(document) > 300 else document
             
-            return sorted_results[:n_results]
+            search_cache.put(user_id, cache_scope, query, sorted_results, query_vector)
+            return sorted_results
             
         except Exception as e:
             logging.error(f"Error searching notes: {e}")
@@ -296,9 +583,11 @@ class VectorEmbeddingService:
             # TODO: Fix array comparison issue
             return []
             
+            collection = self._user_collection(user_id)
+            
             # Get embeddings for the reference note
-            note_chunks = self.collection.get(
-                where={"$and": [{"note_id": {"$eq": note_id}}, {"user_id": {"$eq": user_id}}]},
+            note_chunks = collection.get(
+                where={"note_id": {"$eq": note_id}},
                 include=['embeddings', 'metadatas']
             )
             
@@ -310,9 +599,8 @@ class VectorEmbeddingService:
             query_embedding = note_chunks['embeddings'][0]
             
             # Search for similar notes (excluding the reference note)
-            results = self.collection.query(
+            results = collection.query(
                 query_embeddings=[query_embedding],
-                where={"user_id": {"$eq": user_id}},
                 n_results=n_results * 2,  # Get more to filter out the reference note
                 include=['metadatas', 'distances']
             )
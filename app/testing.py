@@ -0,0 +1,54 @@
+"""
+Query-count instrumentation for catching N+1 regressions
+
+Example:
+    with assert_max_queries(QUERY_BUDGETS['chatbot.get_chat_messages']):
+        client.get(f'/chatbot/chat/{chat_id}/messages')
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db
+
+# Maximum statements per request, including the flask-login user lookup, checked by
+# test_query_budgets.py. Lazy loads that grow with the number of rows push a route over its budget.
+QUERY_BUDGETS = {
+    'main.dashboard': 3,
+    'chatbot.chatbot_interface': 5,
+    'chatbot.get_chat_messages': 3,
+    'chatbot.get_note_details': 2,
+    'notes.api_list_notes': 2,
+    'subjects.list_subjects': 2,
+}
+
+@contextmanager
+def count_queries(engine=None):
+    """
+    Record every SQL statement executed on the engine inside the block
+
+    Args:
+        engine: Engine to watch (defaults to the Flask-SQLAlchemy engine)
+
+    Yields:
+        List[str]: Statements executed so far, filled in as the block runs
+    """
+    engine = engine or db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """Fail with the offending statements if the block runs more than limit queries"""
+    with count_queries(engine) as statements:
+        yield statements
+
+    if len(statements) > limit:
+        executed = "\n".join(f"{i}. {statement}" for i, statement in enumerate(statements, 1))
+        raise AssertionError(f"Expected at most {limit} queries, {len(statements)} were executed:\n{executed}")
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import tempfile
+from flask import Request, current_app
+
+# Directories already known to exist, so saving an upload does not stat its folder each time
+_known_dirs = set()
+
+def ensure_dir(path):
+    """Create a directory (and parents) unless it was already created by this process"""
+    if path not in _known_dirs:
+        os.makedirs(path, exist_ok=True)
+        _known_dirs.add(path)
+
+def remove_file(path):
+    """Delete a file if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class _HashingSpoolFile:
+    """Spool file wrapper that hashes the upload while the form parser writes it"""
+
+    def __init__(self, file):
+        self._file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """
+    Request that spools uploaded files into the upload folder instead of the
+    system temp directory, so a saved upload is a rename rather than a copy.
+    Spool files that were not moved are removed when the request closes.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        upload_folder = current_app.config['UPLOAD_FOLDER_ABS']
+        ensure_dir(upload_folder)
+        stream = tempfile.NamedTemporaryFile('wb+', dir=upload_folder, prefix='.upload_', delete=False)
+        self.__dict__.setdefault('_spooled_uploads', []).append(stream.name)
+        return _HashingSpoolFile(stream)
+
+    def close(self):
+        super().close()
+        for path in self.__dict__.pop('_spooled_uploads', []):
+            remove_file(path)
+
+
+def upload_sha256(file):
+    """
+    SHA-256 hex digest of an uploaded file
+
+    Args:
+        file: FileStorage from request.files (before it is moved)
+
+    Returns:
+        str: Digest, taken from the spool file when it was hashed during parsing
+    """
+    digest = getattr(file.stream, 'sha256', None)
+    if digest is not None:
+        return digest.hexdigest()
+
+    digest = hashlib.sha256()
+    position = file.stream.tell()
+    file.stream.seek(0)
+    for chunk in iter(lambda: file.stream.read(65536), b''):
+        digest.update(chunk)
+    file.stream.seek(position)
+    return digest.hexdigest()
+
+
+def move_upload(file, destination):
+    """
+    Store an uploaded file at destination
+
+    Args:
+        file: FileStorage from request.files
+        destination (str): Final path of the file
+    """
+    spool_path = getattr(file.stream, 'name', None)
+    if isinstance(spool_path, str) and os.path.basename(spool_path).startswith('.upload_'):
+        file.stream.close()
+        try:
+            os.replace(spool_path, destination)
+        except FileNotFoundError:
+            # The cached folder was removed behind our back
+            _known_dirs.discard(os.path.dirname(destination))
+            ensure_dir(os.path.dirname(destination))
+            os.replace(spool_path, destination)
+    else:
+        file.save(destination)
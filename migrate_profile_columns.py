@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-from app import create_app, db
+from app import create_app, db, SQLITE_PRAGMAS
+from app.models import UserProfileImage
 import sqlite3
 import os
 
@@ -13,31 +14,98 @@ def migrate_database():
         
         print(f"Database path: {db_path}")
         
-        # Connect directly to SQLite
-        conn = sqlite3.connect(db_path)
+        # Connect directly to SQLite; transactions are opened explicitly below
+        conn = sqlite3.connect(db_path, isolation_level=None)
         cursor = conn.cursor()
         
         try:
+            # Same pragmas as the app's connections (journal_mode must be set outside a transaction)
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(f"PRAGMA {pragma}")
+            
+            # Run every statement below in one write transaction: one commit (and fsync)
+            # for the whole migration instead of one per ALTER TABLE/CREATE INDEX
+            cursor.execute("BEGIN IMMEDIATE")
+            
             # Check if columns exist
             cursor.execute("PRAGMA table_info(user)")
             columns = [column[1] for column in cursor.fetchall()]
             print(f"Existing columns: {columns}")
             
-            # Add profile_image_data column if it doesn't exist
-            if 'profile_image_data' not in columns:
-                print("Adding profile_image_data column...")
-                cursor.execute("ALTER TABLE user ADD COLUMN profile_image_data BLOB")
-                print("profile_image_data column added successfully!")
+            # Move profile image bytes from the legacy user columns into user_profile_image
+            # (the table itself is created by db.create_all() in create_app)
+            if 'profile_image_data' in columns:
+                print("Copying profile images into user_profile_image...")
+                cursor.execute("""
+                    INSERT OR IGNORE INTO user_profile_image (user_id, data, mimetype)
+                    SELECT id, profile_image_data, profile_image_mimetype
+                    FROM user
+                    WHERE profile_image_data IS NOT NULL
+                """)
+                print(f"{cursor.rowcount} profile images copied.")
             else:
-                print("profile_image_data column already exists.")
+                print("No legacy profile image columns found.")
+            
+            # Users whose image only exists on disk get their bytes loaded from the upload folder
+            cursor.execute("""
+                SELECT id, profile_image FROM user
+                WHERE profile_image IS NOT NULL
+                AND id NOT IN (SELECT user_id FROM user_profile_image)
+            """)
+            for user_id, image_path in cursor.fetchall():
+                full_path = os.path.join(app.config['UPLOAD_FOLDER'], image_path)
+                if os.path.exists(full_path):
+                    with open(full_path, 'rb') as f:
+                        cursor.execute(
+                            "INSERT INTO user_profile_image (user_id, data, mimetype) VALUES (?, ?, NULL)",
+                            (user_id, f.read())
+                        )
+                    print(f"Loaded profile image for user {user_id} from {full_path}")
+            
+            # Give every stored image an ETag for conditional requests
+            cursor.execute("PRAGMA table_info(user_profile_image)")
+            if 'etag' not in [column[1] for column in cursor.fetchall()]:
+                print("Adding etag column...")
+                cursor.execute("ALTER TABLE user_profile_image ADD COLUMN etag VARCHAR(32)")
+            cursor.execute("SELECT user_id, data FROM user_profile_image WHERE etag IS NULL")
+            for user_id, data in cursor.fetchall():
+                cursor.execute(
+                    "UPDATE user_profile_image SET etag = ? WHERE user_id = ?",
+                    (UserProfileImage.compute_etag(data), user_id)
+                )
+                print(f"ETag computed for user {user_id}")
+            
+            # Notes remember the digest of their source image so re-uploads are detected
+            cursor.execute("PRAGMA table_info(note)")
+            if 'image_sha256' not in [column[1] for column in cursor.fetchall()]:
+                print("Adding image_sha256 column...")
+                cursor.execute("ALTER TABLE note ADD COLUMN image_sha256 VARCHAR(64)")
+            
+            # Add composite indexes used by the listing queries
+            indexes = [
+                ("ix_note_user_updated", "note", "user_id, updated_at"),
+                ("ix_note_user_subject_updated", "note", "user_id, subject_id, updated_at"),
+                ("ix_note_user_image_sha256", "note", "user_id, image_sha256"),
+                ("ix_subject_user_created_at", "subject", "user_id, created_at"),
+                ("ix_chat_user_updated", "chat", "user_id, updated_at"),
+                ("ix_msg_chat_created", "chat_message", "chat_id, created_at"),
+            ]
+            for index_name, table_name, columns in indexes:
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})")
+                print(f"{index_name} index ensured.")
             
-            # Add profile_image_mimetype column if it doesn't exist
-            if 'profile_image_mimetype' not in columns:
-                print("Adding profile_image_mimetype column...")
-                cursor.execute("ALTER TABLE user ADD COLUMN profile_image_mimetype VARCHAR(100)")
-                print("profile_image_mimetype column added successfully!")
+            # Subject names are unique per user (uq_subject_user_name on the model)
+            cursor.execute("""
+                SELECT user_id, name, COUNT(*) FROM subject
+                GROUP BY user_id, name HAVING COUNT(*) > 1
+            """)
+            duplicates = cursor.fetchall()
+            if duplicates:
+                for user_id, name, count in duplicates:
+                    print(f"User {user_id} has {count} subjects named '{name}'; rename them to add uq_subject_user_name")
             else:
-                print("profile_image_mimetype column already exists.")
+                cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_subject_user_name ON subject (user_id, name)")
+                print("uq_subject_user_name index ensured.")
             
             # Commit changes
             conn.commit()
@@ -1,11 +1,6 @@
 import os
 import logging
 
-# Disable ChromaDB telemetry before any imports
-os.environ["ANONYMIZED_TELEMETRY"] = "False"
-os.environ["CHROMA_TELEMETRY_DISABLED"] = "True" 
-os.environ["POSTHOG_DISABLED"] = "True"
-
 # Completely suppress chromadb telemetry logging
 logging.getLogger('chromadb.telemetry').disabled = True
 logging.getLogger('chromadb.telemetry.product').disabled = True
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Checks that KeywordMatcher finds the same keywords with the Aho-Corasick automaton
+(pyahocorasick) as with the regex alternation used when it is not installed.
+
+Run with: python -m pytest test_keyword_matcher.py
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+from app.services import rag_chatbot
+from app.services.rag_chatbot import KeywordMatcher, SUBJECT_KEYWORDS
+
+KEYWORDS = {
+    keyword: subject_name
+    for subject_name, keywords in SUBJECT_KEYWORDS.items()
+    for keyword in keywords
+}
+KEYWORDS.update({'bio': 'Bio', 'biology': 'Biology', 'logy': 'Logy', 'cell': 'Cell', 'cells': 'Cells'})
+
+TEXTS = [
+    "what is biology",
+    "biology and bio labs study cells",
+    "microbiology of the cell membrane",
+    "physics, chemistry and economics of the market economy",
+    "the mathematics of algebra and calculus",
+    "nothing to see here",
+    "",
+]
+
+def regex_matcher(monkeypatch):
+    """A matcher built as it is when pyahocorasick is not installed"""
+    monkeypatch.setattr(rag_chatbot, 'ahocorasick', None)
+    return KeywordMatcher(KEYWORDS)
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_backends_find_the_same_keywords(monkeypatch, text):
+    pytest.importorskip('ahocorasick')
+    automaton_matcher = KeywordMatcher(KEYWORDS)
+    assert automaton_matcher._automaton is not None
+    assert list(automaton_matcher.find(text)) == list(regex_matcher(monkeypatch).find(text))
+
+def test_longest_keyword_wins(monkeypatch):
+    matcher = regex_matcher(monkeypatch)
+    assert list(matcher.find("biology and bio")) == ['Biology', 'Bio']
+    assert list(matcher.find("cells")) == ['Cells']
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, '-q']))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Checks every route in QUERY_BUDGETS against a seeded database, so an N+1 lazy
+load shows up as a failure instead of a slow page.
+
+Run with: python -m pytest test_query_budgets.py
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+from flask import url_for
+
+from app import create_app, db
+from app.models import User, Subject, Note, Chat, ChatMessage
+from app.testing import QUERY_BUDGETS, assert_max_queries
+
+@pytest.fixture
+def seeded(tmp_path, monkeypatch):
+    """App with one logged-in user owning several subjects, notes and a chat with sourced answers"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'budgets.db'}")
+    monkeypatch.setenv('INKLING_OLLAMA_WARM_UP', 'false')
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        user = User(username='budget', email='budget@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.flush()
+
+        # More rows than a budget allows, so a per-row lazy load cannot stay under it
+        subjects = [Subject(name=f'Subject {i}', user_id=user.id) for i in range(3)]
+        db.session.add_all(subjects)
+        db.session.flush()
+        notes = [Note(title=f'Note {i}', content='Lorem ipsum ' * 30, user_id=user.id,
+                      subject_id=subjects[i % len(subjects)].id) for i in range(8)]
+        db.session.add_all(notes)
+        db.session.flush()
+
+        chat = Chat(user_id=user.id, title='Budget chat')
+        db.session.add(chat)
+        db.session.flush()
+        for i in range(3):
+            db.session.add(ChatMessage(chat_id=chat.id, content=f'Question {i}', is_user=True))
+            db.session.add(ChatMessage(chat_id=chat.id, content=f'Answer {i}', is_user=False,
+                                       sources=[notes[i].id, notes[i + 1].id]))
+        db.session.commit()
+
+        ids = {'user_id': user.id, 'chat_id': chat.id, 'note_id': notes[0].id}
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(ids['user_id'])
+        session['_fresh'] = True
+    return app, client, ids
+
+ROUTE_ARGS = {
+    'chatbot.get_chat_messages': lambda ids: {'chat_id': ids['chat_id']},
+    'chatbot.get_note_details': lambda ids: {'note_id': ids['note_id']},
+}
+
+@pytest.mark.parametrize('endpoint', sorted(QUERY_BUDGETS))
+def test_route_stays_within_query_budget(seeded, endpoint):
+    app, client, ids = seeded
+    with app.test_request_context():
+        url = url_for(endpoint, **ROUTE_ARGS.get(endpoint, lambda ids: {})(ids))
+
+    with app.app_context():
+        with assert_max_queries(QUERY_BUDGETS[endpoint]):
+            response = client.get(url)
+    assert response.status_code == 200, f"{url} returned {response.status_code}"
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, '-q']))